@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import pathlib
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from PIL import Image, __version__ as PIL_VERSION
+from utils import batch, composite, export, img, pipeline
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# ベンチマーク用の元画像 (幅, 高さ, 形式)
+DEFAULT_SOURCES = [
+    (1920, 1080, 'jpg'),  # フルHD (縮小なし)
+    (4000, 3000, 'jpg'),  # 4:3 12MP
+    (6000, 4000, 'jpg'),  # 3:2 24MP
+    (3000, 4000, 'png'),  # 縦長
+    (8000, 2000, 'png'),  # パノラマ (横長)
+]
+STAGES = ('decode', 'resize', 'crop', 'overlay', 'encode')  # overlayは長方形とロゴの合成 (put_overlays)
+RGBA = (0, 110, 79, 200)
+
+
+def make_source(directory: pathlib.Path, width: int, height: int, fmt: str) -> str:
+    """ベンチマーク用の元画像を作る (毎回同じ画像になる)
+
+    Args:
+        directory (pathlib.Path): 保存先のディレクトリ
+        width (int): 幅
+        height (int): 高さ
+        fmt (str): 形式 ('jpg' or 'png')
+
+    Returns:
+        str: 作った画像のパス
+    """
+    # 1枚ごとにディレクトリを分けて，thumbnail.pngが衝突しないようにする
+    directory = directory / f'{width}x{height}_{fmt}'
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'source.{fmt}'
+    if path.is_file():
+        return str(path)
+
+    fractal = Image.effect_mandelbrot((width, height), (-2.2, -1.2, 0.8, 1.2), 64)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (fractal, gradient, gradient.transpose(Image.Transpose.ROTATE_180)))
+    if fmt == 'jpg':
+        image.save(path, quality=90)
+    else:
+        image.save(path)
+    return str(path)
+
+
+
+def peak_rss_mb(children: bool = False) -> float | None:
+    """最大RSS [MB] (取得できない環境ではNone)
+
+    Args:
+        children (bool, optional): 子プロセスの値を取得する. Defaults to False.
+
+    Returns:
+        float | None: 最大RSS [MB]
+    """
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    rss = resource.getrusage(who).ru_maxrss
+    # macOSはbyte，Linuxはkbyte
+    return round(rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024, 1)
+
+
+
+def bench_stages(path: str, repeat: int) -> dict[str, list[float]]:
+    """1枚の元画像について描画の段階ごとの時間を測る (全ての形と色の組み合わせ)
+
+    キャッシュは毎回捨てるので，初回描画と同じ条件の時間になる．
+    デコードとエンコードは描画と同じdecode_sourceとexport.encodeを使う．
+
+    Args:
+        path (str): 元画像のパス
+        repeat (int): 組み合わせごとの繰り返し回数
+
+    Returns:
+        dict[str, list[float]]: 段階ごとの時間 [秒] のリスト
+    """
+    times: dict[str, list[float]] = {stage: [] for stage in STAGES}
+    size = (img.IMG_W, img.IMG_H)
+    for _ in range(repeat):
+        for shape in img.LogoShape:
+            for color in img.LogoColor:
+                img.clear_caches()
+
+                t0 = time.perf_counter()
+                source = img.decode_source(path, size)
+                t1 = time.perf_counter()
+                resized = img.resize(source, 0, size)
+                t2 = time.perf_counter()
+                canvas = img.compose_base(resized, 0, size)
+                t3 = time.perf_counter()
+                canvas = img.put_overlays(canvas, RGBA, color, shape)
+                t4 = time.perf_counter()
+                export.encode(canvas, export.ExportOptions())
+                t5 = time.perf_counter()
+
+                for stage, elapsed in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+                    times[stage].append(elapsed)
+    return times
+
+
+
+def bench_throughput(paths: list[str], count: int, workers: int) -> dict:
+    """generate_thumbnailのスループットを測る
+
+    Args:
+        paths (list[str]): 元画像のパス (足りない分は繰り返して使う)
+        count (int): 生成する枚数
+        workers (int): ワーカープロセス数 (1ならプールを使わない)
+
+    Returns:
+        dict: 枚数，所要時間，images/sec，失敗数
+    """
+    img.clear_caches()
+    jobs = [paths[i % len(paths)] for i in range(count)]
+    summary = batch.run_batch(jobs, batch.RenderOptions(rgba=RGBA), workers)
+    return {
+        'workers': workers,
+        'images': summary.total,
+        'failed': len(summary.failed),
+        'elapsed_s': round(summary.elapsed, 4),
+        'images_per_sec': round(summary.throughput, 3),
+    }
+
+
+
+def bench_pipeline(paths: list[str], count: int) -> dict:
+    """スレッドのパイプライン (pipeline.run_pipeline) のスループットを測る
+
+    Args:
+        paths (list[str]): 元画像のパス (足りない分は繰り返して使う)
+        count (int): 生成する枚数
+
+    Returns:
+        dict: 枚数，所要時間，images/sec，失敗数，段階ごとの利用率
+    """
+    img.clear_caches()
+    jobs = [paths[i % len(paths)] for i in range(count)]
+    summary, stats = pipeline.run_pipeline(jobs, batch.RenderOptions(rgba=RGBA))
+    return {
+        'workers': 'pipeline',
+        'images': summary.total,
+        'failed': len(summary.failed),
+        'elapsed_s': round(summary.elapsed, 4),
+        'images_per_sec': round(summary.throughput, 3),
+        'utilization': {
+            stage.name: round(stage.utilization(stats.elapsed), 3) for stage in stats.stages
+        },
+    }
+
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    """時間のリストを集計する [ms]"""
+    return {
+        'n': len(values),
+        'mean_ms': round(statistics.mean(values) * 1000, 3),
+        'median_ms': round(statistics.median(values) * 1000, 3),
+        'min_ms': round(min(values) * 1000, 3),
+        'max_ms': round(max(values) * 1000, 3),
+    }
+
+
+
+def run(args: argparse.Namespace) -> dict:
+    """ベンチマークを実行する
+
+    Args:
+        args (argparse.Namespace): パース済みの引数
+
+    Returns:
+        dict: 結果 (JSONにできる形)
+    """
+    work_dir = pathlib.Path(args.work_dir or tempfile.mkdtemp(prefix='thumbgen-bench-'))
+    sources = DEFAULT_SOURCES if not args.quick else DEFAULT_SOURCES[:2]
+    results: dict = {
+        'env': {
+            'python': platform.python_version(),
+            'pillow': PIL_VERSION,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'compositor': 'numpy' if composite.AVAILABLE else 'pillow',
+        },
+        'sources': [],
+    }
+
+    paths = []
+    for width, height, fmt in sources:
+        path = make_source(work_dir, width, height, fmt)
+        paths.append(path)
+        times = bench_stages(path, args.repeat)
+        total = [sum(t) for t in zip(*times.values())]
+        results['sources'].append({
+            'size': [width, height],
+            'format': fmt,
+            'stages': {stage: summarize(t) for stage, t in times.items()},
+            'total': summarize(total),
+        })
+    results['peak_rss_mb'] = peak_rss_mb()
+
+    results['throughput'] = [bench_throughput(paths, args.count, 1)]
+    workers = args.workers or os.cpu_count() or 1
+    if workers > 1:
+        results['throughput'].append(bench_throughput(paths, args.count, workers))
+    results['peak_rss_mb_workers'] = peak_rss_mb(children=True)
+    results['throughput'].append(bench_pipeline(paths, args.count))
+    return results
+
+
+
+def print_report(results: dict):
+    """結果を表にして表示する
+
+    Args:
+        results (dict): runの戻り値
+    """
+    env = results['env']
+    print(
+        f"Python {env['python']} / Pillow {env['pillow']} / {env['platform']} / "
+        f"{env['cpu_count']} CPUs / 合成: {env['compositor']}"
+    )
+    header = f"{'source':>16}" + ''.join(f'{s:>9}' for s in STAGES) + f"{'total':>9}"
+    print(header + '  (median ms)')
+    for source in results['sources']:
+        name = f"{source['size'][0]}x{source['size'][1]} {source['format']}"
+        row = ''.join(f"{source['stages'][s]['median_ms']:>9.1f}" for s in STAGES)
+        print(f'{name:>16}{row}{source["total"]["median_ms"]:>9.1f}')
+    for t in results['throughput']:
+        print(
+            f"workers={t['workers']}: {t['images']}枚 {t['elapsed_s']:.2f}秒 "
+            f"({t['images_per_sec']:.2f} images/sec, 失敗 {t['failed']})"
+        )
+        if 'utilization' in t:
+            print('    利用率: ' + ', '.join(f'{k} {v:.0%}' for k, v in t['utilization'].items()))
+    print(f"peak RSS: {results['peak_rss_mb']} MB (workers: {results['peak_rss_mb_workers']} MB)")
+
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='utils.imgの描画のベンチマーク')
+    parser.add_argument('--repeat', type=int, default=1, help='形と色の組み合わせごとの繰り返し回数 (既定: 1)')
+    parser.add_argument('--count', type=int, default=20, help='スループット計測で生成する枚数 (既定: 20)')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='並列計測のワーカー数 (既定: CPUコア数)')
+    parser.add_argument('--quick', action='store_true', help='小さい元画像だけで計測する')
+    parser.add_argument('--work-dir', default=None, help='元画像の保存先 (既定: 一時ディレクトリ)')
+    parser.add_argument('--json', default=None, help='結果をJSONで書き出すパス (-なら標準出力)')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(results)
+        if args.json:
+            pathlib.Path(args.json).write_text(json.dumps(results, indent=2), encoding='utf-8')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
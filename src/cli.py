@@ -0,0 +1,802 @@
+from enum import Enum
+import argparse
+import multiprocessing
+import pathlib
+import sys
+from utils import autocrop, batch, export, img, instrument, manifest, misc, pipeline, render_cache, service, variants, watch
+
+
+def parse_rgba(hex: str, opacity: int) -> tuple[int, int, int, int]:
+    """HEXコードと不透明度(%)からRGBAを作る
+
+    Args:
+        hex (str): HEXコード (先頭の#はあってもよい)
+        opacity (int): 不透明度 (0-100)
+
+    Returns:
+        tuple[int, int, int, int]: RGBAの組
+    """
+    hex = hex.strip().lstrip('#')
+    if len(hex) != 6:
+        raise argparse.ArgumentTypeError(f'HEXコードが不正です: {hex}')
+    try:
+        r, g, b = misc.rgb(hex)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'HEXコードが不正です: {hex}')
+    if not 0 <= opacity <= 100:
+        raise argparse.ArgumentTypeError(f'不透明度が不正です: {opacity}')
+    return (r, g, b, int(opacity / 100.0 * 255))
+
+
+
+def parse_sizes(text: str) -> tuple[tuple[int, int], ...]:
+    """出力する大きさの指定 (1920x1080,1280x720 など．ladderなら既定の組) を読む
+
+    Args:
+        text (str): 大きさの指定
+
+    Returns:
+        tuple[tuple[int, int], ...]: 大きさ (幅, 高さ) の組
+    """
+    if text.strip().lower() == 'ladder':
+        return img.LADDER_SIZES
+    sizes = []
+    for item in text.split(','):
+        try:
+            w, h = (int(v) for v in item.strip().lower().split('x'))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'大きさが不正です: {item}')
+        if w <= 0 or h <= 0:
+            raise argparse.ArgumentTypeError(f'大きさが不正です: {item}')
+        sizes.append((w, h))
+    return tuple(dict.fromkeys(sizes))
+
+
+
+def parse_members(text: str, cls: type[Enum], label: str) -> tuple:
+    """列挙型の名前のリスト (banner,trapezoid など．allならすべて) を読む
+
+    Args:
+        text (str): 名前のリスト (カンマ区切り)
+        cls (type[Enum]): 列挙型
+        label (str): エラーメッセージに使う名前
+
+    Returns:
+        tuple: 列挙型の値 (指定順，重複なし)
+    """
+    if text.strip().lower() == 'all':
+        return tuple(cls)
+    members = []
+    for name in text.split(','):
+        try:
+            members.append(cls[name.strip().upper()])
+        except KeyError:
+            names = ', '.join(m.name.lower() for m in cls)
+            raise argparse.ArgumentTypeError(f'{label}が不正です: {name} ({names} のどれか)')
+    return tuple(dict.fromkeys(members))
+
+
+
+def parse_threads(text: str) -> tuple[int | None, int, int | None]:
+    """パイプラインのスレッド数の指定 (デコード,合成,エンコード) を読む
+
+    Args:
+        text (str): スレッド数の指定 (例: 4,1,8)
+
+    Returns:
+        tuple[int | None, int, int | None]: (デコード, 合成, エンコード) のスレッド数
+    """
+    try:
+        decode, compose, encode = (int(v) for v in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'スレッド数が不正です: {text} (例: 4,1,8)')
+    if min(decode, compose, encode) <= 0:
+        raise argparse.ArgumentTypeError(f'スレッド数が不正です: {text}')
+    return (decode, compose, encode)
+
+
+
+def parse_workers(text: str) -> int:
+    """ワーカー数の指定を読む
+
+    Args:
+        text (str): ワーカー数 (1以上の整数)
+
+    Returns:
+        int: ワーカー数
+    """
+    try:
+        workers = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'ワーカー数が不正です: {text}')
+    if workers <= 0:
+        raise argparse.ArgumentTypeError(f'ワーカー数が不正です: {text} (1以上)')
+    return workers
+
+
+
+def parse_offset(text: str) -> int | None:
+    """オフセットの指定を読む
+
+    Args:
+        text (str): オフセット (整数，またはauto)
+
+    Returns:
+        int | None: オフセット. autoならNone (元画像ごとに推定する)
+    """
+    if text.strip().lower() == 'auto':
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'オフセットが不正です: {text} (整数かauto)')
+
+
+
+def add_style_arguments(parser: argparse.ArgumentParser):
+    """描画パラメータの引数を追加する
+
+    Args:
+        parser (argparse.ArgumentParser): 引数を追加するパーサー
+    """
+    parser.add_argument(
+        '--color', default='006E4F',
+        help='矩形の色のHEXコード (既定: 006E4F)'
+    )
+    parser.add_argument(
+        '--opacity', type=int, default=100,
+        help='矩形の不透明度 %% (既定: 100)'
+    )
+    parser.add_argument(
+        '--offset', type=parse_offset, default=0,
+        help='画像の縦方向のオフセット. 負なら下に，正なら上にずれる. '
+             'autoなら元画像の目立つところが長方形に隠れないように推定する (既定: 0)'
+    )
+    parser.add_argument(
+        '--logo-color', default='white',
+        choices=[c.name.lower() for c in img.LogoColor],
+        help='ロゴの色 (既定: white)'
+    )
+    parser.add_argument(
+        '--logo-shape', default='banner',
+        choices=[s.name.lower() for s in img.LogoShape],
+        help='ロゴの形 (既定: banner)'
+    )
+    parser.add_argument(
+        '--resample', default=img.FINAL_RESAMPLE.name.lower(),
+        choices=[r.name.lower() for r in img.Image.Resampling],
+        help=f'縮小フィルター. bilinearなら速い (既定: {img.FINAL_RESAMPLE.name.lower()})'
+    )
+
+
+
+def add_export_arguments(parser: argparse.ArgumentParser):
+    """保存形式の引数を追加する
+
+    Args:
+        parser (argparse.ArgumentParser): 引数を追加するパーサー
+    """
+    defaults = export.ExportOptions()
+    parser.add_argument(
+        '--format', default='png', type=str.lower, choices=export.format_names(),
+        help='保存形式 (既定: png)'
+    )
+    parser.add_argument(
+        '--png-level', type=int, default=defaults.png_compress_level, choices=range(10),
+        metavar='0-9', help=f'PNGの圧縮レベル. 小さいほど速い (既定: {defaults.png_compress_level})'
+    )
+    parser.add_argument(
+        '--png-strategy', default='default',
+        choices=[s.name.lower() for s in export.PngStrategy],
+        help='PNG(zlib)の圧縮戦略 (既定: default)'
+    )
+    parser.add_argument(
+        '--quality', type=int, default=None,
+        help=f'JPEG/WebPの品質 0-100 (既定: JPEG {defaults.jpeg_quality}, WebP {defaults.webp_quality})'
+    )
+    parser.add_argument(
+        '--progressive', action='store_true',
+        help='プログレッシブJPEGにする'
+    )
+    parser.add_argument(
+        '--subsampling', default=defaults.jpeg_subsampling,
+        choices=['4:4:4', '4:2:2', '4:2:0'],
+        help=f'JPEGの色差サブサンプリング (既定: {defaults.jpeg_subsampling})'
+    )
+    parser.add_argument(
+        '--webp-method', type=int, default=defaults.webp_method, choices=range(7),
+        metavar='0-6', help=f'WebPの圧縮方法. 小さいほど速い (既定: {defaults.webp_method})'
+    )
+
+
+
+def add_output_arguments(parser: argparse.ArgumentParser, sizes: bool = True):
+    """保存先の引数を追加する
+
+    Args:
+        parser (argparse.ArgumentParser): 引数を追加するパーサー
+        sizes (bool, optional): --sizesも追加する. Defaults to True.
+    """
+    parser.add_argument(
+        '-o', '--out-dir', default=None,
+        help='保存先のディレクトリ (既定: 元画像と同じ)'
+    )
+    parser.add_argument(
+        '--name', default='{stem}_thumbnail',
+        help='ファイル名のテンプレート. {stem} {shape} {logo} {color} {offset} {hash} {size} {format} が使える '
+             '(既定: {stem}_thumbnail)'
+    )
+    if not sizes:
+        return
+    parser.add_argument(
+        '--sizes', type=parse_sizes, default=(),
+        help='複数の大きさで出力する (例: 1920x1080,1280x720,640x360．ladderなら左の3つ)．'
+             '元画像のデコードは1回で済む．ファイル名に{size}がなければ最後に付く'
+    )
+
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser):
+    """描画結果のディスクキャッシュの引数を追加する
+
+    Args:
+        parser (argparse.ArgumentParser): 引数を追加するパーサー
+    """
+    parser.add_argument(
+        '--cache-dir', default=None,
+        help='描画結果のキャッシュのディレクトリ. 指定すると入力が前回と同じ画像は描画しない'
+    )
+    parser.add_argument(
+        '--cache-size', type=int, default=render_cache.DEFAULT_MAX_BYTES // (1024 * 1024),
+        help=f'キャッシュの上限 [MB] (既定: {render_cache.DEFAULT_MAX_BYTES // (1024 * 1024)})'
+    )
+    parser.add_argument(
+        '--cache-content-hash', action='store_true',
+        help='元画像を中身のハッシュで識別する (既定: パス，更新時刻，サイズ)'
+    )
+
+
+
+def add_memory_argument(parser: argparse.ArgumentParser):
+    """ワーカーのメモリの上限の引数を追加する
+
+    Args:
+        parser (argparse.ArgumentParser): 追加先のパーサー
+    """
+    parser.add_argument(
+        '--memory-limit', type=int, default=0, metavar='MB',
+        help='ワーカー1つあたりのメモリの上限[MB]. 大きな画像が多いときは同時に処理する枚数を減らす '
+             '(既定: 0 = 制限しない)'
+    )
+
+
+
+def add_trace_arguments(parser: argparse.ArgumentParser):
+    """描画の計測の引数を追加する
+
+    Args:
+        parser (argparse.ArgumentParser): 追加先のパーサー
+    """
+    parser.add_argument(
+        '--trace', default=None, metavar='PATH',
+        help='1枚ごとの段階別の時間 (decode, resize, crop, banner, logo, encode, write) と'
+             'キャッシュのヒット数をJSON Linesで追記する'
+    )
+    parser.add_argument(
+        '--metrics-file', default=None, metavar='PATH',
+        help='計測の集計をPrometheusのテキスト形式で書き出す (node_exporterのtextfile collector向け)'
+    )
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='--traceにcProfileの結果も含める (遅くなる)'
+    )
+    parser.add_argument(
+        '--trace-memory', action='store_true',
+        help='--traceにtracemallocで測ったメモリ確保量の最大値も含める (遅くなる)'
+    )
+
+
+
+def trace_options(args: argparse.Namespace) -> instrument.TraceOptions | None:
+    """引数から計測の送り先を登録して計測の設定を作る
+
+    Args:
+        args (argparse.Namespace): パース済みの引数
+
+    Returns:
+        instrument.TraceOptions | None: 計測の設定. --traceも--metrics-fileもなければNone
+    """
+    return instrument.configure(args.trace, args.metrics_file, args.profile, args.trace_memory)
+
+
+
+def output_policy(args: argparse.Namespace) -> export.OutputPolicy:
+    """引数から保存先の決め方を作る
+
+    Args:
+        args (argparse.Namespace): パース済みの引数
+
+    Returns:
+        export.OutputPolicy: 保存先の決め方
+    """
+    try:
+        return export.OutputPolicy(directory=args.out_dir, template=args.name)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+
+def export_options(args: argparse.Namespace) -> export.ExportOptions:
+    """引数から保存形式の設定を作る
+
+    Args:
+        args (argparse.Namespace): パース済みの引数
+
+    Returns:
+        export.ExportOptions: 保存形式と圧縮の設定
+    """
+    defaults = export.ExportOptions()
+    return export.ExportOptions(
+        format=export.parse_format(args.format),
+        png_compress_level=args.png_level,
+        png_strategy=export.PngStrategy[args.png_strategy.upper()],
+        jpeg_quality=args.quality if args.quality is not None else defaults.jpeg_quality,
+        jpeg_progressive=args.progressive,
+        jpeg_subsampling=args.subsampling,
+        webp_quality=args.quality if args.quality is not None else defaults.webp_quality,
+        webp_method=args.webp_method,
+    )
+
+
+
+def render_options(args: argparse.Namespace) -> batch.RenderOptions:
+    """引数から描画パラメータを作る
+
+    Args:
+        args (argparse.Namespace): パース済みの引数
+
+    Returns:
+        batch.RenderOptions: 描画パラメータ
+    """
+    return batch.RenderOptions(
+        offset=args.offset or 0,
+        auto_offset=args.offset is None,
+        rgba=parse_rgba(args.color, args.opacity),
+        logo_color=img.LogoColor[args.logo_color.upper()],
+        logo_shape=img.LogoShape[args.logo_shape.upper()],
+        export_options=export_options(args),
+        output_policy=output_policy(args),
+        sizes=args.sizes,
+        resample=img.Image.Resampling[args.resample.upper()],
+        cache_dir=args.cache_dir,
+        cache_max_bytes=args.cache_size * 1024 * 1024,
+        cache_content_hash=args.cache_content_hash,
+        trace=trace_options(args),
+    )
+
+
+
+def run_batch(args: argparse.Namespace) -> int:
+    """batchサブコマンド
+
+    Args:
+        args (argparse.Namespace): パース済みの引数
+
+    Returns:
+        int: 終了コード
+    """
+    options = render_options(args)
+    paths, skipped = batch.collect_inputs(args.inputs, options.output_policy)
+    if skipped:
+        print(f'生成済みのサムネイルを{len(skipped)}枚除きました')
+        if not args.quiet:
+            for path in skipped:
+                print(f'  除外: {path}')
+    if not paths:
+        print('対象の画像がありません', file=sys.stderr)
+        return 1
+
+    def on_progress(done: int, total: int, path: str, error: str | None):
+        if error is None:
+            if not args.quiet:
+                print(f'[{done}/{total}] OK {path}')
+        else:
+            print(f'[{done}/{total}] NG {path}: {error}', file=sys.stderr)
+
+    stats = None
+    if args.pipeline:
+        summary, stats = pipeline.run_pipeline(paths, options, args.threads, on_progress)
+    else:
+        summary = batch.run_batch(
+            paths, options, args.workers, args.memory_limit * 1024 * 1024, on_progress
+        )
+
+    print(
+        f'{summary.succeeded}/{summary.total}枚 成功, '
+        f'{len(summary.failed)}枚 失敗, '
+        f'{summary.elapsed:.2f}秒 ({summary.throughput:.2f} images/sec)'
+    )
+    if summary.outputs:
+        print(
+            f'エンコード: 平均 {summary.encode_time / summary.outputs * 1000:.1f}ms, '
+            f'出力: {summary.outputs}ファイル 合計 {summary.output_bytes / 1024 / 1024:.2f}MB '
+            f'(平均 {summary.output_bytes / summary.outputs / 1024:.0f}KB)'
+        )
+    if options.cache_dir is not None:
+        print(f'キャッシュ: {summary.cache_hits}/{summary.total}枚 描画を省略')
+    if stats is not None:
+        for line in stats.report():
+            print(line)
+    for path, error in summary.failed:
+        print(f'  失敗: {path}: {error}', file=sys.stderr)
+    return 0 if not summary.failed else 1
+
+
+
+def run_manifest(args: argparse.Namespace) -> int:
+    """manifestサブコマンド
+
+    Args:
+        args (argparse.Namespace): パース済みの引数
+
+    Returns:
+        int: 終了コード
+    """
+    defaults = render_options(args)
+    manifest_path = pathlib.Path(args.manifest)
+    results = args.results or str(manifest_path.with_name(manifest_path.name + '.results.jsonl'))
+
+    def on_progress(index: int, path: str, error: str | None):
+        if error is None:
+            if not args.quiet:
+                print(f'[{index + 1}] OK {path}')
+        else:
+            print(f'[{index + 1}] NG {path}: {error}', file=sys.stderr)
+
+    summary = manifest.run_manifest(
+        args.manifest, defaults, results, args.workers,
+        args.max_in_flight, args.memory_limit * 1024 * 1024, args.resume, on_progress
+    )
+
+    print(
+        f'{summary.succeeded}/{summary.total}行 成功, '
+        f'{len(summary.failed)}行 失敗, '
+        f'{summary.elapsed:.2f}秒 ({summary.throughput:.2f} images/sec)'
+    )
+    print(f'結果: {results}')
+    return 0 if not summary.failed else 1
+
+
+
+def run_variants(args: argparse.Namespace) -> int:
+    """variantsサブコマンド
+
+    Args:
+        args (argparse.Namespace): パース済みの引数
+
+    Returns:
+        int: 終了コード
+    """
+    shapes = parse_members(args.shapes, img.LogoShape, 'ロゴの形')
+    colors = parse_members(args.logo_colors, img.LogoColor, 'ロゴの色')
+    palette = tuple(dict.fromkeys(
+        parse_rgba(hex, args.opacity) for hex in (args.palette or args.color).split(',')
+    ))
+    grid = variants.variant_grid(shapes, colors, palette)
+    offset = args.offset
+    if offset is None:
+        offset = autocrop.suggest_offset(args.input)
+        print(f'オフセット: {offset} (自動)')
+    result = variants.generate_variants(
+        args.input, offset, grid, export_options(args), output_policy(args),
+        not args.no_sheet, args.columns, img.Image.Resampling[args.resample.upper()]
+    )
+    for variant, output in zip(result.variants, result.outputs):
+        if not args.quiet:
+            print(f'{variant.label}: {output.path}')
+    if result.sheet is not None:
+        print(f'一覧: {result.sheet.path}')
+    print(f'{len(result.outputs)}枚 {result.elapsed:.2f}秒 (デコード1回)')
+    return 0
+
+
+
+def run_serve(args: argparse.Namespace) -> int:
+    """serveサブコマンド
+
+    Args:
+        args (argparse.Namespace): パース済みの引数
+
+    Returns:
+        int: 終了コード
+    """
+    defaults = service.RenderRequest(
+        offset=args.offset or 0,
+        auto_offset=args.offset is None,
+        rgba=parse_rgba(args.color, args.opacity),
+        logo_color=img.LogoColor[args.logo_color.upper()],
+        logo_shape=img.LogoShape[args.logo_shape.upper()],
+        export_options=export_options(args),
+        resample=img.Image.Resampling[args.resample.upper()],
+    )
+    server = service.RenderService(
+        args.host, args.port, args.workers, args.max_queue, defaults,
+        args.root, args.max_body * 1024 * 1024, trace_options(args)
+    )
+    server.start_workers()
+    host, port = server.address
+    print(
+        f'http://{host}:{port}/ で待ち受けています '
+        f'(ワーカー {server.workers}, 待ちの上限 {server.max_queue}). Ctrl+Cで終了'
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+
+def run_watch(args: argparse.Namespace) -> int:
+    """watchサブコマンド
+
+    Args:
+        args (argparse.Namespace): パース済みの引数
+
+    Returns:
+        int: 終了コード
+    """
+    def on_result(result: batch.JobResult, latency: float):
+        if result.error is None:
+            if not args.quiet:
+                outputs = ', '.join(output.path for output in result.outputs)
+                print(f'OK {result.path} -> {outputs} ({latency:.1f}秒)')
+        else:
+            print(f'NG {result.path}: {result.error}', file=sys.stderr)
+
+    try:
+        watcher = watch.FolderWatcher(
+            args.directories, render_options(args), args.workers, args.settle,
+            args.poll, args.interval, args.existing, on_result
+        )
+    except FileNotFoundError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    print(
+        f'{", ".join(watcher.directories)} を監視しています '
+        f'(ワーカー {watcher.workers}). Ctrl+Cで終了'
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    summary = watcher.summary
+    print(
+        f'監視({watcher.mode}) {summary.elapsed:.0f}秒: '
+        f'{summary.succeeded}枚 成功, {len(summary.failed)}枚 失敗'
+    )
+    return 0
+
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """コマンドライン引数のパーサーを作る
+
+    Returns:
+        argparse.ArgumentParser: パーサー
+    """
+    parser = argparse.ArgumentParser(
+        prog='thumbGen', description='thumbGenのコマンドライン版 (GUIなし)'
+    )
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_batch = sub.add_parser('batch', help='複数の画像のサムネイルをまとめて生成する')
+    p_batch.add_argument(
+        'inputs', nargs='+',
+        help='元画像．ディレクトリ，globパターン，マニフェスト(.txt, 1行1パス)も可'
+    )
+    add_style_arguments(p_batch)
+    add_export_arguments(p_batch)
+    add_output_arguments(p_batch)
+    add_cache_arguments(p_batch)
+    p_batch.add_argument(
+        '-j', '--workers', type=parse_workers, default=None,
+        help='ワーカープロセス数 (既定: CPUコア数)'
+    )
+    add_memory_argument(p_batch)
+    add_trace_arguments(p_batch)
+    p_batch.add_argument(
+        '--pipeline', action='store_true',
+        help='プロセスの代わりにスレッドで，デコード・合成・エンコードを重ねて処理する'
+    )
+    p_batch.add_argument(
+        '--threads', type=parse_threads, default=(None, 1, None), metavar='D,C,E',
+        help='--pipelineのデコード,合成,エンコードのスレッド数 (既定: コア数の半分,1,コア数)'
+    )
+    p_batch.add_argument(
+        '-q', '--quiet', action='store_true',
+        help='成功した画像の進捗を表示しない'
+    )
+    p_batch.set_defaults(func=run_batch)
+
+    p_manifest = sub.add_parser(
+        'manifest', help='マニフェスト(JSON Lines/CSV)の行ごとのパラメータでサムネイルを生成する'
+    )
+    p_manifest.add_argument(
+        'manifest',
+        help='マニフェスト. 1行1画像で input, offset, color, opacity, rgba, '
+             'logo_color, logo_shape, output を指定する (input以外は省略可)'
+    )
+    p_manifest.add_argument(
+        '--results', default=None,
+        help='結果のログ(JSON Lines)のパス (既定: マニフェストの名前に.results.jsonlを付けたもの)'
+    )
+    p_manifest.add_argument(
+        '--resume', action='store_true',
+        help='結果のログにある成功した行を飛ばして続きから処理する'
+    )
+    add_style_arguments(p_manifest)
+    add_export_arguments(p_manifest)
+    add_output_arguments(p_manifest)
+    add_cache_arguments(p_manifest)
+    p_manifest.add_argument(
+        '-j', '--workers', type=parse_workers, default=None,
+        help='ワーカープロセス数 (既定: CPUコア数)'
+    )
+    p_manifest.add_argument(
+        '--max-in-flight', type=int, default=None,
+        help='同時に処理する最大の画像数 (既定: ワーカー数の2倍)'
+    )
+    add_memory_argument(p_manifest)
+    add_trace_arguments(p_manifest)
+    p_manifest.add_argument(
+        '-q', '--quiet', action='store_true',
+        help='成功した行の進捗を表示しない'
+    )
+    p_manifest.set_defaults(func=run_manifest)
+
+    p_variants = sub.add_parser(
+        'variants', help='1枚の元画像から，形・ロゴの色・長方形の色の組み合わせをまとめて生成する',
+        description='元画像のデコードと切り取りは1回だけ行い，組み合わせごとに長方形とロゴを重ねる. '
+                    'それぞれのサムネイルと，縮小して並べた一覧(*_variants)を保存する'
+    )
+    p_variants.add_argument('input', help='元画像')
+    p_variants.add_argument(
+        '--shapes', default='all',
+        help='ロゴの形 (カンマ区切り．既定: all = '
+             + ','.join(s.name.lower() for s in img.LogoShape) + ')'
+    )
+    p_variants.add_argument(
+        '--logo-colors', default='all',
+        help='ロゴの色 (カンマ区切り．既定: all = '
+             + ','.join(c.name.lower() for c in img.LogoColor) + ')'
+    )
+    p_variants.add_argument(
+        '--palette', default=None,
+        help='長方形の色のHEXコード (カンマ区切り．例: 006E4F,C0392B．既定: --color)'
+    )
+    p_variants.add_argument(
+        '--color', default='006E4F',
+        help='--paletteを省略したときの長方形の色 (既定: 006E4F)'
+    )
+    p_variants.add_argument(
+        '--opacity', type=int, default=100,
+        help='長方形の不透明度 %% (既定: 100)'
+    )
+    p_variants.add_argument(
+        '--offset', type=parse_offset, default=0,
+        help='画像の縦方向のオフセット. 負なら下に，正なら上にずれる. '
+             'autoなら元画像の目立つところが長方形に隠れないように推定する (既定: 0)'
+    )
+    p_variants.add_argument(
+        '--resample', default=img.FINAL_RESAMPLE.name.lower(),
+        choices=[r.name.lower() for r in img.Image.Resampling],
+        help=f'縮小フィルター (既定: {img.FINAL_RESAMPLE.name.lower()})'
+    )
+    add_export_arguments(p_variants)
+    add_output_arguments(p_variants, sizes=False)
+    p_variants.add_argument(
+        '--columns', type=int, default=None,
+        help='一覧の列の数 (既定: 正方形に近くなる数)'
+    )
+    p_variants.add_argument(
+        '--no-sheet', action='store_true',
+        help='一覧を保存しない'
+    )
+    p_variants.add_argument(
+        '-q', '--quiet', action='store_true',
+        help='保存したファイルを1つずつ表示しない'
+    )
+    p_variants.set_defaults(func=run_variants)
+
+    p_serve = sub.add_parser(
+        'serve', help='サムネイルを描画するローカルHTTPサービスを起動する',
+        description='POST /render (本文に元画像), GET /render?path=..., GET /metrics, GET /healthz. '
+                    'クエリで offset (autoで自動), color, opacity, logo_color, logo_shape, width, height, '
+                    'format, quality を指定できる (省略時は下の引数の値)'
+    )
+    p_serve.add_argument(
+        '--host', default=service.DEFAULT_HOST,
+        help=f'待ち受けるアドレス (既定: {service.DEFAULT_HOST})'
+    )
+    p_serve.add_argument(
+        '--port', type=int, default=service.DEFAULT_PORT,
+        help=f'待ち受けるポート (既定: {service.DEFAULT_PORT})'
+    )
+    p_serve.add_argument(
+        '-j', '--workers', type=parse_workers, default=None,
+        help='ワーカープロセス数 (既定: CPUコア数)'
+    )
+    p_serve.add_argument(
+        '--max-queue', type=int, default=None,
+        help='処理中と待ちの要求の上限．超えると503を返す (既定: ワーカー数の4倍)'
+    )
+    p_serve.add_argument(
+        '--root', action='append', default=None,
+        help='GET /render?path= で読める元画像のフォルダ (複数指定可．既定: パス指定は無効)'
+    )
+    p_serve.add_argument(
+        '--max-body', type=int, default=service.DEFAULT_MAX_BODY // (1024 * 1024),
+        help=f'送られてくる元画像の上限 [MB] (既定: {service.DEFAULT_MAX_BODY // (1024 * 1024)})'
+    )
+    add_style_arguments(p_serve)
+    add_export_arguments(p_serve)
+    add_trace_arguments(p_serve)
+    p_serve.set_defaults(func=run_serve)
+
+    p_watch = sub.add_parser(
+        'watch', help='フォルダを監視して，追加・更新された画像のサムネイルを生成し続ける',
+        description='書き込みが終わった(大きさと更新時刻が落ち着いた)画像から順にワーカープロセスで生成する. '
+                    f'フォルダに{watch.STYLE_FILE}があれば，そのフォルダの画像は'
+                    'その描画パラメータ (マニフェストと同じキー) で生成する'
+    )
+    p_watch.add_argument('directories', nargs='+', help='監視するフォルダ (直下の画像のみ)')
+    add_style_arguments(p_watch)
+    add_export_arguments(p_watch)
+    add_output_arguments(p_watch)
+    add_cache_arguments(p_watch)
+    p_watch.add_argument(
+        '-j', '--workers', type=parse_workers, default=None,
+        help='ワーカープロセス数 (既定: CPUコア数)'
+    )
+    p_watch.add_argument(
+        '--settle', type=float, default=watch.DEFAULT_SETTLE,
+        help=f'大きさと更新時刻がこの秒数変わらなければ書き込みが終わったとみなす (既定: {watch.DEFAULT_SETTLE})'
+    )
+    p_watch.add_argument(
+        '--poll', action='store_true',
+        help='inotifyを使わずにフォルダを走査する (ネットワーク共有では必要．Linux以外では常にこちら)'
+    )
+    p_watch.add_argument(
+        '--interval', type=float, default=watch.DEFAULT_INTERVAL,
+        help=f'走査の間隔 [秒] (既定: {watch.DEFAULT_INTERVAL})'
+    )
+    p_watch.add_argument(
+        '--existing', action='store_true',
+        help='監視を始めたときにある画像も生成する'
+    )
+    add_trace_arguments(p_watch)
+    p_watch.add_argument(
+        '-q', '--quiet', action='store_true',
+        help='成功した画像を表示しない'
+    )
+    p_watch.set_defaults(func=run_watch)
+
+    return parser
+
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        return args.func(args)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    finally:
+        instrument.close_sinks()
+    return 2
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
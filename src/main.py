@@ -1,13 +1,33 @@
-from PySide6.QtWidgets import QApplication
+from utils import startup  # 起動時間の基準になるので最初に読み込む
 import sys
-from utils import gui
+
 
 def main():
+    report = startup.StartupReport.from_env()
+    # 起動時間を計測するために，重いモジュールはここで読み込む
+    from PySide6.QtWidgets import QApplication
+    report.mark('import PySide6')
+    from utils import gui, instrument
+    report.mark('import utils.gui')
+
     print('Welcome to thumbGen!')
+    # THUMBGEN_TRACE などが設定されていれば描画を計測する
+    instrument.configure_from_env()
     app = QApplication([])
+    report.mark('QApplication')
     window = gui.MainWindow()
+    report.mark('MainWindow')
     window.show()
-    sys.exit(app.exec())
+
+    def on_first_paint():
+        report.finish()
+        # 描画に使うモジュール (Pillow, NumPy) は表示してから読み込む
+        startup.preload()
+
+    startup.on_first_paint(window, on_first_paint)
+    code = app.exec()
+    instrument.close_sinks()
+    sys.exit(code)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,116 @@
+from PIL import Image, ImageFilter
+from typing import IO
+from utils import img
+import itertools
+
+ANALYSIS_SIZE = img.PREVIEW_SIZE  # 解析する大きさ (プレビューと同じなのでデコード結果を共有できる)
+CENTER_WEIGHT = 1e-3  # 中央寄りを優先する強さ (目立つところがない画像では中央を切り取る)
+ESTIMATE_VERSION = 1  # 推定の結果が変わる修正をしたら上げる (キャッシュした推定値を無効にする)
+
+
+def row_saliency(image: Image.Image) -> list[float]:
+    """行ごとの目立ち具合 (輪郭の強さの平均) を取得する
+
+    輪郭抽出と行ごとの平均はPillow (C実装) で行うので，Pythonでは画素を1つずつ触らない．
+
+    Args:
+        image (Image.Image): 解析する画像
+
+    Returns:
+        list[float]: 上の行から順の目立ち具合 (0〜255)
+    """
+    w, h = image.size
+    if w < 3 or h < 3:
+        return [0.0] * h
+    edges = image.convert('L').filter(ImageFilter.FIND_EDGES)
+    # 端の1画素はフィルターがかからず元の明るさが残るので除く
+    edges = edges.crop((1, 1, w - 1, h - 1)).convert('F')
+    profile = edges.resize((1, h - 2), Image.Resampling.BOX)
+    return [0.0, *profile.getdata(), 0.0]
+
+
+
+def best_top(scores: list[float], window: int, visible: int) -> int:
+    """見える範囲の目立ち具合の合計が最大になる切り取り範囲の上端を探す
+
+    Args:
+        scores (list[float]): 行ごとの目立ち具合 (row_saliency)
+        window (int): 切り取る高さ
+        visible (int): 切り取る範囲のうち長方形に隠れない上からの高さ
+
+    Returns:
+        int: 上端のy座標 (0〜len(scores) - window)
+    """
+    last = max(len(scores) - window, 0)
+    if last == 0:
+        return 0
+    sums = [0.0, *itertools.accumulate(scores)]
+    total = sums[-1] or 1.0
+    center = last / 2
+    return max(
+        range(last + 1),
+        key=lambda top: (sums[top + visible] - sums[top]) / total
+        - CENTER_WEIGHT * abs(top - center) / last
+    )
+
+
+
+def analysis_size(size: tuple[int, int]) -> tuple[int, int]:
+    """解析する大きさ (描画する大きさと同じ縦横比で，高さがANALYSIS_SIZEと同じ)
+
+    Args:
+        size (tuple[int, int]): 描画する大きさ
+
+    Returns:
+        tuple[int, int]: 解析する大きさ
+    """
+    h = ANALYSIS_SIZE[1]
+    return (max(round(size[0] * h / size[1]), 1), h)
+
+
+
+def estimate_offset(source: Image.Image, size: tuple[int, int] = (img.IMG_W, img.IMG_H)) -> int:
+    """デコード済みの元画像から，目立つところが長方形に隠れずに収まるオフセットを推定する
+
+    縮小した元画像の輪郭の強さを行ごとに集計し，切り取ったときに長方形の帯より上に
+    入る量が最大になる位置を選ぶ．
+
+    Args:
+        source (Image.Image): 元画像 (大きさは問わない)
+        size (tuple[int, int], optional): 描画する大きさ. Defaults to (img.IMG_W, img.IMG_H).
+
+    Returns:
+        int: オフセット (フルHDでの値. 0〜元画像の余り×2)
+    """
+    size = analysis_size(size)
+    cover = img.cover_size(source.size, size)
+    if source.size != cover:
+        source = source.resize(cover, img.PREVIEW_RESAMPLE, reducing_gap=2.0)
+
+    window = size[1]
+    visible = round(window * (img.IMG_H - img.BANNER_H) / img.IMG_H)
+    top = best_top(row_saliency(source), window, visible)
+    # crop_topの逆 (オフセットはフルHDでの値で，上端はその半分だけ下がる)
+    limit = 2 * ((cover[1] - window) * img.IMG_H // window)
+    return min(2 * round(top * img.IMG_H / window), limit)
+
+
+
+def suggest_offset(
+        input_path: str | IO[bytes], size: tuple[int, int] = (img.IMG_W, img.IMG_H)) -> int:
+    """元画像の目立つところが長方形に隠れずに収まるオフセットを推定する
+
+    パスを渡した場合はsource_cacheを使うので，プレビューを描画済みならデコードし直さない．
+
+    Args:
+        input_path (str | IO[bytes]): 元画像のパス (または開いたファイル)
+        size (tuple[int, int], optional): 描画する大きさ. Defaults to (img.IMG_W, img.IMG_H).
+
+    Returns:
+        int: オフセット (フルHDでの値. 0〜元画像の余り×2)
+    """
+    if isinstance(input_path, str):
+        source = img.load_source(input_path, analysis_size(size), img.PREVIEW_RESAMPLE)
+    else:
+        source = img.decode_source(input_path, analysis_size(size))
+    return estimate_offset(source, size)
@@ -0,0 +1,407 @@
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field, replace
+from typing import Callable, Iterable, TypeVar
+from utils import autocrop, export, img, instrument, render_cache
+import glob
+import os
+import pathlib
+import time
+
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.bmp')
+# サムネイルのファイル名の形とロゴの色 (実際の名前だけに一致させる)
+OUTPUT_TOKEN_PATTERNS = {
+    'shape': '|'.join(shape.name.lower() for shape in img.LogoShape),
+    'logo': '|'.join(color.name.lower() for color in img.LogoColor),
+}
+# 既定の保存先 (並列に保存しても同じファイルに書かないように元画像ごとの名前にする)
+OUTPUT_POLICY = export.OutputPolicy(template='{stem}_thumbnail')
+
+T = TypeVar('T')
+
+
+@dataclass(frozen=True)
+class RenderOptions:
+    """サムネイル1枚分の描画パラメータ"""
+    offset: int = 0
+    auto_offset: bool = False  # offsetの代わりに元画像ごとに推定した値を使う (autocrop.suggest_offset)
+    rgba: tuple[int, int, int, int] = (0, 110, 79, 255)
+    logo_color: img.LogoColor = img.LogoColor.WHITE
+    logo_shape: img.LogoShape = img.LogoShape.BANNER
+    export_options: export.ExportOptions = export.ExportOptions()
+    output_policy: export.OutputPolicy = OUTPUT_POLICY
+    sizes: tuple[tuple[int, int], ...] = ()  # 複数の大きさで出力する場合はその大きさ. 空ならフルHDの1枚
+    resample: img.Image.Resampling = img.FINAL_RESAMPLE  # 縮小フィルター
+    cache_dir: str | None = None  # 描画結果のディスクキャッシュ. Noneなら使わない
+    cache_max_bytes: int = render_cache.DEFAULT_MAX_BYTES
+    cache_content_hash: bool = False  # 元画像を中身のハッシュで識別する
+    trace: instrument.TraceOptions | None = None  # 段階ごとの時間を計測する. Noneなら計測しない
+
+
+@dataclass
+class JobResult:
+    """1枚分の処理結果"""
+    path: str
+    elapsed: float  # 所要時間 [秒]
+    error: str | None = None  # 失敗した場合はその内容
+    outputs: list[export.ExportResult] = field(default_factory=list)  # 成功した場合は保存の結果
+    cached: bool = False  # すべてディスクキャッシュから取り出した場合はTrue
+    trace: instrument.RenderTrace | None = None  # 計測した場合はその結果
+
+
+@dataclass
+class BatchSummary:
+    """バッチ処理の結果"""
+    total: int = 0
+    succeeded: int = 0
+    failed: list[tuple[str, str]] = field(default_factory=list)
+    elapsed: float = 0.0
+    encode_time: float = 0.0  # エンコード時間の合計 [秒]
+    outputs: int = 0  # 出力したファイルの数
+    output_bytes: int = 0  # 出力サイズの合計 [byte]
+    cache_hits: int = 0  # ディスクキャッシュから取り出した枚数
+
+    @property
+    def throughput(self) -> float:
+        """1秒あたりに処理した画像の枚数"""
+        if self.elapsed <= 0:
+            return 0.0
+        return (self.succeeded + len(self.failed)) / self.elapsed
+
+
+
+def collect_inputs(
+        sources: Iterable[str], output_policy: export.OutputPolicy | None = None
+        ) -> tuple[list[str], list[str]]:
+    """入力の指定から画像ファイルのパスの一覧を作る
+
+    指定はディレクトリ(直下の画像)，globパターン，マニフェスト(.txt, 1行1パス)，
+    画像ファイルのいずれか．ディレクトリとglobパターンでは，output_policyで
+    保存したサムネイルを除く (ファイルやマニフェストで直接指定したものは除かない)．
+
+    Args:
+        sources (Iterable[str]): 入力の指定
+        output_policy (export.OutputPolicy | None, optional): サムネイルの保存先の決め方.
+            Defaults to None.
+
+    Returns:
+        tuple[list[str], list[str]]: (画像ファイルのパス, 除いたサムネイルのパス) (どちらも指定順，重複なし)
+    """
+    output_policy = output_policy or OUTPUT_POLICY
+    paths: list[str] = []
+    skipped: list[str] = []
+
+    def accept(path: pathlib.Path) -> bool:
+        if path.suffix.lower() not in IMAGE_SUFFIXES:
+            return False
+        if is_generated(path, output_policy):
+            skipped.append(str(path))
+            return False
+        return True
+
+    for source in sources:
+        path = pathlib.Path(source)
+        if path.is_dir():
+            found = sorted(
+                str(p) for p in path.iterdir()
+                if p.is_file() and accept(p)
+            )
+        elif path.is_file() and path.suffix.lower() == '.txt':
+            lines = path.read_text(encoding='utf-8').splitlines()
+            found = [
+                line.strip() for line in lines
+                if line.strip() and not line.lstrip().startswith('#')
+            ]
+        elif path.is_file():
+            found = [str(path)]
+        else:
+            found = sorted(
+                p for p in glob.glob(source, recursive=True)
+                if accept(pathlib.Path(p))
+            )
+        paths.extend(found)
+    return list(dict.fromkeys(paths)), list(dict.fromkeys(skipped))
+
+
+
+def is_source_image(path: pathlib.Path, output_policy: export.OutputPolicy | None = None) -> bool:
+    """元画像として扱うファイルか (output_policyで保存したサムネイルは除く)"""
+    return (
+        path.suffix.lower() in IMAGE_SUFFIXES
+        and not is_generated(path, output_policy or OUTPUT_POLICY)
+    )
+
+
+
+def is_generated(path: pathlib.Path, output_policy: export.OutputPolicy) -> bool:
+    """output_policyで保存したサムネイルか
+
+    ファイル名がテンプレートに一致するものを除く．保存先のフォルダが決まっていれば
+    そのフォルダのファイルだけを，テンプレートに{stem}があり元画像と同じフォルダに
+    保存する場合はその名前の元画像があるものだけを対象にする
+    (product_thumbnail.jpgなどの元画像を誤って除かないため)．
+
+    Args:
+        path (pathlib.Path): ファイルのパス
+        output_policy (export.OutputPolicy): サムネイルの保存先の決め方
+
+    Returns:
+        bool: 保存したサムネイルならTrue
+    """
+    directory = output_policy.directory
+    if directory is not None and path.parent.resolve() != pathlib.Path(directory).resolve():
+        return False
+    match = output_policy.name_pattern(OUTPUT_TOKEN_PATTERNS).fullmatch(path.stem)
+    if match is None:
+        return False
+    stem = match.groupdict().get('stem')
+    if stem is None or directory is not None:
+        return True
+    return any(
+        path.with_name(stem + ext).is_file()
+        for suffix in IMAGE_SUFFIXES for ext in (suffix, suffix.upper())
+    )
+
+
+
+def init_worker():
+    """ワーカープロセスの初期化
+
+    バッチでは同じ画像を2回描画しないので，元画像と途中結果のキャッシュは使わない．
+    """
+    img.source_cache.max_bytes = 0
+    img.stage_cache.max_bytes = 0
+
+
+
+def estimate_memory(path: str, options: RenderOptions) -> int:
+    """1枚の処理に必要なメモリのおおよその量
+
+    Args:
+        path (str): 元画像のパス
+        options (RenderOptions): 描画パラメータ
+
+    Returns:
+        int: 見積もり [byte]. 読めない画像は0 (処理するとエラーになる)
+    """
+    if options.sizes:
+        size = img.ladder_master_size(tuple(tuple(size) for size in options.sizes))
+    else:
+        size = (img.IMG_W, img.IMG_H)
+    try:
+        return img.estimate_memory(path, size)
+    except Exception:
+        return 0
+
+
+
+def schedule(
+        executor: Executor, jobs: Iterable[T],
+        submit: Callable[[Executor, T], Future],
+        on_done: Callable[[T, Future], None],
+        max_in_flight: int, memory_budget: int = 0,
+        cost: Callable[[T], int] | None = None):
+    """ジョブを少しずつプールに投入する
+
+    同時に処理するのはmax_in_flight件まで．memory_budgetを指定すると，
+    処理中のジョブのcostの合計がそれを超えないように，どれかが終わるまで次を投入しない．
+    (1件だけで予算を超えるジョブは，ほかに処理中のジョブがなければ投入する)
+    jobsはどれかが終わるまで次を取り出さないので，一覧全体を先に作らなくてよい．
+
+    Args:
+        executor (Executor): プール
+        jobs (Iterable[T]): ジョブ
+        submit (Callable[[Executor, T], Future]): ジョブを投入する関数
+        on_done (Callable[[T, Future], None]): ジョブが終わるごとに呼ばれる
+        max_in_flight (int): 同時に処理する最大の件数
+        memory_budget (int, optional): 処理中のジョブのメモリの合計の上限 [byte]. 0なら制限しない.
+        cost (Callable[[T], int] | None, optional): ジョブのメモリの見積もり [byte]. Defaults to None.
+    """
+    max_in_flight = max(max_in_flight, 1)
+    in_flight: dict[Future, tuple[T, int]] = {}
+    used = 0
+
+    def collect():
+        nonlocal used
+        finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in finished:
+            job, job_cost = in_flight.pop(future)
+            used -= job_cost
+            on_done(job, future)
+
+    for job in jobs:
+        job_cost = cost(job) if memory_budget > 0 and cost is not None else 0
+        while in_flight and (
+                len(in_flight) >= max_in_flight or used + job_cost > memory_budget > 0):
+            collect()
+        in_flight[submit(executor, job)] = (job, job_cost)
+        used += job_cost
+    while in_flight:
+        collect()
+
+
+
+def render_one(path: str, options: RenderOptions) -> JobResult:
+    """1枚のサムネイルを生成する (ワーカープロセスで実行される)
+
+    Args:
+        path (str): 元画像のパス
+        options (RenderOptions): 描画パラメータ
+
+    Returns:
+        JobResult: 処理結果 (options.traceを指定した場合は計測結果も入る)
+    """
+    if options.trace is None:
+        return _render_one(path, options)
+    with instrument.trace(path, options.trace) as trace:
+        result = _render_one(path, options)
+    trace.error = result.error
+    result.trace = trace
+    return result
+
+
+
+def resolve_offset(
+        path: str, options: RenderOptions, cache: render_cache.RenderCache | None = None
+        ) -> tuple[int, img.Image.Image | None]:
+    """元画像に使うオフセットを取得する
+
+    options.auto_offsetなら元画像を描画する大きさでデコードして推定し，
+    デコードした元画像も返す (描画に使い回して，デコードを1回で済ませる)．
+    キャッシュに推定済みの値があればデコードしない (描画結果もキャッシュにあればデコードが要らない)．
+
+    Args:
+        path (str): 元画像のパス
+        options (RenderOptions): 描画パラメータ
+        cache (render_cache.RenderCache | None, optional): 描画結果のキャッシュ. Defaults to None.
+
+    Returns:
+        tuple[int, img.Image.Image | None]: (オフセット, デコードした元画像 (デコードしなければNone))
+    """
+    if not options.auto_offset:
+        return options.offset, None
+    sizes = tuple(tuple(size) for size in options.sizes) or ((img.IMG_W, img.IMG_H),)
+    master_size = img.ladder_master_size(sizes)
+    key = None
+    if cache is not None:
+        key = cache.offset_key(path, master_size)
+        offset = cache.fetch_offset(key)
+        if offset is not None:
+            return offset, None
+    source = img.decode_source(path, master_size)
+    offset = autocrop.estimate_offset(source)
+    if cache is not None:
+        cache.store_offset(key, offset)
+    return offset, source
+
+
+
+def _render_one(path: str, options: RenderOptions) -> JobResult:
+    """render_oneの本体 (計測はしない)"""
+    start = time.perf_counter()
+    cached = False
+    try:
+        cache = None
+        if options.cache_dir is not None:
+            cache = render_cache.open_cache(
+                options.cache_dir, options.cache_max_bytes,
+                options.cache_content_hash
+            )
+        offset, source = resolve_offset(path, options, cache)
+        options = replace(options, offset=offset, auto_offset=False)
+        if options.sizes:
+            if cache is None:
+                outputs = img.generate_ladder(
+                    path, options.offset, options.rgba,
+                    options.logo_color, options.logo_shape, options.sizes,
+                    options.export_options, options.output_policy, options.resample, source
+                )
+            else:
+                outputs, hits = render_cache.generate_ladder_cached(
+                    cache, path, options.offset, options.rgba,
+                    options.logo_color, options.logo_shape, options.sizes,
+                    options.export_options, options.output_policy, options.resample, source
+                )
+                cached = hits == len(outputs)
+        elif cache is None:
+            outputs = [img.generate_thumbnail(
+                path, options.offset, options.rgba,
+                options.logo_color, options.logo_shape,
+                options.export_options, options.output_policy, options.resample, source
+            )]
+        else:
+            output, cached = render_cache.generate_cached(
+                cache, path, options.offset, options.rgba,
+                options.logo_color, options.logo_shape,
+                options.export_options, options.output_policy, options.resample, source
+            )
+            outputs = [output]
+    except Exception as e:
+        return JobResult(path, time.perf_counter() - start, f'{type(e).__name__}: {e}')
+    return JobResult(path, time.perf_counter() - start, outputs=outputs, cached=cached)
+
+
+
+def run_batch(
+        paths: list[str], options: RenderOptions,
+        workers: int | None = None, memory_limit: int = 0,
+        on_progress: Callable[[int, int, str, str | None], None] | None = None
+        ) -> BatchSummary:
+    """複数の画像のサムネイルをプロセスプールで並列に生成する
+
+    Args:
+        paths (list[str]): 元画像のパス
+        options (RenderOptions): 描画パラメータ
+        workers (int | None, optional): ワーカー数. Noneならコア数. 1ならプールを使わない.
+        memory_limit (int, optional): ワーカー1つあたりのメモリの上限 [byte].
+            処理中の画像の見積もりの合計がmemory_limit×ワーカー数を超えないように投入する.
+            0なら制限しない. Defaults to 0.
+        on_progress (Callable | None, optional): 1枚終わるごとに
+            (完了数, 全体数, パス, エラー内容 or None) で呼ばれる. Defaults to None.
+
+    Returns:
+        BatchSummary: 処理結果
+    """
+    summary = BatchSummary(total=len(paths))
+    workers = max(workers or os.cpu_count() or 1, 1)
+    start = time.perf_counter()
+
+    def record(result: JobResult):
+        if result.error is None:
+            summary.succeeded += 1
+        else:
+            summary.failed.append((result.path, result.error))
+        for output in result.outputs:
+            summary.encode_time += output.encode_time
+            summary.outputs += 1
+            summary.output_bytes += output.nbytes
+        if result.cached:
+            summary.cache_hits += 1
+        instrument.emit(result.trace)
+        if on_progress is not None:
+            done = summary.succeeded + len(summary.failed)
+            on_progress(done, summary.total, result.path, result.error)
+
+    if workers == 1 or len(paths) <= 1:
+        for path in paths:
+            record(render_one(path, options))
+    else:
+        with ProcessPoolExecutor(
+                max_workers=workers, initializer=init_worker
+                ) as executor:
+            def on_done(path: str, future: Future):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # ワーカープロセス自体が落ちた場合
+                    result = JobResult(path, 0.0, f'{type(e).__name__}: {e}')
+                record(result)
+
+            schedule(
+                executor, paths,
+                lambda executor, path: executor.submit(render_one, path, options),
+                on_done, workers * 2, memory_limit * workers,
+                lambda path: estimate_memory(path, options)
+            )
+
+    summary.elapsed = time.perf_counter() - start
+    return summary
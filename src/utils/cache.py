@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+import threading
+
+
+class LRUCache:
+    """メモリ量の上限付きLRUキャッシュ (スレッドセーフ)"""
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int]):
+        """初期化関数
+
+        Args:
+            max_bytes (int): 保持する値の合計サイズの上限 [byte]
+            sizeof (Callable[[Any], int]): 値のサイズ [byte] を求める関数
+        """
+        self.max_bytes = max_bytes
+        self.__sizeof = sizeof
+        self.__items: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self.__lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get(self, key: Hashable) -> Any | None:
+        """値を取得する
+
+        Args:
+            key (Hashable): キー
+
+        Returns:
+            Any | None: キャッシュされた値. なければNone.
+        """
+        with self.__lock:
+            item = self.__items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self.__items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+
+    def put(self, key: Hashable, value: Any):
+        """値を登録する. 上限を超えた分は古いものから捨てる.
+
+        Args:
+            key (Hashable): キー
+            value (Any): 値 (上限より大きい値は登録しない)
+        """
+        nbytes = self.__sizeof(value)
+        if nbytes > self.max_bytes:
+            return
+        with self.__lock:
+            old = self.__items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self.__items[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted) = self.__items.popitem(last=False)
+                self.current_bytes -= evicted
+                self.evictions += 1
+
+
+    def clear(self):
+        """すべての値を捨てる (カウンタはそのまま)"""
+        with self.__lock:
+            self.__items.clear()
+            self.current_bytes = 0
+
+
+    def __len__(self) -> int:
+        return len(self.__items)
+
+
+    def stats(self) -> dict[str, int]:
+        """統計情報を取得する
+
+        Returns:
+            dict[str, int]: 件数，使用量，ヒット数，ミス数，破棄数
+        """
+        with self.__lock:
+            return {
+                'items': len(self.__items),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,99 @@
+from PIL import Image
+import importlib.util
+
+# NumPyで合成できるか (なければimg.put_overlaysはPillowで合成する)
+# NumPyは読み込みに時間がかかるので，ここでは有無だけを調べて初めて合成するときに読み込む
+AVAILABLE = importlib.util.find_spec('numpy') is not None
+
+
+def _numpy():
+    """NumPyを読み込む (2回目以降は読み込み済みのものを返す)"""
+    import numpy
+    return numpy
+
+
+
+class Layer:
+    """下地に重ねる画像 (長方形の帯やロゴ) をNumPyで合成するために前計算したもの
+
+    不透明度が0でない部分の外接矩形だけを持ち，合成もその範囲だけで行う．
+    色はあらかじめ不透明度を掛けておくので，合成は1画素あたり掛け算1回と足し算1回で済む．
+    """
+    def __init__(self, overlay: Image.Image):
+        """初期化関数
+
+        Args:
+            overlay (Image.Image): 重ねる画像 (RGBA)
+        """
+        if overlay.mode != 'RGBA':
+            overlay = overlay.convert('RGBA')
+        bbox = overlay.getchannel('A').getbbox()
+        if bbox is None:
+            # 完全に透明
+            bbox = (0, 0, 0, 0)
+        np = _numpy()
+        self.offset = bbox[:2]  # 重ねる画像の中での外接矩形の左上
+        region = np.asarray(overlay.crop(bbox), dtype=np.uint16)
+        alpha = region[..., 3:]
+        # out = (色 * a + 下地 * (255 - a) + 127) // 255 (最大 255 * 255 + 127 なのでuint16に収まる)
+        self.premultiplied = region[..., :3] * alpha + 127
+        self.inverse_alpha = 255 - alpha
+
+
+    @property
+    def nbytes(self) -> int:
+        """前計算した配列のメモリ量 [byte]"""
+        return self.premultiplied.nbytes + self.inverse_alpha.nbytes
+
+
+    def blend(self, frame: 'np.ndarray', position: tuple[int, int]):
+        """下地に重ねる (frameを書き換える)
+
+        Args:
+            frame (np.ndarray): 下地 (高さ×幅×3のuint8)
+            position (tuple[int, int]): 下地の中での重ねる画像の左上
+        """
+        h, w = self.inverse_alpha.shape[:2]
+        x0 = position[0] + self.offset[0]
+        y0 = position[1] + self.offset[1]
+        # 下地からはみ出す部分は捨てる
+        left, top = max(-x0, 0), max(-y0, 0)
+        right = min(w, frame.shape[1] - x0)
+        bottom = min(h, frame.shape[0] - y0)
+        if right <= left or bottom <= top:
+            return
+        target = frame[y0 + top:y0 + bottom, x0 + left:x0 + right]
+        blended = target.astype(self.premultiplied.dtype)
+        blended *= self.inverse_alpha[top:bottom, left:right]
+        blended += self.premultiplied[top:bottom, left:right]
+        blended //= 255
+        target[...] = blended
+
+
+
+def new_frame(base: Image.Image) -> 'np.ndarray':
+    """下地の画素をコピーした合成用のバッファを作る
+
+    Args:
+        base (Image.Image): 下地
+
+    Returns:
+        np.ndarray: 高さ×幅×3のuint8 (C順)
+    """
+    if base.mode != 'RGB':
+        base = base.convert('RGB')
+    np = _numpy()
+    return np.array(base, dtype=np.uint8)
+
+
+
+def to_image(frame: 'np.ndarray') -> Image.Image:
+    """合成用のバッファを画像にする
+
+    Args:
+        frame (np.ndarray): 高さ×幅×3のuint8
+
+    Returns:
+        Image.Image: 画像 (RGB)
+    """
+    return Image.fromarray(frame)
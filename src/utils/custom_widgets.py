@@ -1,14 +1,22 @@
 from PySide6.QtWidgets import (
     QWidget, QLabel, QPushButton, QLineEdit, QVBoxLayout,
     QHBoxLayout, QColorDialog, QFileDialog, QRadioButton,
-    QPlainTextEdit
+    QPlainTextEdit, QDialog, QCheckBox, QScrollArea
 )
-from PySide6.QtGui import QPainter, QPaintEvent, QColor, QPixmap
+from PySide6.QtGui import QPainter, QPaintEvent, QColor, QPixmap, QImage
 from PySide6.QtCore import Qt
 from enum import Enum
-from utils import misc, img, gui
+from typing import TYPE_CHECKING
+from utils import misc, gui, workers, instrument
 import pathlib
 
+if TYPE_CHECKING:
+    # Pillowを使うモジュールは起動を速くするために初めて描画するときに読み込む
+    from utils import export, img, variants
+
+PLACEHOLDER_PATH = 'img/placeholder.jpg'  # 画像を選ぶ前に表示する画像 (プレビューと同じ大きさ)
+PREVIEW_SIZE = (480, 270)  # プレビューの大きさ (img.PREVIEW_SIZEと同じ．imgを読み込まずに使う)
+
 
 class ImageSelector(QWidget):
     """ 画像ファイル選択用ウィジェット """
@@ -212,6 +220,7 @@ class ColorSelector(QWidget):
 
         self.__check_color(parent)
         self.__preview_rect.set_color((r, g, b, a))
+        parent.schedule_preview()
 
     
     def __set_color_rgba(self, parent: 'gui.MainWindow'):
@@ -233,6 +242,7 @@ class ColorSelector(QWidget):
         hex = f'{r_int:02X}{g_int:02X}{b_int:02X}' # '#'を含まない
         self.__input_hex.setText(hex)
         self.__preview_rect.set_color((r_int, g_int, b_int, a_int))
+        parent.schedule_preview()
 
     
     def __check_color(self, parent: 'gui.MainWindow'):
@@ -317,12 +327,12 @@ class OffsetSelector(QWidget):
         self.__btn_plus10 = OffsetButton(10)
         self.__btn_plus100 = OffsetButton(100)
         
-        self.__btn_minus100.clicked.connect(lambda: self.__change_offset(-100))
-        self.__btn_minus10.clicked.connect(lambda: self.__change_offset(-10))
-        self.__btn_minus1.clicked.connect(lambda: self.__change_offset(-1))
-        self.__btn_plus1.clicked.connect(lambda: self.__change_offset(1))
-        self.__btn_plus10.clicked.connect(lambda: self.__change_offset(10))
-        self.__btn_plus100.clicked.connect(lambda: self.__change_offset(100))
+        self.__btn_minus100.clicked.connect(lambda: self.__change_offset(-100, parent))
+        self.__btn_minus10.clicked.connect(lambda: self.__change_offset(-10, parent))
+        self.__btn_minus1.clicked.connect(lambda: self.__change_offset(-1, parent))
+        self.__btn_plus1.clicked.connect(lambda: self.__change_offset(1, parent))
+        self.__btn_plus10.clicked.connect(lambda: self.__change_offset(10, parent))
+        self.__btn_plus100.clicked.connect(lambda: self.__change_offset(100, parent))
         
         self._input_offset = LineEditClickable(
             self, text='0', alignment=Qt.AlignmentFlag.AlignRight,
@@ -330,7 +340,17 @@ class OffsetSelector(QWidget):
         )
         
         self._input_offset.setFixedWidth(50)
-        self._input_offset.editingFinished.connect(self.__set_offset)
+        self._input_offset.editingFinished.connect(lambda: self.__set_offset(parent))
+
+        # 元画像から推定したオフセットにする (推定はワーカースレッドで行う)
+        self.__btn_auto = QPushButton("自動", self)
+        self.__btn_auto.setToolTip("元画像の目立つところが長方形に隠れないオフセットにする")
+        self.__btn_auto.clicked.connect(lambda: self.__suggest_offset(parent))
+        self.__executor = workers.LatestOnlyExecutor(self)
+        self.__executor.finished.connect(lambda offset: self.set_offset(offset, parent))
+        self.__executor.failed.connect(
+            lambda e: print(f"オフセットの推定に失敗: {e}")
+        )
         
         layout = QVBoxLayout()
         layout.addWidget(self.__label_offset)
@@ -355,22 +375,45 @@ class OffsetSelector(QWidget):
         bottom.addStretch()
 
         layout.addLayout(bottom)
+        layout.addWidget(self.__btn_auto, alignment=Qt.AlignmentFlag.AlignHCenter)
         
         self.setLayout(layout)
             
-    def __change_offset(self, delta: int): 
+    def __change_offset(self, delta: int, parent: 'gui.MainWindow'): 
         self.__offset += delta
         self._input_offset.setText(str(self.__offset))
         # self.__check_offset(parent)
+        parent.schedule_preview()
     
     
-    def __set_offset(self):
+    def __set_offset(self, parent: 'gui.MainWindow'):
         offset = self._input_offset.text()
         try:
             self.__offset = int(offset)
         except ValueError:
             self.__offset = 0
         # self.__check_offset(parent)
+        parent.schedule_preview()
+
+
+    def __suggest_offset(self, parent: 'gui.MainWindow'):
+        image_path = parent.get_img_path()
+        if not pathlib.Path(image_path).is_file():
+            print("画像が選択されていません")
+            return
+        self.__executor.submit(suggest_offset, image_path)
+
+
+    def set_offset(self, offset: int, parent: 'gui.MainWindow'):
+        """オフセット値を設定してプレビューを更新する
+
+        Args:
+            offset (int): オフセット値 (負なら下に，正なら上にずれる)
+            parent (gui.MainWindow): 親ウィジェット(MainWindow)
+        """
+        self.__offset = offset
+        self._input_offset.setText(str(offset))
+        parent.schedule_preview()
 
 
     # def __check_offset(self, parent):
@@ -427,6 +470,8 @@ class LogoColorSelector(QWidget):
         self.__radio_white = QRadioButton("白", self)
         self.__radio_black = QRadioButton("黒", self)
         self.__radio_white.setChecked(True)
+        self.__radio_white.toggled.connect(lambda: parent.schedule_preview())
+        self.__radio_black.toggled.connect(lambda: parent.schedule_preview())
 
         layout = QHBoxLayout()
         layout.addWidget(self.__label_logo_color)
@@ -437,12 +482,14 @@ class LogoColorSelector(QWidget):
         self.setLayout(layout)
 
 
-    def get_logo_color(self) -> img.LogoColor:
+    def get_logo_color(self) -> 'img.LogoColor':
         """選択されたロゴの色を取得する
 
         Returns:
             img.LogoColor: ロゴの色 (img.LogoColor.WHITE or img.LogoColor.BLACK)
         """
+        from utils import img
+
         if self.__radio_white.isChecked():
             return img.LogoColor.WHITE
         else:
@@ -467,6 +514,11 @@ class LogoShapeSelector(QWidget):
         self.__radio_soft_trapezoid = QRadioButton("角丸台形", self)
         self.__radio_soft_rectangle = QRadioButton("角丸長方形", self)
         self.__radio_banner.setChecked(True)
+        for radio in (
+            self.__radio_banner, self.__radio_trapezoid,
+            self.__radio_soft_trapezoid, self.__radio_soft_rectangle
+        ):
+            radio.toggled.connect(lambda: parent.schedule_preview())
 
         layout = QHBoxLayout()
         layout.addWidget(self.__label_logo_shape)
@@ -481,12 +533,14 @@ class LogoShapeSelector(QWidget):
         self.setLayout(layout)
 
 
-    def get_logo_shape(self) -> img.LogoShape:
+    def get_logo_shape(self) -> 'img.LogoShape':
         """選択されたロゴの形を取得する
 
         Returns:
             img.LogoShape: ロゴの形 (img.LogoShape.BANNER, img.LogoShape.TRAPEZOID, img.LogoShape.SOFT_TRAPEZOID, or img.LogoShape.SOFT_RECTANGLE)
         """
+        from utils import img
+
         if self.__radio_banner.isChecked():
             return img.LogoShape.BANNER
         elif self.__radio_trapezoid.isChecked():
@@ -498,6 +552,71 @@ class LogoShapeSelector(QWidget):
 
 
 
+class OutputFormatSelector(QWidget):
+    """ 保存形式選択用ウィジェット """
+    def __init__(self, parent: 'gui.MainWindow'):
+        """初期化関数
+
+        Args:
+            parent (gui.MainWindow): 親ウィジェット(MainWindow)
+        """
+        super().__init__(parent)
+
+        self.__label_format = QLabel("保存形式", self)
+
+        self.__radio_png = QRadioButton("PNG", self)
+        self.__radio_jpeg = QRadioButton("JPEG", self)
+        self.__radio_webp = QRadioButton("WebP", self)
+        self.__radio_png.setChecked(True)
+
+        # JPEG / WebPの品質
+        self.__label_quality = QLabel("品質", self)
+        self.__input_quality = LineEditClickable(
+            self, placeholderText='90', maxLength=3,
+            inputMask='000;'
+        )
+        self.__input_quality.setFixedWidth(40)
+        self.__input_quality.setText('90')
+
+        layout = QHBoxLayout()
+        layout.addWidget(self.__label_format)
+        layout.addStretch()
+        layout.addWidget(self.__radio_png)
+        layout.addWidget(self.__radio_jpeg)
+        layout.addWidget(self.__radio_webp)
+        layout.addSpacing(10)
+        layout.addWidget(self.__label_quality)
+        layout.addWidget(self.__input_quality)
+
+        self.setLayout(layout)
+
+
+    def get_export_options(self) -> 'export.ExportOptions':
+        """選択された保存形式の設定を取得する
+
+        Returns:
+            export.ExportOptions: 保存形式と圧縮の設定
+        """
+        from utils import export
+
+        try:
+            quality = min(max(int(self.__input_quality.text()), 0), 100)
+        except ValueError:
+            quality = 90
+
+        if self.__radio_jpeg.isChecked():
+            return export.ExportOptions(
+                format=export.OutputFormat.JPEG, jpeg_quality=quality
+            )
+        elif self.__radio_webp.isChecked():
+            return export.ExportOptions(
+                format=export.OutputFormat.WEBP, webp_quality=quality
+            )
+        else:
+            return export.ExportOptions(format=export.OutputFormat.PNG)
+
+
+
 class RectangleWidget(QWidget):
     """色プレビュー用の矩形ウィジェット"""
     def __init__(self, parent: 'ColorSelector'):
@@ -560,36 +679,180 @@ class ThumbnailPreview(QLabel):
             parent (gui.MainWindow): 親ウィジェット(MainWindow)
         """
         super().__init__(parent)
-        pixmap = QPixmap(str(pathlib.Path(misc.base_dir() / "img/wakato.jpg")))
-        pixmap = pixmap.scaled(480, 270, Qt.AspectRatioMode.KeepAspectRatio)
+        # プレビューと同じ大きさの画像を同梱しているので，起動時に縮小しない
+        pixmap = QPixmap(str(pathlib.Path(misc.base_dir() / PLACEHOLDER_PATH)))
+        if pixmap.isNull():
+            pixmap = QPixmap(*PREVIEW_SIZE)
+            pixmap.fill(QColor('#d0d0d0'))
+        elif (pixmap.width(), pixmap.height()) != PREVIEW_SIZE:
+            pixmap = pixmap.scaled(*PREVIEW_SIZE, Qt.AspectRatioMode.KeepAspectRatio)
         self.setPixmap(pixmap)
-        self.resize(480, 270)
+        self.resize(*PREVIEW_SIZE)
+
+        # 描画はワーカースレッドで行い，最新の要求の結果だけを表示する
+        self.__requested: tuple | None = None  # 最後に描画を要求した入力
+        self.__executor = workers.LatestOnlyExecutor(self)
+        self.__executor.finished.connect(self.__show)
+        self.__executor.failed.connect(self.__on_failed)
 
 
     def update_preview(
             self, image_path: str, offset: int,
             rgba: tuple[int, int, int, int],
-            logo_color: img.LogoColor = img.LogoColor.WHITE,
-            logo_shape: img.LogoShape = img.LogoShape.BANNER
+            logo_color: 'img.LogoColor | None' = None,
+            logo_shape: 'img.LogoShape | None' = None
             ):
-        """プレビューを更新する
+        """プレビューを更新する (描画はワーカースレッドで行う)
 
         Args:
             image_path (str): 元画像のパス
             offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
             rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
-            logo_color (img.LogoColor, optional): ロゴの色. Defaults to img.LogoColor.WHITE.
+            logo_color (img.LogoColor | None, optional): ロゴの色. Noneなら白. Defaults to None.
+            logo_shape (img.LogoShape | None, optional): ロゴの形. Noneならバナー. Defaults to None.
         """
-        try:
-            img.generate_thumbnail(image_path, offset, rgba, logo_color, logo_shape)
-            path = pathlib.Path(image_path).parent / 'thumbnail.png'
-            pixmap = QPixmap(str(path)).scaled(
-                480, 270, Qt.AspectRatioMode.KeepAspectRatio
-            )
-            self.setPixmap(pixmap)
-            self.resize(480, 270)
-        except Exception as e:
-            print(f"プレビューの更新に失敗: {e}")
+        from utils import img
+
+        if logo_color is None:
+            logo_color = img.LogoColor.WHITE
+        if logo_shape is None:
+            logo_shape = img.LogoShape.BANNER
+        key = render_key(image_path, offset, rgba, logo_color, logo_shape)
+        if key == self.__requested:
+            # 同じ入力で描画済み (または描画中)
+            return
+        self.__requested = key
+        # プレビューの大きさで描画する (フル解像度は作成ボタンを押したときのみ)
+        self.__executor.submit(
+            render_preview_qimage,
+            image_path, offset, rgba, logo_color, logo_shape
+        )
+
+
+    def show_rendered(self, key: tuple, qimage: QImage):
+        """別に描画したプレビューを表示する (入力が最新のものと同じときのみ)
+
+        Args:
+            key (tuple): 描画の入力 (render_keyの値)
+            qimage (QImage): プレビューの大きさのサムネイル
+        """
+        if self.__requested not in (None, key):
+            return
+        self.__requested = key
+        self.__show(qimage)
+
+
+    def __show(self, qimage: QImage):
+        """描画されたプレビューを表示する
+
+        Args:
+            qimage (QImage): 描画されたプレビュー
+        """
+        self.setPixmap(QPixmap.fromImage(qimage))
+        self.resize(*PREVIEW_SIZE)
+
+
+    def __on_failed(self, e: Exception):
+        """プレビューの描画に失敗したときの処理
+
+        Args:
+            e (Exception): 発生した例外
+        """
+        self.__requested = None
+        print(f"プレビューの更新に失敗: {e}")
+
+
+
+def render_key(
+        image_path: str, offset: int,
+        rgba: tuple[int, int, int, int],
+        logo_color: 'img.LogoColor', logo_shape: 'img.LogoShape'
+        ) -> tuple:
+    """描画の入力を比較するためのキーを作る (元画像が書き換えられると変わる)
+
+    Args:
+        image_path (str): 元画像のパス
+        offset (int): 画像の縦方向のオフセット
+        rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
+        logo_color (img.LogoColor): ロゴの色
+        logo_shape (img.LogoShape): ロゴの形
+
+    Returns:
+        tuple: 描画の入力を表すキー
+    """
+    from utils import img
+
+    return (img.source_stamp(image_path), offset, tuple(rgba), logo_color, logo_shape)
+
+
+
+def suggest_offset(image_path: str) -> int:
+    """元画像の目立つところが長方形に隠れないオフセットを推定する (ワーカースレッドで実行される)
+
+    プレビューと同じ大きさで解析するので，プレビューを描画済みならデコードし直さない．
+
+    Args:
+        image_path (str): 元画像のパス
+
+    Returns:
+        int: オフセット
+    """
+    from utils import autocrop
+
+    return autocrop.suggest_offset(image_path)
+
+
+
+def render_preview_qimage(
+        image_path: str, offset: int,
+        rgba: tuple[int, int, int, int],
+        logo_color: 'img.LogoColor', logo_shape: 'img.LogoShape'
+        ) -> QImage:
+    """プレビューを描画してQImageにする (ワーカースレッドで実行される)
+
+    Args:
+        image_path (str): 元画像のパス
+        offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
+        logo_color (img.LogoColor): ロゴの色
+        logo_shape (img.LogoShape): ロゴの形
+
+    Returns:
+        QImage: 描画されたプレビュー
+    """
+    from utils import img
+
+    if not instrument.enabled():
+        image = img.render_preview(image_path, offset, rgba, logo_color, logo_shape)
+        return to_qimage(image)
+    with instrument.trace(f'{image_path} (preview)') as trace:
+        image = img.render_preview(image_path, offset, rgba, logo_color, logo_shape)
+    instrument.emit(trace)
+    return to_qimage(image)
+
+
+
+def to_qimage(image: 'img.Image.Image') -> QImage:
+    """PIL ImageをQImageに変換する (PNGを経由しない)
+
+    QImageは画素データをコピーせずに参照するので，使い終わるまでデータを保持する．
+
+    Args:
+        image (img.Image.Image): 変換するPIL Imageオブジェクト
+
+    Returns:
+        QImage: 変換されたQImage
+    """
+    if image.mode == 'RGB':
+        fmt, bpp = QImage.Format.Format_RGB888, 3
+    else:
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        fmt, bpp = QImage.Format.Format_RGBA8888, 4
+    data = image.tobytes('raw', image.mode)
+    qimage = QImage(data, image.width, image.height, image.width * bpp, fmt)
+    qimage._data = data  # type: ignore  # QImageより先に解放されないように保持する
+    return qimage
 
 
 
@@ -634,6 +897,14 @@ class GenerateButton(QPushButton):
         self.setFixedWidth(100)
         self.clicked.connect(lambda: self.__on_click(parent))
 
+        # 生成はワーカースレッドで行う
+        self.__last: tuple[tuple, 'img.Image.Image'] | None = None  # (入力, 最後に描画したサムネイル)
+        self.__executor = workers.LatestOnlyExecutor(self)
+        self.__executor.finished.connect(
+            lambda result: self.__on_generated(parent, result)
+        )
+        self.__executor.failed.connect(self.__on_failed)
+
 
     def __on_click(self, parent: 'gui.MainWindow'):
         """クリック時の処理(サムネイルの作成)
@@ -648,10 +919,294 @@ class GenerateButton(QPushButton):
             rgba = parent.get_rgba()
             logo_color = parent.get_logo_color()
             logo_shape = parent.get_logo_shape()
+            export_options = parent.get_export_options()
             
-            img.generate_thumbnail(image_path, offset, rgba, logo_color, logo_shape)
-            parent.update_preview()
+            # 入力が変わっていなければ前回の描画結果を保存し直すだけにする
+            key = render_key(image_path, offset, rgba, logo_color, logo_shape)
+            rendered = None
+            if self.__last is not None and self.__last[0] == key:
+                rendered = self.__last[1]
+
+            self.__executor.submit(
+                generate_with_preview, key, rendered,
+                image_path, offset, rgba, logo_color, logo_shape,
+                export_options
+            )
+        except Exception as e:
+            self.__on_failed(e)
+
+
+    def __on_generated(self, parent: 'gui.MainWindow', result: tuple):
+        """生成が終わったときの処理 (生成した画像をそのままプレビューに使う)
+
+        Args:
+            parent (gui.MainWindow): 親ウィジェット(MainWindow)
+            result (tuple): generate_with_previewの戻り値
+        """
+        key, rendered, qimage, output, trace = result
+        self.__last = (key, rendered)
+        print(
+            f"保存しました: {output.path} ({output.nbytes / 1024:.0f}KB, "
+            f"エンコード {output.encode_time * 1000:.0f}ms)"
+        )
+        print(f"  {trace.summary()}")
+        parent.show_preview(key, qimage)
+
+
+    def __on_failed(self, e: Exception):
+        """生成に失敗したときの処理
+
+        Args:
+            e (Exception): 発生した例外
+        """
+        print(f"Error: {e}")
+        print("画像の生成に失敗しました。")
+
+
+
+def generate_with_preview(
+        key: tuple, rendered: 'img.Image.Image | None',
+        image_path: str, offset: int,
+        rgba: tuple[int, int, int, int],
+        logo_color: 'img.LogoColor', logo_shape: 'img.LogoShape',
+        export_options: 'export.ExportOptions'
+        ) -> tuple[tuple, 'img.Image.Image', QImage, 'export.ExportResult', instrument.RenderTrace]:
+    """サムネイルを生成して保存し，縮小したプレビューも作る (ワーカースレッドで実行される)
+
+    Args:
+        key (tuple): 描画の入力 (render_keyの値)
+        rendered (img.Image.Image | None): 同じ入力で描画済みのサムネイル. あれば描画せずに保存だけする.
+        image_path (str): 元画像のパス
+        offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
+        logo_color (img.LogoColor): ロゴの色
+        logo_shape (img.LogoShape): ロゴの形
+        export_options (export.ExportOptions): 保存形式と圧縮の設定
+
+    Returns:
+        tuple[tuple, img.Image.Image, QImage, export.ExportResult, instrument.RenderTrace]:
+            (入力, 描画したサムネイル, プレビュー, 保存の結果, 段階ごとの時間)
+    """
+    from utils import img
+
+    with instrument.trace(image_path) as trace:
+        if rendered is None:
+            rendered = img.render_thumbnail(
+                image_path, offset, rgba, logo_color, logo_shape
+            )
+        output = img.save_thumbnail(
+            rendered, img.thumbnail_path(image_path, export_options), export_options
+        )
+    instrument.emit(trace)
+    preview = rendered.resize(img.PREVIEW_SIZE)
+    return key, rendered, to_qimage(preview), output, trace
+
+
+
+class VariantButton(QPushButton):
+    """バリエーションの一覧を開くボタン"""
+    def __init__(self, parent: 'gui.MainWindow'):
+        """初期化関数
+
+        Args:
+            parent (gui.MainWindow): 親ウィジェット(MainWindow)
+        """
+        super().__init__("バリエーション", parent)
+        self.setFixedWidth(120)
+        self.__dialog: VariantDialog | None = None  # 初めて押されたときに作る
+        self.clicked.connect(lambda: self.__on_click(parent))
+
+
+    def __on_click(self, parent: 'gui.MainWindow'):
+        if self.__dialog is None:
+            self.__dialog = VariantDialog(parent)
+        self.__dialog.show()
+        self.__dialog.raise_()
+        self.__dialog.activateWindow()
+
+
+
+class VariantDialog(QDialog):
+    """形・ロゴの色・長方形の色の組み合わせをまとめて生成して一覧を表示するダイアログ
+
+    元画像・オフセット・保存形式はメインウィンドウで選択されているものを使う．
+    """
+    # img.LogoShape / img.LogoColorの名前 -> 表示
+    SHAPE_LABELS = {
+        'BANNER': "バナー",
+        'TRAPEZOID': "台形",
+        'SOFT_TRAPEZOID': "角丸台形",
+        'SOFT_RECTANGLE': "角丸長方形",
+    }
+    COLOR_LABELS = {
+        'WHITE': "白",
+        'BLACK': "黒",
+    }
+
+    def __init__(self, parent: 'gui.MainWindow'):
+        """初期化関数
+
+        Args:
+            parent (gui.MainWindow): 親ウィジェット(MainWindow)
+        """
+        from utils import img
+
+        super().__init__(parent)
+        self.setWindowTitle("バリエーション")
+
+        # ロゴの形
+        self.__checks_shape = {}
+        shapes = QHBoxLayout()
+        shapes.addWidget(QLabel("ロゴの形", self))
+        shapes.addStretch()
+        for name, label in self.SHAPE_LABELS.items():
+            check = QCheckBox(label, self)
+            check.setChecked(True)
+            self.__checks_shape[img.LogoShape[name]] = check
+            shapes.addWidget(check)
+
+        # ロゴの色
+        self.__checks_color = {}
+        colors = QHBoxLayout()
+        colors.addWidget(QLabel("ロゴの色", self))
+        colors.addStretch()
+        for name, label in self.COLOR_LABELS.items():
+            check = QCheckBox(label, self)
+            check.setChecked(True)
+            self.__checks_color[img.LogoColor[name]] = check
+            colors.addWidget(check)
+
+        # 長方形の色 (カンマ区切りのHEXコード．空ならメインウィンドウの色)
+        self.__input_palette = LineEditClickable(
+            self, placeholderText="006E4F,C0392B (空なら選択中の色)"
+        )
+        palette = QHBoxLayout()
+        palette.addWidget(QLabel("矩形の色", self))
+        palette.addWidget(self.__input_palette)
+
+        self.__btn_generate = QPushButton("生成", self)
+        self.__btn_generate.clicked.connect(lambda: self.__on_click(parent))
+        self.__status = QLabel("", self, wordWrap=True)
+
+        # 一覧
+        self.__sheet = QLabel(self)
+        self.__sheet.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        scroll = QScrollArea(self)
+        scroll.setWidget(self.__sheet)
+        scroll.setWidgetResizable(True)
+        scroll.setMinimumSize(640, 400)
+
+        bottom = QHBoxLayout()
+        bottom.addWidget(self.__status)
+        bottom.addStretch()
+        bottom.addWidget(self.__btn_generate)
+
+        layout = QVBoxLayout()
+        layout.addLayout(shapes)
+        layout.addLayout(colors)
+        layout.addLayout(palette)
+        layout.addWidget(scroll)
+        layout.addLayout(bottom)
+        self.setLayout(layout)
+
+        # 生成はワーカースレッドで行う
+        self.__executor = workers.LatestOnlyExecutor(self)
+        self.__executor.finished.connect(self.__on_generated)
+        self.__executor.failed.connect(self.__on_failed)
+
+
+    def get_variants(self, parent: 'gui.MainWindow') -> list['variants.Variant']:
+        """選択されている組み合わせを取得する
+
+        Args:
+            parent (gui.MainWindow): 親ウィジェット(MainWindow)
+
+        Returns:
+            list[variants.Variant]: 組み合わせ
+        """
+        from utils import variants
+
+        shapes = tuple(s for s, check in self.__checks_shape.items() if check.isChecked())
+        colors = tuple(c for c, check in self.__checks_color.items() if check.isChecked())
+        alpha = parent.get_rgba()[3]
+        palette = []
+        for hex in self.__input_palette.text().split(','):
+            hex = hex.strip().lstrip('#')
+            if not hex:
+                continue
+            if len(hex) != 6:
+                raise ValueError(f"HEXコードが不正です: {hex}")
+            palette.append((*misc.rgb(hex), alpha))
+        if not palette:
+            palette.append(parent.get_rgba())
+        return variants.variant_grid(shapes, colors, tuple(dict.fromkeys(palette)))
+
+
+    def __on_click(self, parent: 'gui.MainWindow'):
+        """クリック時の処理(バリエーションの生成)
+
+        Args:
+            parent (gui.MainWindow): 親ウィジェット(MainWindow)
+        """
+        try:
+            image_path = parent.get_img_path()
+            if not pathlib.Path(image_path).is_file():
+                raise ValueError("画像が選択されていません")
+            grid = self.get_variants(parent)
+            if not grid:
+                raise ValueError("ロゴの形と色を1つ以上選択してください")
+            self.__status.setText(f"{len(grid)}枚を生成しています...")
+            self.__executor.submit(
+                generate_variants_qimage, image_path, parent.get_offset(),
+                grid, parent.get_export_options()
+            )
         except Exception as e:
-            print(f"Error: {e}")
-            print("画像の生成に失敗しました。")
+            self.__on_failed(e)
+
+
+    def __on_generated(self, result: tuple):
+        """生成が終わったときの処理 (一覧を表示する)
+
+        Args:
+            result (tuple): generate_variants_qimageの戻り値
+        """
+        result, qimage = result
+        self.__sheet.setPixmap(QPixmap.fromImage(qimage))
+        self.__status.setText(
+            f"{len(result.outputs)}枚を保存しました ({result.elapsed:.1f}秒): {result.sheet.path}"
+        )
+        print(f"一覧を保存しました: {result.sheet.path}")
+
+
+    def __on_failed(self, e: Exception):
+        """生成に失敗したときの処理
+
+        Args:
+            e (Exception): 発生した例外
+        """
+        self.__status.setText(f"生成に失敗しました: {e}")
+        print(f"Error: {e}")
+
+
+
+def generate_variants_qimage(
+        image_path: str, offset: int, grid: list['variants.Variant'],
+        export_options: 'export.ExportOptions'
+        ) -> tuple['variants.VariantResult', QImage]:
+    """バリエーションを生成して保存し，一覧をQImageにする (ワーカースレッドで実行される)
+
+    Args:
+        image_path (str): 元画像のパス
+        offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        grid (list[variants.Variant]): 生成する組み合わせ
+        export_options (export.ExportOptions): 保存形式と圧縮の設定
+
+    Returns:
+        tuple[variants.VariantResult, QImage]: (生成結果, 一覧)
+    """
+    from utils import variants
 
+    result = variants.generate_variants(
+        image_path, offset, grid, export_options, columns=min(len(grid), 4)
+    )
+    return result, to_qimage(result.sheet_image)
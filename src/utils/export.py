@@ -0,0 +1,318 @@
+from PIL import Image
+from dataclasses import dataclass, replace
+from enum import Enum
+import io
+import os
+import pathlib
+import re
+import string
+import tempfile
+import time
+from utils import instrument
+
+# ファイル名のテンプレートで使える置換 (例: '{stem}_{shape}_{hash}')
+TEMPLATE_TOKENS = ('stem', 'shape', 'logo', 'color', 'offset', 'hash', 'size', 'format')
+# 置換された値に一致する正規表現 (保存したファイルを見分けるのに使う)
+TOKEN_PATTERNS = {
+    'stem': r'.+', 'shape': r'[a-z_]+', 'logo': r'[a-z]+', 'color': r'[0-9a-f]{8}',
+    'offset': r'-?\d+', 'hash': r'[0-9a-f]{10}', 'size': r'\d+x\d+', 'format': r'[a-z]+',
+}
+
+
+def _read_umask() -> int:
+    """プロセスのumaskを取得する
+
+    Linuxでは/proc/self/statusのUmaskを読む．読めない場合は設定し直して読むしかなく，
+    その間に他のスレッドが作るファイルに影響するので，モジュールの読み込み時に1回だけ呼ぶ．
+    """
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return mask
+
+
+
+UMASK = _read_umask()  # write_atomicで保存するファイルの権限に使う
+
+
+class OutputFormat(Enum):
+    PNG = 'png'
+    JPEG = 'jpg'
+    WEBP = 'webp'
+
+
+# 保存形式の別名 (拡張子と同じ書き方も受け付ける)
+FORMAT_ALIASES = {'jpeg': OutputFormat.JPEG}
+
+
+def parse_format(name: str) -> OutputFormat:
+    """保存形式の名前を読む (大文字小文字は区別しない)
+
+    Args:
+        name (str): 保存形式 (png, jpg, jpeg, webp)
+
+    Returns:
+        OutputFormat: 保存形式
+
+    Raises:
+        ValueError: 知らない形式の場合
+    """
+    name = name.strip().lower()
+    if name in FORMAT_ALIASES:
+        return FORMAT_ALIASES[name]
+    return OutputFormat(name)
+
+
+
+def format_names() -> list[str]:
+    """parse_formatで読める名前の一覧"""
+    return [f.value for f in OutputFormat] + list(FORMAT_ALIASES)
+
+
+class PngStrategy(Enum):
+    """PNG(zlib)の圧縮戦略"""
+    DEFAULT = 0
+    FILTERED = 1
+    HUFFMAN_ONLY = 2
+    RLE = 3
+    FIXED = 4
+
+
+@dataclass(frozen=True)
+class ExportOptions:
+    """サムネイルの保存形式と圧縮の設定"""
+    format: OutputFormat = OutputFormat.PNG
+    png_compress_level: int = 6  # 0(無圧縮)-9(最大). 写真なら1-3でも大きさはあまり変わらず速い
+    png_strategy: PngStrategy = PngStrategy.DEFAULT
+    jpeg_quality: int = 90
+    jpeg_progressive: bool = False
+    jpeg_subsampling: str = '4:2:0'  # '4:4:4', '4:2:2', '4:2:0'
+    webp_quality: int = 85
+    webp_method: int = 4  # 0(速い)-6(小さい)
+
+    @property
+    def suffix(self) -> str:
+        """保存するファイルの拡張子 (.を含む)"""
+        return '.' + self.format.value
+
+
+    def save_params(self) -> dict:
+        """Image.saveに渡す引数
+
+        Returns:
+            dict: 形式名と圧縮の設定
+        """
+        match self.format:
+            case OutputFormat.PNG:
+                return {
+                    'format': 'PNG',
+                    'compress_level': self.png_compress_level,
+                    'compress_type': self.png_strategy.value,
+                }
+            case OutputFormat.JPEG:
+                return {
+                    'format': 'JPEG',
+                    'quality': self.jpeg_quality,
+                    'progressive': self.jpeg_progressive,
+                    'subsampling': self.jpeg_subsampling,
+                }
+            case OutputFormat.WEBP:
+                return {
+                    'format': 'WEBP',
+                    'quality': self.webp_quality,
+                    'method': self.webp_method,
+                }
+            case _:
+                raise ValueError(f'Invalid output format: {self.format}')
+
+
+
+@dataclass(frozen=True)
+class OutputPolicy:
+    """サムネイルの保存先の決め方
+
+    templateでは次の置換が使える (拡張子は保存形式から付く):
+        {stem}: 元画像のファイル名 (拡張子なし)
+        {shape}: 長方形の形 (banner など)
+        {logo}: ロゴの色 (white / black)
+        {color}: 長方形の色 (RRGGBBAA)
+        {offset}: オフセット
+        {hash}: 元画像と描画パラメータから作った短いハッシュ
+        {size}: サムネイルの大きさ (1920x1080 など)
+        {format}: 保存形式 (png など)
+    """
+    directory: str | None = None  # 保存先のディレクトリ. Noneなら元画像と同じ
+    template: str = 'thumbnail'
+
+    def __post_init__(self):
+        try:
+            self.template.format(**{token: 'x' for token in TEMPLATE_TOKENS})
+        except (KeyError, IndexError, ValueError) as e:
+            raise ValueError(f'ファイル名のテンプレートが不正です: {self.template} ({e})')
+
+
+    def with_size(self) -> 'OutputPolicy':
+        """複数の大きさで保存するときの決め方 (templateに{size}がなければ最後に付ける)
+
+        Returns:
+            OutputPolicy: 大きさごとにファイル名が変わる決め方
+        """
+        fields = (field for _, field, _, _ in string.Formatter().parse(self.template))
+        if 'size' in fields:
+            return self
+        return replace(self, template=self.template + '_{size}')
+
+
+    def with_style(self) -> 'OutputPolicy':
+        """複数の描画パラメータで保存するときの決め方
+
+        templateに{hash}がなければ，{shape}，{logo}，{color}のうちないものを最後に付ける．
+
+        Returns:
+            OutputPolicy: 形・ロゴの色・長方形の色ごとにファイル名が変わる決め方
+        """
+        fields = {field for _, field, _, _ in string.Formatter().parse(self.template)}
+        if 'hash' in fields:
+            return self
+        missing = [token for token in ('shape', 'logo', 'color') if token not in fields]
+        if not missing:
+            return self
+        return replace(self, template=self.template + ''.join(f'_{{{token}}}' for token in missing))
+
+
+    def name_pattern(self, patterns: dict[str, str] | None = None) -> re.Pattern:
+        """このテンプレートで保存したファイル名 (拡張子なし) に一致する正規表現
+
+        with_size・with_styleで付け足す部分と，一覧の_variantsも含む．
+        {stem}などの置換は同じ名前のグループになる．
+
+        Args:
+            patterns (dict[str, str] | None, optional): TOKEN_PATTERNSの代わりに使う正規表現
+                (形やロゴの色の名前を限定する場合など). Defaults to None.
+
+        Returns:
+            re.Pattern: fullmatchで使う正規表現
+        """
+        patterns = {**TOKEN_PATTERNS, **(patterns or {})}
+        parts = []
+        seen = set()
+        for literal, field, _, _ in string.Formatter().parse(self.template):
+            parts.append(re.escape(literal))
+            if field is None:
+                continue
+            if field in seen:
+                parts.append(f'(?P={field})')
+            else:
+                seen.add(field)
+                parts.append(f'(?P<{field}>{patterns[field]})')
+        size = f'(_(?:{patterns["size"]}))?'
+        style = ''.join(f'(_(?:{patterns[token]}))?' for token in ('shape', 'logo', 'color'))
+        return re.compile(''.join(parts) + size + style + size + '(_variants)?')
+
+
+    def path_for(self, input_path: str, suffix: str, tokens: dict[str, str]) -> str:
+        """保存先のパスを決める
+
+        Args:
+            input_path (str): 元画像のパス
+            suffix (str): 拡張子 (.を含む)
+            tokens (dict[str, str]): テンプレートの置換 (stem以外)
+
+        Returns:
+            str: 保存先のパス
+        """
+        source = pathlib.Path(input_path)
+        directory = pathlib.Path(self.directory) if self.directory else source.parent
+        name = self.template.format(stem=source.stem, format=suffix.lstrip('.'), **tokens)
+        return str(directory / f'{name}{suffix}')
+
+
+
+@dataclass
+class ExportResult:
+    """保存の結果"""
+    path: str
+    format: OutputFormat
+    nbytes: int  # 出力のサイズ [byte]
+    encode_time: float  # エンコードにかかった時間 [秒]
+    write_time: float = 0.0  # 書き込みにかかった時間 [秒]
+
+
+
+def encode(image: Image.Image, options: ExportOptions) -> tuple[bytes, float]:
+    """画像をエンコードする
+
+    Args:
+        image (Image.Image): エンコードする画像
+        options (ExportOptions): 保存形式と圧縮の設定
+
+    Returns:
+        tuple[bytes, float]: (エンコードされたデータ, かかった時間[秒])
+    """
+    start = time.perf_counter()
+    with instrument.span('encode'):
+        if options.format != OutputFormat.PNG and image.mode != 'RGB':
+            # JPEGは透明度を持てない (WebPも不透明なら持たない方が小さい)
+            image = image.convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, **options.save_params())
+    instrument.count('output_bytes', buffer.tell())
+    return buffer.getvalue(), time.perf_counter() - start
+
+
+
+def export(image: Image.Image, path: str, options: ExportOptions) -> ExportResult:
+    """画像をエンコードして保存する
+
+    同じフォルダの一時ファイルに書いてから置き換えるので，書きかけのファイルが残ったり，
+    同じパスに同時に保存したときに混ざったりしない (最後に終わったものが残る)．
+
+    Args:
+        image (Image.Image): 保存する画像
+        path (str): 保存先のパス
+        options (ExportOptions): 保存形式と圧縮の設定
+
+    Returns:
+        ExportResult: 保存の結果
+    """
+    data, encode_time = encode(image, options)
+    start = time.perf_counter()
+    with instrument.span('write'):
+        write_atomic(path, data)
+    return ExportResult(
+        path, options.format, len(data), encode_time,
+        time.perf_counter() - start
+    )
+
+
+
+def write_atomic(path: str, data: bytes):
+    """一時ファイルに書いてから置き換えることで，ファイルを一度に書き込む
+
+    Args:
+        path (str): 保存先のパス (フォルダがなければ作る)
+        data (bytes): 書き込むデータ
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(
+        dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstempは所有者しか読めない権限で作るので，open()で作る通常のファイルと同じにする
+        os.chmod(temp_path, 0o666 & ~UMASK)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
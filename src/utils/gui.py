@@ -1,17 +1,36 @@
 from PySide6.QtWidgets import (
     QMainWindow, QWidget, QHBoxLayout, QVBoxLayout
 )
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer
+from PySide6.QtGui import QImage
+from typing import TYPE_CHECKING
 from utils import custom_widgets as cwidgets
-from utils import img
+import pathlib
+
+if TYPE_CHECKING:
+    from utils import img, export
+
+PREVIEW_DELAY_MS = 150  # 入力が止まってからプレビューを更新するまでの時間 [ms]
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, preview_delay_ms: int = PREVIEW_DELAY_MS):
+        """初期化関数
+
+        Args:
+            preview_delay_ms (int, optional): 入力が止まってからプレビューを更新するまでの時間 [ms].
+                Defaults to PREVIEW_DELAY_MS.
+        """
         super().__init__()
 
         self.setWindowTitle("thumbGen")
 
+        # プレビュー更新の遅延用タイマー (入力が続く間は更新しない)
+        self.__preview_timer = QTimer(self)
+        self.__preview_timer.setSingleShot(True)
+        self.__preview_timer.setInterval(preview_delay_ms)
+        self.__preview_timer.timeout.connect(self.update_preview)
+
         # 画像ファイル選択
         self.__image_selector = cwidgets.ImageSelector(self)
 
@@ -27,6 +46,9 @@ class MainWindow(QMainWindow):
         # ロゴの形
         self.__logo_shape_selector = cwidgets.LogoShapeSelector(self)
 
+        # 保存形式
+        self.__format_selector = cwidgets.OutputFormatSelector(self)
+
         # サムネイル表示
         self.__pic = cwidgets.ThumbnailPreview(self)
 
@@ -53,6 +75,9 @@ class MainWindow(QMainWindow):
         # サムネイル生成ボタン
         self.__btn_generate = cwidgets.GenerateButton(self)
 
+        # バリエーションの一覧を開くボタン
+        self.__btn_variants = cwidgets.VariantButton(self)
+
 
         # レイアウト配置
         top = QHBoxLayout()
@@ -64,6 +89,7 @@ class MainWindow(QMainWindow):
         left.addWidget(self.__offset_selector)
         left.addWidget(self.__logo_color_selector)
         left.addWidget(self.__logo_shape_selector)
+        left.addWidget(self.__format_selector)
         left.addStretch()
         top.addLayout(left)
 
@@ -79,6 +105,7 @@ class MainWindow(QMainWindow):
 
         bottom = QHBoxLayout()
         bottom.addStretch()
+        bottom.addWidget(self.__btn_variants)
         bottom.addWidget(self.__btn_generate)
 
         main_layout = QVBoxLayout()
@@ -127,7 +154,7 @@ class MainWindow(QMainWindow):
         return self.__offset_selector.get_offset()
     
 
-    def get_logo_color(self) -> img.LogoColor:
+    def get_logo_color(self) -> 'img.LogoColor':
         """選択されているロゴの色を取得する
 
         Returns:
@@ -136,7 +163,7 @@ class MainWindow(QMainWindow):
         return self.__logo_color_selector.get_logo_color()
     
 
-    def get_logo_shape(self) -> img.LogoShape:
+    def get_logo_shape(self) -> 'img.LogoShape':
         """選択されているロゴの形を取得する
 
         Returns:
@@ -144,6 +171,16 @@ class MainWindow(QMainWindow):
         """
         return self.__logo_shape_selector.get_logo_shape()
 
+
+
+    def get_export_options(self) -> 'export.ExportOptions':
+        """選択されている保存形式の設定を取得する
+
+        Returns:
+            export.ExportOptions: 保存形式と圧縮の設定
+        """
+        return self.__format_selector.get_export_options()
+
     
     def update_preview(self):
         """プレビューを更新する"""
@@ -156,3 +193,23 @@ class MainWindow(QMainWindow):
             self.__pic.update_preview(image_path, offset, color, logo_color, logo_shape)
         except Exception as e:
             print(f"プレビューの更新に失敗: {e}")
+
+
+    def schedule_preview(self):
+        """プレビューの更新を予約する
+
+        一定時間(preview_delay_ms)新しい入力がなかったときに1回だけ更新する．
+        """
+        if not pathlib.Path(self.get_img_path()).is_file():
+            return
+        self.__preview_timer.start()
+
+
+    def show_preview(self, key: tuple, qimage: QImage):
+        """描画済みのプレビューを表示する (作成ボタンで生成した結果を使い回す)
+
+        Args:
+            key (tuple): 描画の入力 (cwidgets.render_keyの値)
+            qimage (QImage): プレビューの大きさに縮小したサムネイル
+        """
+        self.__pic.show_rendered(key, qimage)
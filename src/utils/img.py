@@ -1,7 +1,55 @@
 from PIL import Image
 from enum import Enum
-from utils import misc
+from typing import IO, Callable
+from utils import misc, cache, composite, export, instrument
+import hashlib
+import math
+import os
 import pathlib
+import threading
+
+RENDER_VERSION = 5  # 描画結果が変わる修正をしたら上げる (保存済みのキャッシュを無効にする)
+
+IMG_W = 1920  # サムネイルの幅
+IMG_H = 1080  # サムネイルの高さ
+PREVIEW_SIZE = (480, 270)  # プレビューの大きさ
+LADDER_SIZES = ((1920, 1080), (1280, 720), (640, 360))  # 複数の大きさで出力するときの既定
+
+# デコード後にImage.reduceで縮小できるモード
+REDUCIBLE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'RGBX', 'CMYK', 'YCbCr', 'I', 'F')
+
+FINAL_RESAMPLE = Image.Resampling.LANCZOS  # 保存するサムネイルの縮小フィルター
+PREVIEW_RESAMPLE = Image.Resampling.BILINEAR  # プレビューの縮小フィルター (速い)
+
+BANNER_H = 180  # 長方形の高さ (IMG_H基準)
+RADIUS = 45  # 角丸の半径 (IMG_H基準)
+LOGO_H = 120  # ロゴの高さ (IMG_H基準)
+LOGO_X = 75  # ロゴの左端の位置 (IMG_H基準)
+LOGO_MARGIN_BOTTOM = 30  # ロゴの下の余白 (IMG_H基準)
+
+SOURCE_CACHE_BYTES = 256 * 1024 * 1024  # デコード済み元画像のキャッシュの上限
+OVERLAY_CACHE_BYTES = 32 * 1024 * 1024  # 長方形の帯のキャッシュの上限
+STAGE_CACHE_BYTES = 96 * 1024 * 1024  # 描画の途中結果のキャッシュの上限
+
+
+def image_nbytes(image: Image.Image) -> int:
+    """画像の画素データのおおよそのサイズ [byte]"""
+    return image.width * image.height * len(image.getbands())
+
+
+def overlay_nbytes(overlay: tuple[Image.Image | composite.Layer, int]) -> int:
+    """長方形の帯 (画像またはNumPyで合成するための配列) のおおよそのサイズ [byte]"""
+    banner = overlay[0]
+    return banner.nbytes if isinstance(banner, composite.Layer) else image_nbytes(banner)
+
+
+# デコード・リサイズ済みの元画像のキャッシュ (プレビューと作成で共有)
+source_cache = cache.LRUCache(SOURCE_CACHE_BYTES, image_nbytes)
+# 描画済みの長方形の帯のキャッシュ ((形, 色, 大きさ) -> (帯, 上端のy座標))
+overlay_cache = cache.LRUCache(OVERLAY_CACHE_BYTES, overlay_nbytes)
+# 描画の途中結果のキャッシュ ((段階, 入力) -> 画像)
+stage_cache = cache.LRUCache(STAGE_CACHE_BYTES, image_nbytes)
+
 
 class LogoColor(Enum):
     BLACK = 0
@@ -15,12 +63,371 @@ class LogoShape(Enum):
     SOFT_RECTANGLE = 3
 
 
+def clear_caches():
+    """キャッシュ (元画像，途中結果，長方形の帯，ロゴ) をすべて捨てる"""
+    source_cache.clear()
+    stage_cache.clear()
+    overlay_cache.clear()
+    with _logos_lock:
+        _logos.clear()
+        _logo_layers.clear()
+
+
+
 def generate_thumbnail(
         input_path: str, offset: int, 
         rgba: tuple[int, int, int, int],
         logo_color: LogoColor = LogoColor.WHITE,
-        logo_shape: LogoShape = LogoShape.BANNER) -> None:
-    """サムネイルを生成する
+        logo_shape: LogoShape = LogoShape.BANNER,
+        export_options: export.ExportOptions | None = None,
+        output_policy: export.OutputPolicy | None = None,
+        resample: Image.Resampling = FINAL_RESAMPLE,
+        source: Image.Image | None = None
+        ) -> export.ExportResult:
+    """サムネイルを生成して保存する (既定では元画像と同じフォルダのthumbnail.png)
+
+    Args:
+        input_path (str): 元画像のパス
+        offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
+        logo_color (LogoColor, optional): ロゴの色. Defaults to LogoColor.WHITE.
+        logo_shape (LogoShape, optional): ロゴの形. Defaults to LogoShape.BANNER.
+        export_options (export.ExportOptions | None, optional): 保存形式と圧縮の設定.
+            Noneなら既定のPNG. Defaults to None.
+        output_policy (export.OutputPolicy | None, optional): 保存先の決め方.
+            Noneなら元画像と同じフォルダのthumbnail. Defaults to None.
+        resample (Image.Resampling, optional): 縮小フィルター. Defaults to FINAL_RESAMPLE.
+        source (Image.Image | None, optional): デコード済みの元画像 (decode_sourceの結果).
+            Noneならinput_pathからデコードする. Defaults to None.
+
+    Returns:
+        export.ExportResult: 保存の結果 (保存先，サイズ，エンコード時間)
+    """
+    export_options = export_options or export.ExportOptions()
+    canvas = render_thumbnail(
+        input_path, offset, rgba, logo_color, logo_shape, resample=resample, source=source
+    )
+    save_path = thumbnail_path(
+        input_path, export_options, output_policy,
+        offset, rgba, logo_color, logo_shape
+    )
+    return save_thumbnail(canvas, save_path, export_options)
+
+
+
+def generate_ladder(
+        input_path: str, offset: int,
+        rgba: tuple[int, int, int, int],
+        logo_color: LogoColor = LogoColor.WHITE,
+        logo_shape: LogoShape = LogoShape.BANNER,
+        sizes: tuple[tuple[int, int], ...] = LADDER_SIZES,
+        export_options: export.ExportOptions | None = None,
+        output_policy: export.OutputPolicy | None = None,
+        resample: Image.Resampling = FINAL_RESAMPLE,
+        source: Image.Image | None = None
+        ) -> list[export.ExportResult]:
+    """1回のデコードで複数の大きさのサムネイルを生成して保存する
+
+    ファイル名のテンプレートに{size}がなければ最後に付ける (既定ではthumbnail_1920x1080.png など)．
+
+    Args:
+        input_path (str): 元画像のパス
+        offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
+        logo_color (LogoColor, optional): ロゴの色. Defaults to LogoColor.WHITE.
+        logo_shape (LogoShape, optional): ロゴの形. Defaults to LogoShape.BANNER.
+        sizes (tuple[tuple[int, int], ...], optional): 出力する大きさ. Defaults to LADDER_SIZES.
+        export_options (export.ExportOptions | None, optional): 保存形式と圧縮の設定.
+            Noneなら既定のPNG. Defaults to None.
+        output_policy (export.OutputPolicy | None, optional): 保存先の決め方.
+            Noneなら元画像と同じフォルダのthumbnail_{size}. Defaults to None.
+        resample (Image.Resampling, optional): 縮小フィルター. Defaults to FINAL_RESAMPLE.
+        source (Image.Image | None, optional): デコード済みの元画像 (decode_sourceの結果).
+            Noneならinput_pathからデコードする. Defaults to None.
+
+    Returns:
+        list[export.ExportResult]: 保存の結果 (sizesの順)
+    """
+    export_options = export_options or export.ExportOptions()
+    output_policy = (output_policy or export.OutputPolicy()).with_size()
+    images = render_ladder(
+        input_path, offset, rgba, logo_color, logo_shape, sizes, resample, source
+    )
+    results = []
+    for size, image in zip(sizes, images):
+        save_path = thumbnail_path(
+            input_path, export_options, output_policy,
+            offset, rgba, logo_color, logo_shape, size
+        )
+        results.append(save_thumbnail(image, save_path, export_options))
+    return results
+
+
+
+def render_thumbnail(
+        input_path: str, offset: int,
+        rgba: tuple[int, int, int, int],
+        logo_color: LogoColor = LogoColor.WHITE,
+        logo_shape: LogoShape = LogoShape.BANNER,
+        size: tuple[int, int] = (IMG_W, IMG_H),
+        draft: bool = False,
+        resample: Image.Resampling | None = None,
+        source: Image.Image | None = None) -> Image.Image:
+    """サムネイルを描画する (ファイルには保存しない)
+
+    Args:
+        input_path (str): 元画像のパス
+        offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
+        logo_color (LogoColor, optional): ロゴの色. Defaults to LogoColor.WHITE.
+        logo_shape (LogoShape, optional): ロゴの形. Defaults to LogoShape.BANNER.
+        size (tuple[int, int], optional): 描画する大きさ. 長方形やロゴもこれに合わせて縮小される.
+            Defaults to (IMG_W, IMG_H).
+        draft (bool, optional): プレビュー向けに描画する. 縮小済みの元画像をキャッシュして，
+            オフセットを変えたときは切り取り直すだけにする. Defaults to False.
+        resample (Image.Resampling | None, optional): 縮小フィルター.
+            Noneならdraftのとき PREVIEW_RESAMPLE，それ以外は FINAL_RESAMPLE. Defaults to None.
+        source (Image.Image | None, optional): デコード済みの元画像 (decode_sourceの結果．draftでないときだけ使う).
+            Noneならinput_pathからデコードする. Defaults to None.
+
+    Returns:
+        Image.Image: 描画されたサムネイル (RGB)
+    """
+    if resample is None:
+        resample = PREVIEW_RESAMPLE if draft else FINAL_RESAMPLE
+
+    # 元画像 → 切り取った下地 → 長方形とロゴ の順に描画する．
+    # 下地はその段階までの入力をキーにstage_cacheに保持されるので，
+    # 色や形だけを変えたときは長方形とロゴだけを描き直す．
+    base_key = ('base', *source_stamp(input_path), size, draft, offset, resample)
+    if draft:
+        # プレビューはオフセットを何度も変えるので，縮小済みの元画像をキャッシュして切り取り直す
+        make_base = lambda: compose_base(
+            load_source(input_path, size, resample), offset, size
+        )
+    else:
+        # 保存するサムネイルは使う範囲だけを1回で縮小する
+        make_base = lambda: render_base(
+            decode_source(input_path, size) if source is None else source,
+            offset, size, resample
+        )
+    base = _memoize(base_key, make_base)
+    return put_overlays(base, rgba, logo_color, logo_shape)
+
+
+
+def render_ladder(
+        input_path: str, offset: int,
+        rgba: tuple[int, int, int, int],
+        logo_color: LogoColor = LogoColor.WHITE,
+        logo_shape: LogoShape = LogoShape.BANNER,
+        sizes: tuple[tuple[int, int], ...] = LADDER_SIZES,
+        resample: Image.Resampling = FINAL_RESAMPLE,
+        source: Image.Image | None = None
+        ) -> list[Image.Image]:
+    """1回のデコードで複数の大きさのサムネイルを描画する (ファイルには保存しない)
+
+    元画像は一番大きい大きさに合わせて1回だけデコードして切り取り，
+    それより小さい下地はその下地を縮小して作る (縦横比が違う大きさは元画像から切り取り直す)．
+    長方形とロゴは縮小でぼやけないように大きさごとに描画する．
+
+    Args:
+        input_path (str): 元画像のパス
+        offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
+        logo_color (LogoColor, optional): ロゴの色. Defaults to LogoColor.WHITE.
+        logo_shape (LogoShape, optional): ロゴの形. Defaults to LogoShape.BANNER.
+        sizes (tuple[tuple[int, int], ...], optional): 描画する大きさ. Defaults to LADDER_SIZES.
+        resample (Image.Resampling, optional): 縮小フィルター. Defaults to FINAL_RESAMPLE.
+        source (Image.Image | None, optional): デコード済みの元画像
+            (ladder_master_size(sizes)でのdecode_sourceの結果). Noneならinput_pathからデコードする.
+            Defaults to None.
+
+    Returns:
+        list[Image.Image]: 描画されたサムネイル (RGB, sizesの順)
+    """
+    if source is None:
+        source = decode_source(input_path, ladder_master_size(sizes))
+    return compose_ladder(source, offset, rgba, logo_color, logo_shape, sizes, resample)
+
+
+
+def ladder_master_size(sizes: tuple[tuple[int, int], ...]) -> tuple[int, int]:
+    """複数の大きさのうち，元画像をデコードする基準になる一番大きいもの"""
+    return tuple(max(sizes, key=lambda size: size[0] * size[1]))
+
+
+
+def compose_ladder(
+        source: Image.Image, offset: int,
+        rgba: tuple[int, int, int, int],
+        logo_color: LogoColor = LogoColor.WHITE,
+        logo_shape: LogoShape = LogoShape.BANNER,
+        sizes: tuple[tuple[int, int], ...] = LADDER_SIZES,
+        resample: Image.Resampling = FINAL_RESAMPLE
+        ) -> list[Image.Image]:
+    """デコード済みの元画像から複数の大きさのサムネイルを描画する
+
+    Args:
+        source (Image.Image): デコード済みの元画像 (decode_sourceの戻り値)
+        offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
+        logo_color (LogoColor, optional): ロゴの色. Defaults to LogoColor.WHITE.
+        logo_shape (LogoShape, optional): ロゴの形. Defaults to LogoShape.BANNER.
+        sizes (tuple[tuple[int, int], ...], optional): 描画する大きさ. Defaults to LADDER_SIZES.
+        resample (Image.Resampling, optional): 縮小フィルター. Defaults to FINAL_RESAMPLE.
+
+    Returns:
+        list[Image.Image]: 描画されたサムネイル (RGB, sizesの順)
+    """
+    bases = ladder_bases(source, offset, sizes, resample)
+    return [put_overlays(base, rgba, logo_color, logo_shape) for base in bases]
+
+
+
+def ladder_bases(
+        source: Image.Image, offset: int,
+        sizes: tuple[tuple[int, int], ...] = LADDER_SIZES,
+        resample: Image.Resampling = FINAL_RESAMPLE
+        ) -> list[Image.Image]:
+    """デコード済みの元画像から複数の大きさの下地を作る
+
+    一番大きい下地だけを元画像から縮小し，縦横比が同じ小さい下地はそれを縮小して作る．
+
+    Args:
+        source (Image.Image): デコード済みの元画像
+        offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        sizes (tuple[tuple[int, int], ...], optional): 下地の大きさ. Defaults to LADDER_SIZES.
+        resample (Image.Resampling, optional): 縮小フィルター. Defaults to FINAL_RESAMPLE.
+
+    Returns:
+        list[Image.Image]: 下地 (RGB, sizesの順)
+    """
+    master_size = ladder_master_size(sizes)
+    master = render_base(source, offset, master_size, resample)
+
+    bases = []
+    for size in sizes:
+        size = tuple(size)
+        if size == master_size:
+            bases.append(master)
+        elif size[0] * master_size[1] == size[1] * master_size[0]:
+            with instrument.span('resize'):
+                bases.append(master.resize(size, resample, reducing_gap=reducing_gap(resample)))
+        else:
+            bases.append(render_base(source, offset, size, resample))
+    return bases
+
+
+
+def put_overlays(
+        base: Image.Image, rgba: tuple[int, int, int, int],
+        logo_color: LogoColor = LogoColor.WHITE,
+        logo_shape: LogoShape = LogoShape.BANNER
+        ) -> Image.Image:
+    """下地に長方形とロゴを描画する (下地は書き換えない)
+
+    NumPyがあれば，下地をコピーしたRGBのバッファ1枚に，長方形の帯とロゴを
+    それぞれ不透明な部分の外接矩形の範囲だけ直接合成する (画像全体のRGBAを作らない)．
+    NumPyがなければput_bannerとput_logoで合成する．
+
+    Args:
+        base (Image.Image): 下地
+        rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
+        logo_color (LogoColor, optional): ロゴの色. Defaults to LogoColor.WHITE.
+        logo_shape (LogoShape, optional): ロゴの形. Defaults to LogoShape.BANNER.
+
+    Returns:
+        Image.Image: 描画されたサムネイル (RGB)
+    """
+    if not composite.AVAILABLE:
+        # put_bannerはRGBAに変換した複製に描画するので，baseは書き換わらない
+        return put_logo(put_banner(base, rgba, logo_shape), logo_color).convert('RGB')
+
+    with instrument.span('banner'):
+        frame = composite.new_frame(base)
+        banner, y0 = get_banner_layer(logo_shape, rgba, base.size)
+        banner.blend(frame, (0, y0))
+    with instrument.span('logo'):
+        logo, position = get_logo_layer(logo_color, base.size)
+        logo.blend(frame, position)
+        return composite.to_image(frame)
+
+
+
+def _memoize(key: tuple, make: Callable[[], Image.Image]) -> Image.Image:
+    """描画の途中結果をstage_cacheから取得する. なければ作って登録する.
+
+    Args:
+        key (tuple): 段階とその入力を表すキー
+        make (Callable[[], Image.Image]): 途中結果を作る関数
+
+    Returns:
+        Image.Image: 途中結果 (共有されるので変更しないこと)
+    """
+    image = stage_cache.get(key)
+    if image is None:
+        instrument.count('stage_cache_miss')
+        image = make()
+        stage_cache.put(key, image)
+    else:
+        instrument.count('stage_cache_hit')
+    return image
+
+
+
+def compose_base(
+        image: Image.Image, offset: int = 0,
+        size: tuple[int, int] = (IMG_W, IMG_H)
+        ) -> Image.Image:
+    """リサイズ済みの元画像を切り取って白い下地に貼り付ける
+
+    Args:
+        image (Image.Image): cover_sizeの大きさにリサイズされた元画像
+        offset (int, optional): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        size (tuple[int, int], optional): 下地の大きさ. Defaults to (IMG_W, IMG_H).
+
+    Returns:
+        Image.Image: 下地 (RGB)
+    """
+    with instrument.span('crop'):
+        canvas = Image.new('RGB', size, (255, 255, 255))
+        canvas.paste(crop(image, offset, size), (0, 0))
+    return canvas
+
+
+
+def render_base(
+        source: Image.Image, offset: int = 0,
+        size: tuple[int, int] = (IMG_W, IMG_H),
+        resample: Image.Resampling = FINAL_RESAMPLE
+        ) -> Image.Image:
+    """デコード済みの元画像から使う範囲だけを縮小して白い下地に貼り付ける
+
+    Args:
+        source (Image.Image): デコード済みの元画像 (リサイズしていないもの)
+        offset (int, optional): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        size (tuple[int, int], optional): 下地の大きさ. Defaults to (IMG_W, IMG_H).
+        resample (Image.Resampling, optional): 縮小フィルター. Defaults to FINAL_RESAMPLE.
+
+    Returns:
+        Image.Image: 下地 (RGB)
+    """
+    # 切り取りは縮小と一緒に行うので，cropは下地に貼り付ける時間
+    resized = resize(source, offset, size, resample)
+    with instrument.span('crop'):
+        canvas = Image.new('RGB', size, (255, 255, 255))
+        canvas.paste(resized, (0, 0))
+    return canvas
+
+
+
+def render_preview(
+        input_path: str, offset: int,
+        rgba: tuple[int, int, int, int],
+        logo_color: LogoColor = LogoColor.WHITE,
+        logo_shape: LogoShape = LogoShape.BANNER) -> Image.Image:
+    """プレビュー用にサムネイルを低解像度で描画する
 
     Args:
         input_path (str): 元画像のパス
@@ -28,50 +435,353 @@ def generate_thumbnail(
         rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
         logo_color (LogoColor, optional): ロゴの色. Defaults to LogoColor.WHITE.
         logo_shape (LogoShape, optional): ロゴの形. Defaults to LogoShape.BANNER.
+
+    Returns:
+        Image.Image: 描画されたプレビュー (RGB, PREVIEW_SIZE)
+    """
+    return render_thumbnail(
+        input_path, offset, rgba, logo_color, logo_shape,
+        size=PREVIEW_SIZE, draft=True
+    )
+
+
+
+def thumbnail_path(
+        input_path: str,
+        export_options: export.ExportOptions | None = None,
+        output_policy: export.OutputPolicy | None = None,
+        offset: int = 0,
+        rgba: tuple[int, int, int, int] = (0, 0, 0, 255),
+        logo_color: LogoColor = LogoColor.WHITE,
+        logo_shape: LogoShape = LogoShape.BANNER,
+        size: tuple[int, int] = (IMG_W, IMG_H)) -> str:
+    """サムネイルの保存先のパスを取得する
+
+    描画パラメータはファイル名のテンプレートの置換 ({shape}, {hash} など) に使う．
+
+    Args:
+        input_path (str): 元画像のパス
+        export_options (export.ExportOptions | None, optional): 保存形式の設定 (拡張子を決める).
+            Noneなら既定のPNG. Defaults to None.
+        output_policy (export.OutputPolicy | None, optional): 保存先の決め方.
+            Noneなら元画像と同じフォルダのthumbnail. Defaults to None.
+        offset (int, optional): 画像の縦方向のオフセット. Defaults to 0.
+        rgba (tuple[int, int, int, int], optional): 長方形の色(R, G, B, A). Defaults to (0, 0, 0, 255).
+        logo_color (LogoColor, optional): ロゴの色. Defaults to LogoColor.WHITE.
+        logo_shape (LogoShape, optional): ロゴの形. Defaults to LogoShape.BANNER.
+        size (tuple[int, int], optional): サムネイルの大きさ. Defaults to (IMG_W, IMG_H).
+
+    Returns:
+        str: 保存先のパス (既定では元画像と同じフォルダのthumbnail.png など)
+    """
+    export_options = export_options or export.ExportOptions()
+    output_policy = output_policy or export.OutputPolicy()
+    tokens = {
+        'shape': logo_shape.name.lower(),
+        'logo': logo_color.name.lower(),
+        'color': ''.join(f'{c:02x}' for c in rgba),
+        'offset': str(offset),
+    }
+    params = (source_stamp(input_path), tokens, export_options.suffix)
+    if tuple(size) != (IMG_W, IMG_H):
+        # フルHDのときは大きさを入れる前と同じハッシュにする
+        params += (tuple(size),)
+    tokens['hash'] = hashlib.sha1(repr(params).encode('utf-8')).hexdigest()[:10]
+    tokens['size'] = f'{size[0]}x{size[1]}'
+    return output_policy.path_for(input_path, export_options.suffix, tokens)
+
+
+
+def save_thumbnail(
+        image: Image.Image, save_path: str,
+        export_options: export.ExportOptions | None = None
+        ) -> export.ExportResult:
+    """描画済みのサムネイルを保存する
+
+    Args:
+        image (Image.Image): render_thumbnailで描画したサムネイル
+        save_path (str): 保存先のパス
+        export_options (export.ExportOptions | None, optional): 保存形式と圧縮の設定.
+            Noneなら既定のPNG. Defaults to None.
+
+    Returns:
+        export.ExportResult: 保存の結果 (保存先，サイズ，エンコード時間)
     """
-    image = Image.open(input_path).copy()
-    image = resize(image, offset)
+    return export.export(image, save_path, export_options or export.ExportOptions())
 
-    canvas = Image.new('RGB', (1920, 1080), (255, 255, 255))
-    canvas.paste(image, (0, 0))
-    canvas = put_banner(canvas, rgba, logo_shape)
-    canvas = put_logo(canvas, logo_color)
-    
-    save_path = str(pathlib.Path(input_path).parent / 'thumbnail.png')
-    canvas.save(save_path)
 
 
+def source_stamp(input_path: str) -> tuple[str, int, int]:
+    """元画像を識別する組を取得する (ファイルが書き換えられると変わる)
 
-def resize(image: Image.Image, offset: int = 0) -> Image.Image:
+    Args:
+        input_path (str): 元画像のパス
+
+    Returns:
+        tuple[str, int, int]: (絶対パス, 更新時刻[ns], ファイルサイズ)
+    """
+    path = os.path.abspath(input_path)
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+
+def load_source(
+        input_path: str, size: tuple[int, int] = (IMG_W, IMG_H),
+        resample: Image.Resampling = PREVIEW_RESAMPLE) -> Image.Image:
+    """元画像を開いて，指定の大きさを覆うように縦横比を保ってリサイズする
+
+    結果は (パス, 更新時刻, ファイルサイズ, 大きさ, フィルター) をキーにsource_cacheに保持されるので，
+    同じ画像を何度描画してもデコードは1回で済む. 戻り値は共有されるので変更しないこと.
+
+    Args:
+        input_path (str): 元画像のパス
+        size (tuple[int, int], optional): 覆う大きさ. Defaults to (IMG_W, IMG_H).
+        resample (Image.Resampling, optional): 縮小フィルター. Defaults to PREVIEW_RESAMPLE.
+
+    Returns:
+        Image.Image: リサイズされた元画像 (切り取りはしていない)
+    """
+    key = (*source_stamp(input_path), size, resample)
+    image = source_cache.get(key)
+    if image is not None:
+        instrument.count('source_cache_hit')
+        return image
+
+    instrument.count('source_cache_miss')
+    source = decode_source(input_path, size)
+    with instrument.span('resize'):
+        image = source.resize(
+            cover_size(source.size, size), resample, reducing_gap=reducing_gap(resample)
+        )
+    source_cache.put(key, image)
+    return image
+
+
+
+def decode_source(
+        input_path: str | IO[bytes], size: tuple[int, int] = (IMG_W, IMG_H),
+        reduce: bool = True) -> Image.Image:
+    """元画像をデコードする (キャッシュしない)
+
+    reduceのときは，sizeを覆うのに足りる範囲でできるだけ小さくデコードする．
+    JPEGはデコードしながら1/2，1/4，1/8に縮小し (draft)，全体をデコードしない．
+    それ以外の形式はデコードしてから整数分の1に縮小する (reduce)．
+
+    Args:
+        input_path (str | IO[bytes]): 元画像のパス (または開いたファイル)
+        size (tuple[int, int], optional): 描画する大きさ. Defaults to (IMG_W, IMG_H).
+        reduce (bool, optional): 小さくデコードする. Defaults to True.
+
+    Returns:
+        Image.Image: デコードされた元画像 (sizeを覆う大きさ以上)
+    """
+    with instrument.span('decode'), Image.open(input_path) as source:
+        if reduce:
+            # JPEG以外では何もしない
+            source.draft(None, cover_size(source.size, size))
+        source.load()
+        factor = reduce_factor(source.size, size) if reduce else 1
+        if factor > 1 and source.mode in REDUCIBLE_MODES:
+            source = source.reduce(factor)
+        instrument.count('decoded_bytes', image_nbytes(source))
+        return source
+
+
+
+def reduce_factor(image_size: tuple[int, int], size: tuple[int, int]) -> int:
+    """縮小してもsizeを覆える最大の整数倍率
+
+    Args:
+        image_size (tuple[int, int]): 元画像の大きさ
+        size (tuple[int, int]): 覆う大きさ
+
+    Returns:
+        int: 倍率 (1なら縮小しない)
+    """
+    cover_w, cover_h = cover_size(image_size, size)
+    return max(min(image_size[0] // cover_w, image_size[1] // cover_h), 1)
+
+
+
+def estimate_memory(input_path: str, size: tuple[int, int] = (IMG_W, IMG_H)) -> int:
+    """1枚を描画するのに必要なメモリのおおよその量 (ヘッダーだけを読んで見積もる)
+
+    Args:
+        input_path (str): 元画像のパス
+        size (tuple[int, int], optional): 描画する大きさ. Defaults to (IMG_W, IMG_H).
+
+    Returns:
+        int: 見積もり [byte]
+    """
+    with Image.open(input_path) as source:
+        source.draft(None, cover_size(source.size, size))
+        w, h = source.size
+        bands = len(source.getbands())
+    # デコード結果 (reduceする場合はその結果も) と，下地・合成用のバッファ・描画結果
+    factor = reduce_factor((w, h), size)
+    decoded = w * h * bands
+    if factor > 1:
+        decoded += (w // factor) * (h // factor) * bands
+    return decoded + size[0] * size[1] * (3 + 4 + 4)
+
+
+
+def cover_size(image_size: tuple[int, int], size: tuple[int, int]) -> tuple[int, int]:
+    """縦横比を保ったまま指定の大きさを覆うのに必要な大きさを求める
+
+    Args:
+        image_size (tuple[int, int]): 元画像の大きさ
+        size (tuple[int, int]): 覆う大きさ
+
+    Returns:
+        tuple[int, int]: 縦横比を保って拡大縮小した後の大きさ
+    """
+    w, h = size
+    image_aspect_ratio = image_size[0] / image_size[1]
+    if image_aspect_ratio > w / h:
+        # 画像が横長すぎる場合
+        return (int(h * image_aspect_ratio), h)
+    else:
+        # 画像が縦長すぎる場合
+        return (w, int(w // image_aspect_ratio))
+
+
+
+def resize(
+        image: Image.Image, offset: int = 0,
+        size: tuple[int, int] = (IMG_W, IMG_H),
+        resample: Image.Resampling = FINAL_RESAMPLE
+        ) -> Image.Image:
     """画像をフルHD(横長，1920x1080)にリサイズする（縦横比は保つ，あふれた部分は切り取る）
 
+    cover_sizeに縮小してからcropで切り取るのと同じ範囲を，元画像の使う部分だけから1回で縮小する．
+
     Args:
         image (Image.Image): リサイズするPIL Imageオブジェクト
         offset (int, optional): 画像の縦方向のオフセット. デフォルトは0. 負なら下に，正なら上にずれる.
+        size (tuple[int, int], optional): リサイズ後の大きさ. オフセットはIMG_H基準の値として
+            この大きさに合わせて縮小される. Defaults to (IMG_W, IMG_H).
+        resample (Image.Resampling, optional): 縮小フィルター. Defaults to FINAL_RESAMPLE.
 
     Returns:
         Image.Image: リサイズされたPIL Imageオブジェクト
     """
-    after_aspect_ratio = 1920 / 1080  # フルHDの縦横比に合わせる
-    image_aspect_ratio = image.width / image.height
-    center = ((1080 + offset) // 2, 1920 // 2)
+    w, h = size
+    cover_w, cover_h = cover_size(image.size, size)
+    sx = image.width / cover_w
+    sy = image.height / cover_h
+    top = crop_top(offset, size)
 
-    if image_aspect_ratio > after_aspect_ratio:
-        # 画像が横長すぎる場合
-        image = image.resize((1080 * image_aspect_ratio, 1080))
-    else:
-        # 画像が縦長すぎる場合
-        image = image.resize((1920, int(1920 // image_aspect_ratio)))
+    # 元画像からはみ出す部分 (オフセットが大きいとき) は黒のまま (cropと同じ)
+    y0 = max(top, 0)
+    y1 = min(top + h, cover_h)
+    with instrument.span('resize'):
+        if y0 == top and y1 == top + h:
+            return resize_region(image, size, (0, y0 * sy, w * sx, y1 * sy), (sx, sy), resample)
+        result = Image.new(image.mode, size)
+        if y1 > y0:
+            part = resize_region(image, (w, y1 - y0), (0, y0 * sy, w * sx, y1 * sy), (sx, sy), resample)
+            result.paste(part, (0, y0 - top))
+        return result
 
-    left = center[1] - 1920 / 2
-    top = center[0] - 1080 / 2
-    right = center[1] + 1920 / 2
-    bottom = center[0] + 1080 / 2
 
 
-    # 切り取りとリサイズを実行
-    image = image.crop((left, top, right, bottom))
-    return image
+def resize_region(
+        image: Image.Image, size: tuple[int, int],
+        box: tuple[float, float, float, float], scale: tuple[float, float],
+        resample: Image.Resampling = FINAL_RESAMPLE
+        ) -> Image.Image:
+    """元画像のboxの範囲をsizeに縮小する (画像全体を縮小してから切り取るのと同じ結果になる)
+
+    Image.resizeのreducing_gapは整数分の1の縮小をboxの端から始めるので，画像全体を縮小するときと
+    ブロックの区切りがずれて結果が変わる．ここでは画像の左上に揃えたブロックで縮小してから残りを縮小する．
+
+    Args:
+        image (Image.Image): 元画像
+        size (tuple[int, int]): 縮小後の大きさ
+        box (tuple[float, float, float, float]): 元画像で縮小する範囲
+        scale (tuple[float, float]): 画像全体を縮小するときの倍率 (元画像の画素数 / 縮小後の画素数)
+        resample (Image.Resampling, optional): 縮小フィルター. Defaults to FINAL_RESAMPLE.
+
+    Returns:
+        Image.Image: 縮小された画像
+    """
+    gap = reducing_gap(resample)
+    if gap is None or image.mode not in REDUCIBLE_MODES:
+        return image.resize(size, resample, box=box, reducing_gap=gap)
+    if image.mode in ('LA', 'RGBA'):
+        # Image.resizeと同じく，乗算済みのアルファにしてから縮小する
+        premultiplied = image.convert({'LA': 'La', 'RGBA': 'RGBa'}[image.mode])
+        return resize_region(premultiplied, size, box, scale, resample).convert(image.mode)
+
+    fx = int(scale[0] / gap) or 1
+    fy = int(scale[1] / gap) or 1
+    if fx > 1 or fy > 1:
+        # フィルターがかかる範囲 (Lanczosの半径3画素分) まで含めてブロックの区切りに揃える
+        mx = 3 * scale[0] + fx
+        my = 3 * scale[1] + fy
+        x0 = max(math.floor(box[0] - mx) // fx * fx, 0)
+        y0 = max(math.floor(box[1] - my) // fy * fy, 0)
+        x1 = min(math.ceil((box[2] + mx) / fx) * fx, image.width)
+        y1 = min(math.ceil((box[3] + my) / fy) * fy, image.height)
+        image = image.reduce((fx, fy), (x0, y0, x1, y1))
+        box = ((box[0] - x0) / fx, (box[1] - y0) / fy, (box[2] - x0) / fx, (box[3] - y0) / fy)
+    return image.resize(size, resample, box=box)
+
+
+
+def reducing_gap(resample: Image.Resampling) -> float | None:
+    """縮小フィルターごとのreducing_gap (整数倍の縮小を先に行って速くする．大きいほど正確)
+
+    Args:
+        resample (Image.Resampling): 縮小フィルター
+
+    Returns:
+        float | None: Image.resizeのreducing_gap
+    """
+    if resample == Image.Resampling.NEAREST:
+        return None
+    if resample == Image.Resampling.BILINEAR:
+        return 2.0
+    return 3.0
+
+
+
+def crop_top(offset: int, size: tuple[int, int] = (IMG_W, IMG_H)) -> int:
+    """cover_sizeの大きさにリサイズした画像から切り取る範囲の上端のy座標
+
+    Args:
+        offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        size (tuple[int, int], optional): 切り取る大きさ. Defaults to (IMG_W, IMG_H).
+
+    Returns:
+        int: 上端のy座標
+    """
+    # オフセットはフルHDでの値なので描画する大きさに合わせる
+    return round(((IMG_H + offset) // 2 - IMG_H // 2) * size[1] / IMG_H)
+
+
+
+def crop(
+        image: Image.Image, offset: int = 0,
+        size: tuple[int, int] = (IMG_W, IMG_H)
+        ) -> Image.Image:
+    """リサイズ済みの画像からサムネイルの範囲を切り取る
+
+    Args:
+        image (Image.Image): cover_sizeの大きさにリサイズされた画像
+        offset (int, optional): 画像の縦方向のオフセット. デフォルトは0. 負なら下に，正なら上にずれる.
+        size (tuple[int, int], optional): 切り取る大きさ. Defaults to (IMG_W, IMG_H).
+
+    Returns:
+        Image.Image: 切り取られたPIL Imageオブジェクト
+    """
+    w, h = size
+    top = crop_top(offset, size)
+
+    # 切り取りを実行
+    return image.crop((0, top, w, top + h))
 
 
 
@@ -81,6 +791,10 @@ def put_banner(
         shape: LogoShape = LogoShape.BANNER
         ) -> Image.Image:
     """画像の下に長方形を描画する
+
+    図形の大きさは画像の高さに合わせて縮小される (IMG_Hのとき等倍).
+    合成するのは長方形がかかる下端の帯の部分だけ．
+
     Args:
         image (Image.Image): 長方形を描画するPIL Imageオブジェクト
         rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
@@ -88,104 +802,255 @@ def put_banner(
     Returns:
         Image.Image: 長方形が描画されたPIL Imageオブジェクト
     """
+    with instrument.span('banner'):
+        # RGBAに変換
+        image = image.convert('RGBA')
+        banner, y0 = get_banner(shape, rgba, image.size)
+        # 元の画像と長方形を合成 (下端の帯のみ)
+        image.alpha_composite(banner, (0, y0))
+
+    return image
+
+
+
+def get_banner(
+        shape: LogoShape, rgba: tuple[int, int, int, int],
+        size: tuple[int, int] = (IMG_W, IMG_H)
+        ) -> tuple[Image.Image, int]:
+    """長方形を描画した下端の帯の画像を取得する
+
+    (形, 色, 画像の大きさ) ごとにoverlay_cacheに保持される．戻り値は共有されるので変更しないこと．
+
+    Args:
+        shape (LogoShape): 長方形の形
+        rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
+        size (tuple[int, int], optional): 合成先の画像の大きさ. Defaults to (IMG_W, IMG_H).
+
+    Returns:
+        tuple[Image.Image, int]: (帯の画像(RGBA), 合成先での帯の上端のy座標)
+    """
+    key = (shape, tuple(rgba), tuple(size))
+    cached = overlay_cache.get(key)
+    if cached is not None:
+        instrument.count('overlay_cache_hit')
+        return cached
+    instrument.count('overlay_cache_miss')
+
     from PIL import ImageDraw
 
-    # RGBAに変換
-    image = image.convert('RGBA')
+    w, h = size
+    s = h / IMG_H
+    y0 = math.floor(h - BANNER_H * s)
+    th = h - y0
     # 長方形を描画するためのImageDrawオブジェクトを作成
-    temp = Image.new('RGBA', image.size, (255, 255, 255, 0))
+    temp = Image.new('RGBA', (w, th), (255, 255, 255, 0))
     draw = ImageDraw.Draw(temp, 'RGBA')
-    # 長方形を描画
-    IMG_H = 1080
-    IMG_W = 1920
-    RADIUS = 45
+    # 長方形を描画 (座標は帯の中での値)
+    top = th - BANNER_H * s
+    radius = RADIUS * s
     match shape:
         case LogoShape.BANNER:
             draw.rectangle(
-                [(0, IMG_H - 180), (IMG_W, IMG_H)], 
+                [(0, top), (w, th)], 
                 fill=rgba
             )
         case LogoShape.TRAPEZOID:
             draw.polygon(
-                [(0, IMG_H - 180),
-                 (0, IMG_H),
-                 (840, IMG_H),
-                 (720, IMG_H - 180)],
+                [(0, top),
+                 (0, th),
+                 (840 * s, th),
+                 (720 * s, top)],
                 fill=rgba
             )
         case LogoShape.SOFT_TRAPEZOID:
             draw.rounded_rectangle(
-                [(0, IMG_H - 180), (720, IMG_H)], 
-                radius=RADIUS, fill=rgba
+                [(0, top), (720 * s, th)], 
+                radius=radius, fill=rgba
             )
             draw.rectangle(
-                [(0, IMG_H - 180), (RADIUS, IMG_H)],
+                [(0, top), (radius, th)],
                 fill=rgba
             )
             draw.rectangle(
-                [(720 - RADIUS, IMG_H - RADIUS), (720, IMG_H)],
+                [(720 * s - radius, th - radius), (720 * s, th)],
                 fill=rgba
             )
             draw.polygon(
-                [(720 - RADIUS + (3 / (13**(1/2))) * RADIUS, IMG_H),
-                 (840, IMG_H),
-                 (720 - RADIUS + (3 / (13**(1/2))) * RADIUS,
-                  IMG_H - 180 + RADIUS - (2 / (13**(1/2))) * RADIUS)],
+                [(720 * s - radius + (3 / (13**(1/2))) * radius, th),
+                 (840 * s, th),
+                 (720 * s - radius + (3 / (13**(1/2))) * radius,
+                  top + radius - (2 / (13**(1/2))) * radius)],
                 fill=rgba
             )
         case LogoShape.SOFT_RECTANGLE:
             draw.rounded_rectangle(
-                [(0, IMG_H - 180), (720, IMG_H)], 
-                radius=RADIUS, fill=rgba
+                [(0, top), (720 * s, th)], 
+                radius=radius, fill=rgba
             )
             draw.rectangle(
-                [(0, IMG_H - 180), (RADIUS, IMG_H)],
+                [(0, top), (radius, th)],
                 fill=rgba
             )
             draw.rectangle(
-                [(720 - RADIUS, IMG_H - RADIUS), (720, IMG_H)],
+                [(720 * s - radius, th - radius), (720 * s, th)],
                 fill=rgba
             )
         case _:
-            draw.rectangle((0, image.height * 5 / 6, image.width, image.height), fill=rgba)
-    # 元の画像と長方形を合成
-    image = Image.alpha_composite(image, temp)
+            draw.rectangle((0, h * 5 / 6 - y0, w, th), fill=rgba)
 
-    return image
+    overlay_cache.put(key, (temp, y0))
+    return temp, y0
 
 
 
-def put_logo(image: Image.Image, bw: LogoColor) -> Image.Image:
-    """画像の左下にロゴを描画する
+def get_banner_layer(
+        shape: LogoShape, rgba: tuple[int, int, int, int],
+        size: tuple[int, int] = (IMG_W, IMG_H)
+        ) -> tuple[composite.Layer, int]:
+    """NumPyで合成するための長方形の帯を取得する (overlay_cacheに保持される)
 
     Args:
-        image (Image.Image): ロゴを描画するPIL Imageオブジェクト
-        bw (LogoColor): ロゴの色
+        shape (LogoShape): 長方形の形
+        rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
+        size (tuple[int, int], optional): 合成先の画像の大きさ. Defaults to (IMG_W, IMG_H).
 
     Returns:
-        Image.Image: ロゴが描画されたPIL Imageオブジェクト
+        tuple[composite.Layer, int]: (帯, 合成先での帯の上端のy座標)
     """
-    from PIL import Image
+    key = ('layer', shape, tuple(rgba), tuple(size))
+    cached = overlay_cache.get(key)
+    if cached is not None:
+        return cached
+
+    banner, y0 = get_banner(shape, rgba, size)
+    layer = (composite.Layer(banner), y0)
+    overlay_cache.put(key, layer)
+    return layer
+
+
+
+# 読み込み済みのロゴ ((色, 高さ) -> (ロゴ, マスク))
+_logos: dict[tuple[LogoColor, int], tuple[Image.Image, Image.Image]] = {}
+# NumPyで合成するためのロゴ ((色, 高さ) -> ロゴ)
+_logo_layers: dict[tuple[LogoColor, int], composite.Layer] = {}
+_logos_lock = threading.Lock()
+
+
+def logo_path(bw: LogoColor) -> str:
+    """ロゴ画像のパスを取得する
+
+    Args:
+        bw (LogoColor): ロゴの色
 
-    # ロゴ画像のパスを決定
+    Returns:
+        str: ロゴ画像のパス
+    """
     if bw == LogoColor.BLACK:
-        logo_path = str(pathlib.Path(misc.base_dir() / 'img/logo_black.png'))
+        return str(pathlib.Path(misc.base_dir() / 'img/logo_black.png'))
     elif bw == LogoColor.WHITE:
-        logo_path = str(pathlib.Path(misc.base_dir() / 'img/logo_white.png'))
+        return str(pathlib.Path(misc.base_dir() / 'img/logo_white.png'))
     else:
         raise ValueError('Invalid logo color')
 
-    # ロゴ画像を開く
-    logo = Image.open(logo_path).convert('RGBA')
-    # ロゴのサイズを決定（画像の高さの1/6に合わせる）
-    LOGO_H = 120
-    logo_w = int(logo.width * (LOGO_H / logo.height)) # approx. 570
-    logo = logo.resize((logo_w, LOGO_H))
-
-    IMG_H = 1080
-    IMG_W = 1920
-    # ロゴを画像の左下に貼り付ける
-    image.paste(logo, (75, IMG_H - LOGO_H - 30), logo)
+
+
+def logo_version() -> str:
+    """ロゴ画像の版 (ロゴ画像の中身のハッシュ)
+
+    Returns:
+        str: ロゴ画像が差し替えられると変わる文字列
+    """
+    global _logo_version
+    if _logo_version is None:
+        digest = hashlib.sha1()
+        for bw in LogoColor:
+            with open(logo_path(bw), 'rb') as f:
+                digest.update(f.read())
+        _logo_version = digest.hexdigest()[:12]
+    return _logo_version
+
+
+_logo_version: str | None = None
+
+
+
+def get_logo(bw: LogoColor, logo_h: int = LOGO_H) -> tuple[Image.Image, Image.Image]:
+    """縮小済みのロゴとそのアルファマスクを取得する
+
+    ロゴは(色, 高さ)ごとにプロセス内で1回だけ読み込まれ，以降は使い回される．
+    戻り値は共有されるので変更しないこと．
+
+    Args:
+        bw (LogoColor): ロゴの色
+        logo_h (int, optional): ロゴの高さ. Defaults to LOGO_H.
+
+    Returns:
+        tuple[Image.Image, Image.Image]: (ロゴ(RGBA), アルファマスク(L))
+    """
+    key = (bw, logo_h)
+    logo = _logos.get(key)
+    if logo is not None:
+        return logo
+
+    with _logos_lock:
+        logo = _logos.get(key)
+        if logo is None:
+            # ロゴ画像を開く
+            with Image.open(logo_path(bw)) as source:
+                image = source.convert('RGBA')
+            logo_w = int(image.width * (logo_h / image.height)) # approx. 570
+            image = image.resize((logo_w, logo_h))
+            logo = (image, image.getchannel('A'))
+            _logos[key] = logo
+    return logo
+
+
+def get_logo_layer(
+        bw: LogoColor, size: tuple[int, int] = (IMG_W, IMG_H)
+        ) -> tuple[composite.Layer, tuple[int, int]]:
+    """NumPyで合成するためのロゴと，その貼り付け位置を取得する
+
+    Args:
+        bw (LogoColor): ロゴの色
+        size (tuple[int, int], optional): 合成先の画像の大きさ. Defaults to (IMG_W, IMG_H).
+
+    Returns:
+        tuple[composite.Layer, tuple[int, int]]: (ロゴ, 合成先でのロゴの左上)
+    """
+    s = size[1] / IMG_H
+    logo_h = round(LOGO_H * s)
+    position = (round(LOGO_X * s), size[1] - logo_h - round(LOGO_MARGIN_BOTTOM * s))
+    key = (bw, logo_h)
+    layer = _logo_layers.get(key)
+    if layer is None:
+        logo, _ = get_logo(bw, logo_h)
+        with _logos_lock:
+            layer = _logo_layers.setdefault(key, composite.Layer(logo))
+    return layer, position
+
+
+
+def put_logo(image: Image.Image, bw: LogoColor) -> Image.Image:
+    """画像の左下にロゴを描画する
+
+    ロゴの大きさは画像の高さに合わせて縮小される (IMG_Hのとき等倍).
+
+    Args:
+        image (Image.Image): ロゴを描画するPIL Imageオブジェクト
+        bw (LogoColor): ロゴの色
+
+    Returns:
+        Image.Image: ロゴが描画されたPIL Imageオブジェクト
+    """
+    with instrument.span('logo'):
+        # ロゴのサイズを決定（画像の高さの1/6に合わせる）
+        s = image.height / IMG_H
+        logo_h = round(LOGO_H * s)
+        logo, mask = get_logo(bw, logo_h)
+
+        # ロゴを画像の左下に貼り付ける
+        position = (round(LOGO_X * s), image.height - logo_h - round(LOGO_MARGIN_BOTTOM * s))
+        image.paste(logo, position, mask)
     return image
 
 
@@ -0,0 +1,373 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator, Protocol
+import io
+import json
+import os
+import threading
+import time
+
+# 描画の段階 (spanの名前)
+STAGES = ('decode', 'resize', 'crop', 'banner', 'logo', 'encode', 'write')
+
+
+@dataclass(frozen=True)
+class TraceOptions:
+    """計測で追加で取るもの (どちらも処理が遅くなるので必要なときだけ使う)"""
+    profile: bool = False  # cProfileで関数ごとの時間を取る
+    memory: bool = False  # tracemallocでPythonのメモリ確保量の最大値を取る
+    profile_limit: int = 25  # プロファイルに残す関数の数
+
+
+
+@dataclass
+class RenderTrace:
+    """1件分の描画の計測結果"""
+    name: str  # 何を描画したか (元画像のパスなど)
+    started: float = field(default_factory=time.time)  # 開始時刻 (UNIX時間)
+    stages: dict[str, float] = field(default_factory=dict)  # 段階ごとの時間の合計 [秒]
+    counts: dict[str, int] = field(default_factory=dict)  # キャッシュのヒット数やバイト数
+    elapsed: float = 0.0  # 全体の時間 [秒]
+    error: str | None = None
+    profile: str | None = None  # cProfileの結果 (TraceOptions.profileのとき)
+    peak_memory: int | None = None  # メモリ確保量の最大値 [byte] (TraceOptions.memoryのとき)
+
+    @property
+    def bound(self) -> str | None:
+        """一番時間がかかった段階 (decodeならデコード律速，encodeならエンコード律速)"""
+        if not self.stages:
+            return None
+        return max(self.stages, key=self.stages.__getitem__)
+
+
+    def summary(self) -> str:
+        """段階ごとの時間を1行にする (例: 'decode 31ms, resize 120ms, ... (計 180ms)')"""
+        stages = ', '.join(
+            f'{stage} {self.stages[stage] * 1000:.0f}ms' for stage in STAGES if stage in self.stages
+        )
+        return f'{stages} (計 {self.elapsed * 1000:.0f}ms)'
+
+
+    def record(self) -> dict:
+        """JSONにできる形にする"""
+        record = {
+            'name': self.name,
+            'started': round(self.started, 3),
+            'elapsed': round(self.elapsed, 6),
+            'stages': {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+            'counts': dict(self.counts),
+            'bound': self.bound,
+            'error': self.error,
+        }
+        if self.peak_memory is not None:
+            record['peak_memory'] = self.peak_memory
+        if self.profile is not None:
+            record['profile'] = self.profile
+        return record
+
+
+
+# 現在のスレッド(コンテキスト)で計測中の描画
+_current: ContextVar[RenderTrace | None] = ContextVar('thumbgen_trace', default=None)
+# configureで決めた計測の設定 (traceでoptionsを省略したときに使う)
+_default_options = TraceOptions()
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """段階の時間を計測中の描画に足す (計測中でなければ何もしない)
+
+    Args:
+        stage (str): 段階の名前 (STAGESのどれか)
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.stages[stage] = trace.stages.get(stage, 0.0) + time.perf_counter() - start
+
+
+
+def count(name: str, n: int = 1):
+    """計測中の描画の数を足す (計測中でなければ何もしない)
+
+    Args:
+        name (str): 名前 (source_cache_hit, output_bytes など)
+        n (int, optional): 足す数. Defaults to 1.
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.counts[name] = trace.counts.get(name, 0) + n
+
+
+
+@contextmanager
+def trace(name: str, options: TraceOptions | None = None) -> Iterator[RenderTrace]:
+    """この中で行った描画を計測する
+
+    終わってもsinkには送らないので，必要ならemitで送る
+    (ワーカープロセスで計測して，結果を受け取った親プロセスで送れるようにするため)．
+
+    Args:
+        name (str): 何を描画するか (元画像のパスなど)
+        options (TraceOptions | None, optional): 追加で取るもの.
+            Noneならconfigureで決めた設定. Defaults to None.
+
+    Yields:
+        Iterator[RenderTrace]: 計測結果 (終わると埋まる)
+    """
+    options = options or _default_options
+    result = RenderTrace(name)
+    token = _current.set(result)
+    profiler = None
+    if options.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    started_tracemalloc = False
+    if options.memory:
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+            started_tracemalloc = True
+    start = time.perf_counter()
+    try:
+        yield result
+    except Exception as e:
+        result.error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        result.elapsed = time.perf_counter() - start
+        if profiler is not None:
+            import pstats
+            profiler.disable()
+            stream = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(options.profile_limit)
+            result.profile = stream.getvalue()
+        if options.memory:
+            result.peak_memory = tracemalloc.get_traced_memory()[1]
+            if started_tracemalloc:
+                tracemalloc.stop()
+        _current.reset(token)
+
+
+
+@contextmanager
+def activate(trace: RenderTrace | None) -> Iterator[None]:
+    """計測中の描画を別のスレッドで続ける (パイプラインの段階ごとのスレッドで使う)
+
+    Args:
+        trace (RenderTrace | None): 続ける計測結果. Noneなら計測しない.
+    """
+    token = _current.set(trace)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+
+class Sink(Protocol):
+    """計測結果の送り先"""
+    def emit(self, trace: RenderTrace): ...
+    def close(self): ...
+
+
+
+class JsonLinesSink:
+    """計測結果を1件1行のJSONでファイルに追記する"""
+    def __init__(self, path: str):
+        """初期化関数
+
+        Args:
+            path (str): 書き込むファイルのパス
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.__file = open(path, 'a', encoding='utf-8')
+        self.__lock = threading.Lock()
+
+
+    def emit(self, trace: RenderTrace):
+        line = json.dumps(trace.record(), ensure_ascii=False)
+        with self.__lock:
+            self.__file.write(line + '\n')
+            self.__file.flush()
+
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
+
+
+
+class PrometheusSink:
+    """計測結果を集計してPrometheusのテキスト形式にする
+
+    pathを指定すると，1件ごとにnode_exporterのtextfile collectorで読める形で書き直す．
+    """
+    def __init__(self, path: str | None = None):
+        """初期化関数
+
+        Args:
+            path (str | None, optional): 書き込むファイルのパス (.prom). Noneなら書き込まない.
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.traces = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.stages: dict[str, float] = {}
+        self.bound: dict[str, int] = {}
+        self.counts: dict[str, int] = {}
+
+
+    def emit(self, trace: RenderTrace):
+        with self.__lock:
+            self.traces += 1
+            self.errors += trace.error is not None
+            self.seconds += trace.elapsed
+            for stage, seconds in trace.stages.items():
+                self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+            if trace.bound is not None:
+                self.bound[trace.bound] = self.bound.get(trace.bound, 0) + 1
+            for name, n in trace.counts.items():
+                self.counts[name] = self.counts.get(name, 0) + n
+            text = self.text() if self.path is not None else None
+        if text is not None:
+            from utils import export
+            export.write_atomic(self.path, text.encode('utf-8'))
+
+
+    def text(self) -> str:
+        """Prometheusのテキスト形式にする"""
+        lines = [
+            '# TYPE thumbgen_traces_total counter',
+            f'thumbgen_traces_total {self.traces}',
+            '# TYPE thumbgen_trace_errors_total counter',
+            f'thumbgen_trace_errors_total {self.errors}',
+            '# TYPE thumbgen_trace_seconds_total counter',
+            f'thumbgen_trace_seconds_total {self.seconds:.6f}',
+            '# TYPE thumbgen_stage_seconds_total counter',
+            *(f'thumbgen_stage_seconds_total{{stage="{stage}"}} {seconds:.6f}'
+              for stage, seconds in sorted(self.stages.items())),
+            '# TYPE thumbgen_bound_total counter',
+            *(f'thumbgen_bound_total{{stage="{stage}"}} {n}'
+              for stage, n in sorted(self.bound.items())),
+            '# TYPE thumbgen_bytes_total counter',
+            *(f'thumbgen_bytes_total{{kind="{name.removesuffix("_bytes")}"}} {n}'
+              for name, n in sorted(self.counts.items()) if name.endswith('_bytes')),
+            '# TYPE thumbgen_events_total counter',
+            *(f'thumbgen_events_total{{event="{name}"}} {n}'
+              for name, n in sorted(self.counts.items()) if not name.endswith('_bytes')),
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+    def close(self):
+        pass
+
+
+
+# 計測結果の送り先
+_sinks: list[Sink] = []
+_sinks_lock = threading.Lock()
+
+
+def add_sink(sink: Sink):
+    """計測結果の送り先を追加する"""
+    with _sinks_lock:
+        _sinks.append(sink)
+
+
+
+def remove_sink(sink: Sink):
+    """計測結果の送り先を外して閉じる"""
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+    sink.close()
+
+
+
+def close_sinks():
+    """すべての送り先を外して閉じる"""
+    with _sinks_lock:
+        sinks = list(_sinks)
+        _sinks.clear()
+    for sink in sinks:
+        sink.close()
+
+
+
+def enabled() -> bool:
+    """送り先があるか (なければ計測しなくてよい)"""
+    return bool(_sinks)
+
+
+
+def emit(trace: RenderTrace | None):
+    """計測結果をすべての送り先に送る
+
+    Args:
+        trace (RenderTrace | None): 計測結果. Noneなら何もしない.
+    """
+    if trace is None:
+        return
+    with _sinks_lock:
+        sinks = list(_sinks)
+    for sink in sinks:
+        sink.emit(trace)
+
+
+
+def configure(
+        jsonl_path: str | None = None, metrics_path: str | None = None,
+        profile: bool = False, memory: bool = False
+        ) -> TraceOptions | None:
+    """送り先を登録して計測の設定を作る
+
+    Args:
+        jsonl_path (str | None, optional): JSON Linesの送り先のパス. Defaults to None.
+        metrics_path (str | None, optional): Prometheusのテキスト形式の送り先のパス. Defaults to None.
+        profile (bool, optional): cProfileの結果も取る. Defaults to False.
+        memory (bool, optional): tracemallocでメモリ確保量も取る. Defaults to False.
+
+    Returns:
+        TraceOptions | None: 計測の設定. 送り先がなければNone (計測しない)
+    """
+    if jsonl_path:
+        add_sink(JsonLinesSink(jsonl_path))
+    if metrics_path:
+        add_sink(PrometheusSink(metrics_path))
+    global _default_options
+    if not enabled():
+        return None
+    _default_options = TraceOptions(profile=profile, memory=memory)
+    return _default_options
+
+
+
+def configure_from_env() -> TraceOptions | None:
+    """環境変数から送り先を登録して計測の設定を作る (GUI向け)
+
+    THUMBGEN_TRACE: JSON Linesの送り先のパス
+    THUMBGEN_METRICS_FILE: Prometheusのテキスト形式の送り先のパス
+    THUMBGEN_PROFILE: 1ならcProfileの結果も取る
+    THUMBGEN_TRACE_MEMORY: 1ならtracemallocでメモリ確保量も取る
+
+    Returns:
+        TraceOptions | None: 計測の設定. 送り先がなければNone (計測しない)
+    """
+    return configure(
+        os.environ.get('THUMBGEN_TRACE'), os.environ.get('THUMBGEN_METRICS_FILE'),
+        os.environ.get('THUMBGEN_PROFILE') == '1', os.environ.get('THUMBGEN_TRACE_MEMORY') == '1'
+    )
@@ -0,0 +1,350 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from enum import Enum
+from typing import Callable, Iterator, TextIO
+from utils import batch, export, img, instrument, misc
+import csv
+import json
+import os
+import pathlib
+import time
+
+# 出力先の拡張子から決まる保存形式
+SUFFIX_FORMATS = {
+    '.png': export.OutputFormat.PNG,
+    '.jpg': export.OutputFormat.JPEG,
+    '.jpeg': export.OutputFormat.JPEG,
+    '.webp': export.OutputFormat.WEBP,
+}
+
+
+@dataclass
+class ManifestRow:
+    """マニフェストの1行分のジョブ"""
+    index: int  # 行番号 (データ行の0始まり)
+    path: str  # 元画像のパス
+    options: batch.RenderOptions | None = None  # 描画パラメータ (読めなかった場合はNone)
+    error: str | None = None  # 行が読めなかった場合はその内容
+
+
+
+def read_manifest(
+        manifest_path: str, defaults: batch.RenderOptions
+        ) -> Iterator[ManifestRow]:
+    """マニフェストを1行ずつ読む (ファイル全体は読み込まない)
+
+    形式は拡張子で決まる (.csvならヘッダー付きCSV，それ以外はJSON Lines)．
+    列(キー)は次の通りで，input以外は省略するとdefaultsの値になる．
+        input: 元画像のパス
+        offset: 画像の縦方向のオフセット (autoなら元画像ごとに推定する)
+        color: 長方形の色のHEXコード / opacity: 不透明度 (0-100)
+        rgba: 長方形の色 ([R, G, B, A] または 'R,G,B,A'．colorより優先)
+        logo_color: ロゴの色 (white / black)
+        logo_shape: ロゴの形 (banner など)
+        output: 保存先のパス (拡張子で保存形式が決まる)
+    相対パスはマニフェストのあるフォルダが基準になる．
+
+    Args:
+        manifest_path (str): マニフェストのパス
+        defaults (batch.RenderOptions): 省略された列の値
+
+    Yields:
+        Iterator[ManifestRow]: 1行分のジョブ
+    """
+    base = pathlib.Path(manifest_path).parent
+    with open(manifest_path, encoding='utf-8', newline='') as f:
+        for index, record in enumerate(_records(f, manifest_path)):
+            if isinstance(record, Exception):
+                yield ManifestRow(index, '', error=f'{type(record).__name__}: {record}')
+                continue
+            # 相対パスはマニフェストのあるフォルダが基準
+            path = str(record.get('input') or record.get('path') or '')
+            if path and not os.path.isabs(path):
+                path = str(base / path)
+            if record.get('output') and not os.path.isabs(str(record['output'])):
+                record['output'] = str(base / str(record['output']))
+            try:
+                if not path:
+                    raise ValueError('inputがありません')
+                options = row_options(record, defaults)
+            except (ValueError, TypeError) as e:
+                yield ManifestRow(index, path, error=f'{type(e).__name__}: {e}')
+                continue
+            yield ManifestRow(index, path, options)
+
+
+
+def _records(f: TextIO, manifest_path: str) -> Iterator[dict | Exception]:
+    """マニフェストのデータ行を辞書にする (空行とコメント行は飛ばす)"""
+    if manifest_path.lower().endswith('.csv'):
+        lines = (line for line in f if line.strip() and not line.startswith('#'))
+        for record in csv.DictReader(lines):
+            yield {k.strip(): v.strip() for k, v in record.items() if k and v is not None and v.strip()}
+        return
+
+    for line in f:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError('1行に1つのオブジェクトを書いてください')
+        except ValueError as e:
+            yield e
+            continue
+        yield record
+
+
+
+def row_options(record: dict, defaults: batch.RenderOptions) -> batch.RenderOptions:
+    """マニフェストの1行から描画パラメータを作る
+
+    Args:
+        record (dict): 1行分の値
+        defaults (batch.RenderOptions): 省略された列の値
+
+    Returns:
+        batch.RenderOptions: 描画パラメータ
+    """
+    changes = {}
+    if 'offset' in record:
+        if str(record['offset']).strip().lower() == 'auto':
+            changes['auto_offset'] = True
+        else:
+            changes['offset'] = int(record['offset'])
+            changes['auto_offset'] = False
+    if 'rgba' in record:
+        rgba = record['rgba']
+        if isinstance(rgba, str):
+            rgba = rgba.split(',')
+        rgba = tuple(int(c) for c in rgba)
+        if len(rgba) != 4 or not all(0 <= c <= 255 for c in rgba):
+            raise ValueError(f'rgbaが不正です: {record["rgba"]}')
+        changes['rgba'] = rgba
+    elif 'color' in record or 'opacity' in record:
+        hex = str(record.get('color', '')).strip().lstrip('#')
+        if 'color' in record:
+            if len(hex) != 6:
+                raise ValueError(f'HEXコードが不正です: {hex}')
+            r, g, b = misc.rgb(hex)
+        else:
+            r, g, b = defaults.rgba[:3]
+        a = defaults.rgba[3]
+        if 'opacity' in record:
+            opacity = float(record['opacity'])
+            if not 0 <= opacity <= 100:
+                raise ValueError(f'不透明度が不正です: {opacity}')
+            a = int(opacity / 100.0 * 255)
+        changes['rgba'] = (r, g, b, a)
+    if 'logo_color' in record:
+        changes['logo_color'] = _enum(img.LogoColor, record['logo_color'], 'ロゴの色')
+    if 'logo_shape' in record:
+        changes['logo_shape'] = _enum(img.LogoShape, record['logo_shape'], 'ロゴの形')
+    if 'output' in record:
+        output = pathlib.Path(str(record['output']))
+        fmt = SUFFIX_FORMATS.get(output.suffix.lower())
+        if fmt is None:
+            raise ValueError(f'保存形式が分からない拡張子です: {output}')
+        changes['export_options'] = replace(defaults.export_options, format=fmt)
+        # 拡張子は保存形式から付くので，ファイル名はそのままテンプレートにする
+        template = output.stem.replace('{', '{{').replace('}', '}}')
+        changes['output_policy'] = export.OutputPolicy(str(output.parent), template)
+    return replace(defaults, **changes)
+
+
+
+def _enum(cls: type[Enum], value: str, label: str) -> Enum:
+    """列の値 (小文字の名前) を列挙型にする"""
+    try:
+        return cls[str(value).upper()]
+    except KeyError:
+        names = ', '.join(m.name.lower() for m in cls)
+        raise ValueError(f'{label}が不正です: {value} ({names} のどれか)')
+
+
+
+class ResultLog:
+    """結果のログ (JSON Lines．1件ごとに追記してflushする)
+
+    再開するときは，ログにある成功した行を飛ばす．
+    書き込んだ行は成功・失敗を問わず「ここまで全部書き込んだ行数」と，それより後に
+    書き込んだ行の集合で持ち，失敗した行は別の集合で持つ．前者は同時に処理している数程度に
+    収まるので，メモリの使用量はマニフェストの長さではなく失敗した行の数に比例する．
+    """
+    def __init__(self, path: str, resume: bool = False):
+        """初期化関数
+
+        Args:
+            path (str): ログのパス
+            resume (bool, optional): 既存のログを読んで続きから再開する.
+                Falseならログを空にする. Defaults to False.
+        """
+        self.path = path
+        self.written_below = 0  # この行番号より前はすべて書き込み済み
+        self.__written: set[int] = set()  # written_below以降で書き込み済みの行
+        self.__failed: set[int] = set()  # 失敗した行 (あとで成功したものは除く)
+        if resume and os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 中断で書きかけになった行
+                        continue
+                    if 'row' in entry:
+                        self.__mark(int(entry['row']), entry.get('error') is None)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.__file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if self.__file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    # 書きかけの行の続きに書かないように改行する
+                    self.__file.write('\n')
+
+
+    def is_done(self, index: int) -> bool:
+        """前回までに成功した行か"""
+        written = index < self.written_below or index in self.__written
+        return written and index not in self.__failed
+
+
+    def write(self, index: int, result: batch.JobResult):
+        """1件分の結果を書き込む
+
+        Args:
+            index (int): 行番号
+            result (batch.JobResult): 処理結果
+        """
+        entry = {
+            'row': index,
+            'input': result.path,
+            'outputs': [output.path for output in result.outputs],
+            'bytes': sum(output.nbytes for output in result.outputs),
+            'elapsed': round(result.elapsed, 4),
+            'cached': result.cached,
+            'error': result.error,
+        }
+        self.__file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.__file.flush()
+        self.__mark(index, result.error is None)
+
+
+    def close(self):
+        self.__file.close()
+
+
+    def __mark(self, index: int, succeeded: bool):
+        if succeeded:
+            # 再開して成功した行 (前回の失敗はログの前の方にある)
+            self.__failed.discard(index)
+        else:
+            self.__failed.add(index)
+        self.__written.add(index)
+        while self.written_below in self.__written:
+            self.__written.remove(self.written_below)
+            self.written_below += 1
+
+
+    def __enter__(self) -> 'ResultLog':
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+def run_manifest(
+        manifest_path: str, defaults: batch.RenderOptions,
+        results_path: str, workers: int | None = None,
+        max_in_flight: int | None = None, memory_limit: int = 0,
+        resume: bool = False, on_progress: Callable[[int, str, str | None], None] | None = None
+        ) -> batch.BatchSummary:
+    """マニフェストの行ごとにサムネイルを生成する
+
+    マニフェストは1行ずつ読み，同時に処理する(デコード済みの画像を持つ)のは
+    max_in_flight件まで (memory_limitを指定した場合はさらにメモリの見積もりの範囲内) に抑える．
+    どれかが終わるまで次の行は読まないので，マニフェストが長くてもメモリの使用量は増えない．
+
+    Args:
+        manifest_path (str): マニフェスト (JSON Lines or CSV) のパス
+        defaults (batch.RenderOptions): マニフェストで省略された値
+        results_path (str): 結果のログ (JSON Lines) のパス
+        workers (int | None, optional): ワーカー数. Noneならコア数. 1ならプールを使わない.
+        max_in_flight (int | None, optional): 同時に処理する最大の件数.
+            Noneならワーカー数の2倍. Defaults to None.
+        memory_limit (int, optional): ワーカー1つあたりのメモリの上限 [byte]. 0なら制限しない.
+            batch.run_batchを参照. Defaults to 0.
+        resume (bool, optional): 結果のログにある成功した行を飛ばして再開する. Defaults to False.
+        on_progress (Callable | None, optional): 1件終わるごとに
+            (行番号, パス, エラー内容 or None) で呼ばれる. Defaults to None.
+
+    Returns:
+        batch.BatchSummary: 処理結果 (再開で飛ばした行は含まない)
+    """
+    summary = batch.BatchSummary()
+    workers = max(workers or os.cpu_count() or 1, 1)
+    max_in_flight = max(max_in_flight or workers * 2, 1)
+    start = time.perf_counter()
+
+    with ResultLog(results_path, resume) as log:
+        def record(index: int, result: batch.JobResult):
+            log.write(index, result)
+            summary.total += 1
+            if result.error is None:
+                summary.succeeded += 1
+            else:
+                summary.failed.append((result.path, result.error))
+            for output in result.outputs:
+                summary.encode_time += output.encode_time
+                summary.outputs += 1
+                summary.output_bytes += output.nbytes
+            if result.cached:
+                summary.cache_hits += 1
+            instrument.emit(result.trace)
+            if on_progress is not None:
+                on_progress(index, result.path, result.error)
+
+        rows = (row for row in read_manifest(manifest_path, defaults) if not log.is_done(row.index))
+        if workers == 1:
+            for row in rows:
+                record(row.index, _run_row(row))
+        else:
+            with ProcessPoolExecutor(
+                    max_workers=workers, initializer=batch.init_worker
+                    ) as executor:
+                def valid_rows() -> Iterator[ManifestRow]:
+                    for row in rows:
+                        if row.error is None:
+                            yield row
+                        else:
+                            record(row.index, _run_row(row))
+
+                def on_done(row: ManifestRow, future: Future):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # ワーカープロセス自体が落ちた場合
+                        result = batch.JobResult(row.path, 0.0, f'{type(e).__name__}: {e}')
+                    record(row.index, result)
+
+                batch.schedule(
+                    executor, valid_rows(),
+                    lambda executor, row: executor.submit(batch.render_one, row.path, row.options),
+                    on_done, max_in_flight, memory_limit * workers,
+                    lambda row: batch.estimate_memory(row.path, row.options)
+                )
+
+    summary.elapsed = time.perf_counter() - start
+    return summary
+
+
+
+def _run_row(row: ManifestRow) -> batch.JobResult:
+    """1行分を現在のプロセスで処理する"""
+    if row.error is not None:
+        return batch.JobResult(row.path, 0.0, row.error)
+    return batch.render_one(row.path, row.options)
+
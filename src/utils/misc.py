@@ -23,12 +23,14 @@ def rgb(hex: str) -> tuple[int, int, int]:
 def base_dir() -> Path:
     """ベースディレクトリを取得する
 
+    作業ディレクトリには依存しない (CLIをどこから実行してもロゴなどを読み込める)．
+
     Returns:
-        Path: ベースディレクトリ
+        Path: ベースディレクトリ (PyInstallerでは展開先，それ以外はリポジトリのルート)
     """
     if hasattr(sys, "_MEIPASS"):
         return Path(sys._MEIPASS)  # type: ignore
     else:
-        return Path('.')
+        return Path(__file__).resolve().parents[2]
     
 
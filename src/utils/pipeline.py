@@ -0,0 +1,344 @@
+from dataclasses import dataclass, field
+from PIL import Image
+from typing import Callable
+from utils import batch, export, img, instrument, render_cache
+import os
+import queue
+import threading
+import time
+
+_STOP = object()  # 段階の終わりを表す印
+
+
+@dataclass
+class StageStats:
+    """パイプラインの1段階分の統計"""
+    name: str
+    workers: int
+    items: int = 0  # 処理した件数
+    busy: float = 0.0  # 処理にかかった時間の合計 [秒]
+    wait: float = 0.0  # 次の段階の空きを待った時間の合計 [秒]
+
+    def utilization(self, elapsed: float) -> float:
+        """スレッドが処理をしていた時間の割合 (0-1)
+
+        Args:
+            elapsed (float): パイプライン全体の所要時間 [秒]
+
+        Returns:
+            float: 利用率
+        """
+        if elapsed <= 0 or self.workers <= 0:
+            return 0.0
+        return min(self.busy / (elapsed * self.workers), 1.0)
+
+
+
+@dataclass
+class PipelineStats:
+    """パイプラインの統計"""
+    stages: list[StageStats] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    def report(self) -> list[str]:
+        """段階ごとの利用率を表示用の文字列にする
+
+        Returns:
+            list[str]: 1段階1行
+        """
+        lines = []
+        for stage in self.stages:
+            mean = stage.busy / stage.items * 1000 if stage.items else 0.0
+            lines.append(
+                f'{stage.name:>7}: {stage.workers}スレッド 利用率 {stage.utilization(self.elapsed):5.1%} '
+                f'(平均 {mean:.1f}ms, 待ち {stage.wait:.2f}秒)'
+            )
+        return lines
+
+
+
+@dataclass
+class _Job:
+    """パイプラインを流れる1枚分の処理"""
+    path: str
+    outputs_expected: int = 0  # 出力するファイルの数
+    # 描画が必要な大きさごとの (大きさ, 保存先, キャッシュのキー)
+    targets: list[tuple[tuple[int, int], str, str | None]] = field(default_factory=list)
+    bases: list[Image.Image] = field(default_factory=list)  # 縮小・切り取り済みの下地
+    images: list[Image.Image] = field(default_factory=list)
+    outputs: list[export.ExportResult] = field(default_factory=list)
+    cache_hits: int = 0
+    error: str | None = None
+    # 計測結果 (options.traceを指定した場合．elapsedはキューで待った時間を含まない)
+    trace: instrument.RenderTrace | None = None
+
+
+
+class _Stage:
+    """パイプラインの1段階 (同じ関数を実行する複数のスレッド)"""
+    def __init__(
+            self, fn: Callable[[_Job], None], stats: StageStats,
+            inbox: queue.Queue, outbox: queue.Queue, next_workers: int
+            ):
+        """初期化関数
+
+        Args:
+            fn (Callable[[_Job], None]): ジョブを処理する関数
+            stats (StageStats): この段階の統計
+            inbox (queue.Queue): 処理するジョブのキュー
+            outbox (queue.Queue): 処理したジョブを渡すキュー
+            next_workers (int): 次の段階のスレッド数 (終わりの印を送る数)
+        """
+        self.fn = fn
+        self.stats = stats
+        self.inbox = inbox
+        self.outbox = outbox
+        self.next_workers = next_workers
+        self.__lock = threading.Lock()
+        self.__remaining = stats.workers
+
+
+    def start(self) -> list[threading.Thread]:
+        """スレッドを起動する
+
+        Returns:
+            list[threading.Thread]: 起動したスレッド
+        """
+        threads = [
+            threading.Thread(target=self.__run, name=f'thumbgen-{self.stats.name}', daemon=True)
+            for _ in range(self.stats.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+
+    def __run(self):
+        """終わりの印が来るまでinboxのジョブを処理してoutboxに渡す"""
+        while True:
+            job = self.inbox.get()
+            if job is _STOP:
+                break
+            processed = job.error is None
+            busy = 0.0
+            if processed:
+                t0 = time.perf_counter()
+                try:
+                    with instrument.activate(job.trace):
+                        self.fn(job)
+                except Exception as e:
+                    job.error = f'{type(e).__name__}: {e}'
+                    job.bases = []
+                    job.images = []
+                busy = time.perf_counter() - t0
+                if job.trace is not None:
+                    job.trace.elapsed += busy
+            t0 = time.perf_counter()
+            self.outbox.put(job)
+            wait = time.perf_counter() - t0
+            with self.__lock:
+                if processed:
+                    self.stats.items += 1
+                    self.stats.busy += busy
+                self.stats.wait += wait
+
+        # 最後に終わったスレッドが次の段階に終わりの印を送る
+        with self.__lock:
+            self.__remaining -= 1
+            last = self.__remaining == 0
+        if last:
+            for _ in range(self.next_workers):
+                self.outbox.put(_STOP)
+
+
+
+class Pipeline:
+    """デコード・合成・エンコードを別々のスレッドプールで並行して行うバッチ処理
+
+    PillowはデコードやリサイズやエンコードのあいだGILを解放するので，
+    画像N+1のデコード，画像Nの合成，画像N-1のエンコードを重ねるだけで複数コアを使える．
+    プロセスプールと違って画像のコピーや受け渡しのpickleが要らない．
+    段階のあいだのキューは長さに上限があるので，遅い段階があると前の段階が待ち，
+    メモリ上の画像の枚数はスレッド数とキューの長さの合計までに収まる．
+    """
+    def __init__(
+            self, options: batch.RenderOptions,
+            decode_workers: int | None = None, compose_workers: int = 1,
+            encode_workers: int | None = None, queue_size: int | None = None
+            ):
+        """初期化関数
+
+        Args:
+            options (batch.RenderOptions): 描画パラメータ
+            decode_workers (int | None, optional): デコードのスレッド数. Noneならコア数の半分. Defaults to None.
+            compose_workers (int, optional): 合成のスレッド数. Defaults to 1.
+            encode_workers (int | None, optional): エンコードのスレッド数. Noneならコア数. Defaults to None.
+            queue_size (int | None, optional): 段階のあいだのキューの長さ. Noneならコア数. Defaults to None.
+        """
+        cpus = os.cpu_count() or 1
+        self.options = options
+        self.workers = (
+            max(decode_workers or cpus // 2, 1),
+            max(compose_workers, 1),
+            max(encode_workers or cpus, 1),
+        )
+        self.queue_size = max(queue_size or cpus, 1)
+        self.__cache = None
+        if options.cache_dir is not None:
+            self.__cache = render_cache.open_cache(
+                options.cache_dir, options.cache_max_bytes, options.cache_content_hash
+            )
+
+
+    def run(
+            self, paths: list[str],
+            on_progress: Callable[[int, int, str, str | None], None] | None = None
+            ) -> tuple[batch.BatchSummary, PipelineStats]:
+        """複数の画像のサムネイルを生成する
+
+        Args:
+            paths (list[str]): 元画像のパス
+            on_progress (Callable | None, optional): 1枚終わるごとに
+                (完了数, 全体数, パス, エラー内容 or None) で呼ばれる. Defaults to None.
+
+        Returns:
+            tuple[batch.BatchSummary, PipelineStats]: (処理結果, 段階ごとの統計)
+        """
+        summary = batch.BatchSummary(total=len(paths))
+        stats = PipelineStats([
+            StageStats(name, workers)
+            for name, workers in zip(('decode', 'compose', 'encode'), self.workers)
+        ])
+        inbox: queue.Queue = queue.Queue(self.queue_size)
+        queues = [inbox, queue.Queue(self.queue_size), queue.Queue(self.queue_size), queue.Queue()]
+        fns = (self.__decode, self.__compose, self.__encode)
+        start = time.perf_counter()
+
+        threads = []
+        for i, (fn, stage) in enumerate(zip(fns, stats.stages)):
+            next_workers = self.workers[i + 1] if i + 1 < len(self.workers) else 0
+            threads += _Stage(fn, stage, queues[i], queues[i + 1], next_workers).start()
+
+        def feed():
+            for path in paths:
+                # cProfileとtracemallocはスレッドをまたいで使えないので，段階ごとの時間と数だけを取る
+                trace = instrument.RenderTrace(path) if self.options.trace is not None else None
+                inbox.put(_Job(path, trace=trace))
+            for _ in range(self.workers[0]):
+                inbox.put(_STOP)
+
+        feeder = threading.Thread(target=feed, name='thumbgen-feed', daemon=True)
+        feeder.start()
+
+        results = queues[-1]
+        for _ in range(len(paths)):
+            job: _Job = results.get()
+            if job.error is None:
+                summary.succeeded += 1
+            else:
+                summary.failed.append((job.path, job.error))
+            for output in job.outputs:
+                summary.encode_time += output.encode_time
+                summary.outputs += 1
+                summary.output_bytes += output.nbytes
+            if job.outputs_expected and job.cache_hits == job.outputs_expected:
+                summary.cache_hits += 1
+            if job.trace is not None:
+                job.trace.error = job.error
+                instrument.emit(job.trace)
+            if on_progress is not None:
+                done = summary.succeeded + len(summary.failed)
+                on_progress(done, summary.total, job.path, job.error)
+
+        feeder.join()
+        for thread in threads:
+            thread.join()
+        summary.elapsed = stats.elapsed = time.perf_counter() - start
+        return summary, stats
+
+
+    def __decode(self, job: _Job):
+        """保存先を決めて，キャッシュになければ元画像をデコードして下地を作る"""
+        options = self.options
+        export_options = options.export_options
+        if options.sizes:
+            sizes = tuple(tuple(size) for size in options.sizes)
+            policy = options.output_policy.with_size()
+        else:
+            sizes = ((img.IMG_W, img.IMG_H),)
+            policy = options.output_policy
+
+        offset, source = batch.resolve_offset(job.path, options, self.__cache)
+        job.outputs_expected = len(sizes)
+        missing = []
+        for size in sizes:
+            save_path = img.thumbnail_path(
+                job.path, export_options, policy, offset, options.rgba,
+                options.logo_color, options.logo_shape, size
+            )
+            key = None
+            if self.__cache is not None:
+                key = self.__cache.key(
+                    job.path, offset, options.rgba,
+                    options.logo_color, options.logo_shape, export_options, size,
+                    options.resample
+                )
+                start = time.perf_counter()
+                if self.__cache.fetch(key, export_options.suffix, save_path):
+                    job.cache_hits += 1
+                    job.outputs.append(export.ExportResult(
+                        save_path, export_options.format, os.path.getsize(save_path),
+                        0.0, time.perf_counter() - start
+                    ))
+                    continue
+            missing.append((size, save_path, key))
+        job.targets = missing
+        if missing:
+            sizes = tuple(size for size, _, _ in missing)
+            # 元画像は大きいので，ここで縮小まで済ませて下地だけを次に渡す
+            if source is None:
+                source = img.decode_source(job.path, img.ladder_master_size(sizes))
+            job.bases = img.ladder_bases(source, offset, sizes, options.resample)
+
+
+    def __compose(self, job: _Job):
+        """長方形とロゴを合成する"""
+        options = self.options
+        job.images = [
+            img.put_overlays(base, options.rgba, options.logo_color, options.logo_shape)
+            for base in job.bases
+        ]
+        job.bases = []
+
+
+    def __encode(self, job: _Job):
+        """エンコードして保存する (キャッシュを使う場合は登録する)"""
+        export_options = self.options.export_options
+        for (_, save_path, key), image in zip(job.targets, job.images):
+            job.outputs.append(img.save_thumbnail(image, save_path, export_options))
+            if self.__cache is not None and key is not None:
+                self.__cache.store(key, export_options.suffix, save_path)
+        job.images = []
+
+
+
+def run_pipeline(
+        paths: list[str], options: batch.RenderOptions,
+        threads: tuple[int | None, int, int | None] = (None, 1, None),
+        on_progress: Callable[[int, int, str, str | None], None] | None = None
+        ) -> tuple[batch.BatchSummary, PipelineStats]:
+    """複数の画像のサムネイルをパイプラインで生成する
+
+    Args:
+        paths (list[str]): 元画像のパス
+        options (batch.RenderOptions): 描画パラメータ
+        threads (tuple[int | None, int, int | None], optional): (デコード, 合成, エンコード) のスレッド数.
+            Noneは既定 (Pipelineを参照). Defaults to (None, 1, None).
+        on_progress (Callable | None, optional): 1枚終わるごとに
+            (完了数, 全体数, パス, エラー内容 or None) で呼ばれる. Defaults to None.
+
+    Returns:
+        tuple[batch.BatchSummary, PipelineStats]: (処理結果, 段階ごとの統計)
+    """
+    pipeline = Pipeline(options, *threads)
+    return pipeline.run(paths, on_progress)
@@ -0,0 +1,449 @@
+from utils import autocrop, export, img, instrument
+import hashlib
+import os
+import pathlib
+import shutil
+import threading
+import time
+
+CACHE_VERSION = 1  # キャッシュの形式を変えたら上げる
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 既定の上限 (2GB)
+OFFSET_SUFFIX = '.offset'  # 推定したオフセットのファイルの拡張子
+
+
+class RenderCache:
+    """描画結果のディスクキャッシュ
+
+    元画像と描画パラメータ (オフセット，色，ロゴの色と形，保存形式，ロゴ画像の版) の
+    ハッシュをキーに，保存済みのサムネイルのファイルを保持する．
+    自動のオフセットを使うときのために，元画像ごとに推定したオフセットも保持する．
+    同じ入力で生成するときは描画せずにキャッシュからハードリンク(できなければコピー)する．
+    合計サイズが上限を超えたら，最後に使われたのが古いものから消す．
+    """
+    def __init__(
+            self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES,
+            content_hash: bool = False
+            ):
+        """初期化関数
+
+        Args:
+            directory (str): キャッシュを置くディレクトリ (なければ作る)
+            max_bytes (int, optional): キャッシュの合計サイズの上限 [byte]. Defaults to DEFAULT_MAX_BYTES.
+            content_hash (bool, optional): 元画像を中身のハッシュで識別する.
+                Falseなら(パス, 更新時刻, サイズ)で識別する. Defaults to False.
+        """
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.content_hash = content_hash
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__bytes = sum(size for _, size, _ in self.__entries())
+        if self.__bytes > self.max_bytes:
+            self.evict()
+
+
+    def key(
+            self, input_path: str, offset: int,
+            rgba: tuple[int, int, int, int],
+            logo_color: img.LogoColor, logo_shape: img.LogoShape,
+            export_options: export.ExportOptions,
+            size: tuple[int, int] = (img.IMG_W, img.IMG_H),
+            resample: img.Image.Resampling = img.FINAL_RESAMPLE
+            ) -> str:
+        """キャッシュのキーを作る
+
+        Args:
+            input_path (str): 元画像のパス
+            offset (int): 画像の縦方向のオフセット
+            rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
+            logo_color (img.LogoColor): ロゴの色
+            logo_shape (img.LogoShape): ロゴの形
+            export_options (export.ExportOptions): 保存形式と圧縮の設定
+            size (tuple[int, int], optional): サムネイルの大きさ. Defaults to (img.IMG_W, img.IMG_H).
+            resample (img.Image.Resampling, optional): 縮小フィルター. Defaults to img.FINAL_RESAMPLE.
+
+        Returns:
+            str: キー (16進数のハッシュ)
+        """
+        params = (
+            CACHE_VERSION, img.RENDER_VERSION, img.logo_version(), self.__source_id(input_path),
+            offset, tuple(rgba), logo_color.name, logo_shape.name,
+            repr(export_options)
+        )
+        if tuple(size) != (img.IMG_W, img.IMG_H):
+            # フルHDのときは大きさを入れる前と同じキーにする
+            params += (tuple(size),)
+        if resample != img.FINAL_RESAMPLE:
+            params += (resample.name,)
+        return hashlib.sha256(repr(params).encode('utf-8')).hexdigest()
+
+
+    def offset_key(self, input_path: str, size: tuple[int, int] = (img.IMG_W, img.IMG_H)) -> str:
+        """推定したオフセットのキーを作る
+
+        Args:
+            input_path (str): 元画像のパス
+            size (tuple[int, int], optional): 推定に使う元画像をデコードした大きさ.
+                Defaults to (img.IMG_W, img.IMG_H).
+
+        Returns:
+            str: キー (16進数のハッシュ)
+        """
+        params = (
+            CACHE_VERSION, 'offset', autocrop.ESTIMATE_VERSION,
+            self.__source_id(input_path), tuple(size)
+        )
+        return hashlib.sha256(repr(params).encode('utf-8')).hexdigest()
+
+
+    def fetch_offset(self, key: str) -> int | None:
+        """推定したオフセットを取得する
+
+        Args:
+            key (str): キー (offset_key)
+
+        Returns:
+            int | None: オフセット. なければNone.
+        """
+        cached = self.__path(key, OFFSET_SUFFIX)
+        try:
+            offset = int(cached.read_text(encoding='ascii'))
+        except (OSError, ValueError):
+            instrument.count('offset_cache_miss')
+            return None
+        instrument.count('offset_cache_hit')
+        try:
+            os.utime(cached)
+        except OSError:
+            pass
+        return offset
+
+
+    def store_offset(self, key: str, offset: int):
+        """推定したオフセットを登録する
+
+        Args:
+            key (str): キー (offset_key)
+            offset (int): オフセット
+        """
+        cached = self.__path(key, OFFSET_SUFFIX)
+        data = str(offset).encode('ascii')
+        try:
+            replaced = cached.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        export.write_atomic(str(cached), data)
+        with self.__lock:
+            self.__bytes += len(data) - replaced
+
+
+    def fetch(self, key: str, suffix: str, dest: str) -> bool:
+        """キャッシュにあればdestに置く
+
+        Args:
+            key (str): キー
+            suffix (str): 拡張子 (.を含む)
+            dest (str): 置き先のパス
+
+        Returns:
+            bool: キャッシュにあった場合はTrue
+        """
+        cached = self.__path(key, suffix)
+        try:
+            with instrument.span('write'):
+                link_or_copy(str(cached), dest)
+        except FileNotFoundError:
+            instrument.count('render_cache_miss')
+            with self.__lock:
+                self.misses += 1
+            return False
+        instrument.count('render_cache_hit')
+        # 最後に使った時刻として更新時刻を使う
+        try:
+            os.utime(cached)
+        except OSError:
+            pass
+        with self.__lock:
+            self.hits += 1
+        return True
+
+
+    def store(self, key: str, suffix: str, path: str):
+        """保存済みのサムネイルをキャッシュに登録する
+
+        Args:
+            key (str): キー
+            suffix (str): 拡張子 (.を含む)
+            path (str): 保存済みのサムネイルのパス
+        """
+        cached = self.__path(key, suffix)
+        try:
+            # 同じキーで登録し直す場合は置き換えるファイルの分を引く
+            replaced = cached.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        link_or_copy(path, str(cached))
+        with self.__lock:
+            self.__bytes += cached.stat().st_size - replaced
+            over = self.__bytes > self.max_bytes
+        if over:
+            self.evict()
+
+
+    def evict(self):
+        """合計サイズが上限以下になるまで，最後に使われたのが古いものから消す
+
+        他のプロセスも同じディレクトリを使うことがあるので，実際のファイルを数え直す．
+        """
+        entries = sorted(self.__entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+        with self.__lock:
+            self.__bytes = total
+
+
+    def stats(self) -> dict[str, int]:
+        """統計情報を取得する
+
+        Returns:
+            dict[str, int]: 使用量，上限，ヒット数，ミス数
+        """
+        with self.__lock:
+            return {
+                'bytes': self.__bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+    def __path(self, key: str, suffix: str) -> pathlib.Path:
+        return self.directory / key[:2] / f'{key}{suffix}'
+
+
+    def __source_id(self, input_path: str) -> tuple[str, object]:
+        """キーに入れる元画像の識別子"""
+        if self.content_hash:
+            return ('sha256', file_digest(input_path))
+        return ('stamp', img.source_stamp(input_path))
+
+
+    def __entries(self) -> list[tuple[pathlib.Path, int, float]]:
+        """キャッシュのファイルの一覧 (パス, サイズ, 更新時刻)"""
+        entries = []
+        for path in self.directory.glob('??/*'):
+            if path.suffix == '.tmp':
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+
+
+def file_digest(path: str) -> str:
+    """ファイルの中身のハッシュ (SHA-256)
+
+    Args:
+        path (str): ファイルのパス
+
+    Returns:
+        str: 16進数のハッシュ
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+
+def link_or_copy(src: str, dest: str):
+    """srcをdestにハードリンクする. できなければコピーする. (どちらもdestを一度に置き換える)
+
+    Args:
+        src (str): 元のファイル
+        dest (str): 置き先のパス
+    """
+    if os.path.exists(dest) and os.path.exists(src) and os.path.samefile(src, dest):
+        # すでにリンクされている (同じファイルへのrenameは何もしないので一時ファイルが残る)
+        return
+    directory = os.path.dirname(os.path.abspath(dest))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(
+        directory, f'.{os.path.basename(dest)}.{os.getpid()}.{threading.get_ident()}.tmp'
+    )
+    try:
+        try:
+            os.link(src, temp_path)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            # 別のファイルシステムなど
+            shutil.copyfile(src, temp_path)
+        os.replace(temp_path, dest)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+
+def generate_cached(
+        cache: RenderCache, input_path: str, offset: int,
+        rgba: tuple[int, int, int, int],
+        logo_color: img.LogoColor = img.LogoColor.WHITE,
+        logo_shape: img.LogoShape = img.LogoShape.BANNER,
+        export_options: export.ExportOptions | None = None,
+        output_policy: export.OutputPolicy | None = None,
+        resample: img.Image.Resampling = img.FINAL_RESAMPLE,
+        source: img.Image.Image | None = None
+        ) -> tuple[export.ExportResult, bool]:
+    """キャッシュを使ってサムネイルを生成する (入力が同じなら描画しない)
+
+    Args:
+        cache (RenderCache): 描画結果のキャッシュ
+        input_path (str): 元画像のパス
+        offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
+        logo_color (img.LogoColor, optional): ロゴの色. Defaults to img.LogoColor.WHITE.
+        logo_shape (img.LogoShape, optional): ロゴの形. Defaults to img.LogoShape.BANNER.
+        export_options (export.ExportOptions | None, optional): 保存形式と圧縮の設定. Defaults to None.
+        output_policy (export.OutputPolicy | None, optional): 保存先の決め方. Defaults to None.
+        resample (img.Image.Resampling, optional): 縮小フィルター. Defaults to img.FINAL_RESAMPLE.
+        source (img.Image.Image | None, optional): デコード済みの元画像 (描画するときに使う).
+            Noneならinput_pathからデコードする. Defaults to None.
+
+    Returns:
+        tuple[export.ExportResult, bool]: (保存の結果, キャッシュにあったか)
+    """
+    export_options = export_options or export.ExportOptions()
+    key = cache.key(
+        input_path, offset, rgba, logo_color, logo_shape, export_options,
+        resample=resample
+    )
+    save_path = img.thumbnail_path(
+        input_path, export_options, output_policy,
+        offset, rgba, logo_color, logo_shape
+    )
+
+    start = time.perf_counter()
+    if cache.fetch(key, export_options.suffix, save_path):
+        return export.ExportResult(
+            save_path, export_options.format, os.path.getsize(save_path),
+            0.0, time.perf_counter() - start
+        ), True
+
+    result = img.generate_thumbnail(
+        input_path, offset, rgba, logo_color, logo_shape,
+        export_options, output_policy, resample, source
+    )
+    cache.store(key, export_options.suffix, result.path)
+    return result, False
+
+
+
+def generate_ladder_cached(
+        cache: RenderCache, input_path: str, offset: int,
+        rgba: tuple[int, int, int, int],
+        logo_color: img.LogoColor = img.LogoColor.WHITE,
+        logo_shape: img.LogoShape = img.LogoShape.BANNER,
+        sizes: tuple[tuple[int, int], ...] = img.LADDER_SIZES,
+        export_options: export.ExportOptions | None = None,
+        output_policy: export.OutputPolicy | None = None,
+        resample: img.Image.Resampling = img.FINAL_RESAMPLE,
+        source: img.Image.Image | None = None
+        ) -> tuple[list[export.ExportResult], int]:
+    """キャッシュを使って複数の大きさのサムネイルを生成する (キャッシュにない大きさだけを描画する)
+
+    Args:
+        cache (RenderCache): 描画結果のキャッシュ
+        input_path (str): 元画像のパス
+        offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        rgba (tuple[int, int, int, int]): 長方形の色(R, G, B, A)
+        logo_color (img.LogoColor, optional): ロゴの色. Defaults to img.LogoColor.WHITE.
+        logo_shape (img.LogoShape, optional): ロゴの形. Defaults to img.LogoShape.BANNER.
+        sizes (tuple[tuple[int, int], ...], optional): 出力する大きさ. Defaults to img.LADDER_SIZES.
+        export_options (export.ExportOptions | None, optional): 保存形式と圧縮の設定. Defaults to None.
+        output_policy (export.OutputPolicy | None, optional): 保存先の決め方. Defaults to None.
+        resample (img.Image.Resampling, optional): 縮小フィルター. Defaults to img.FINAL_RESAMPLE.
+        source (img.Image.Image | None, optional): デコード済みの元画像 (描画するときに使う).
+            Noneならinput_pathからデコードする. Defaults to None.
+
+    Returns:
+        tuple[list[export.ExportResult], int]: (保存の結果 (sizesの順), キャッシュにあった数)
+    """
+    export_options = export_options or export.ExportOptions()
+    output_policy = (output_policy or export.OutputPolicy()).with_size()
+    results: dict[tuple[int, int], export.ExportResult] = {}
+    keys = {}
+    for size in sizes:
+        size = tuple(size)
+        keys[size] = cache.key(
+            input_path, offset, rgba, logo_color, logo_shape, export_options, size,
+            resample
+        )
+        save_path = img.thumbnail_path(
+            input_path, export_options, output_policy,
+            offset, rgba, logo_color, logo_shape, size
+        )
+        start = time.perf_counter()
+        if cache.fetch(keys[size], export_options.suffix, save_path):
+            results[size] = export.ExportResult(
+                save_path, export_options.format, os.path.getsize(save_path),
+                0.0, time.perf_counter() - start
+            )
+    hits = len(results)
+
+    missing = tuple(size for size in keys if size not in results)
+    if missing:
+        rendered = img.generate_ladder(
+            input_path, offset, rgba, logo_color, logo_shape, missing,
+            export_options, output_policy, resample, source
+        )
+        for size, result in zip(missing, rendered):
+            cache.store(keys[size], export_options.suffix, result.path)
+            results[size] = result
+    return [results[tuple(size)] for size in sizes], hits
+
+
+
+# プロセスごとに開いたキャッシュ ((ディレクトリ, 上限, 中身のハッシュ) -> キャッシュ)
+_caches: dict[tuple[str, int, bool], RenderCache] = {}
+_caches_lock = threading.Lock()
+
+
+def open_cache(
+        directory: str, max_bytes: int = DEFAULT_MAX_BYTES,
+        content_hash: bool = False
+        ) -> RenderCache:
+    """キャッシュを開く (プロセス内では同じ設定のものを使い回す)
+
+    Args:
+        directory (str): キャッシュを置くディレクトリ
+        max_bytes (int, optional): キャッシュの合計サイズの上限 [byte]. Defaults to DEFAULT_MAX_BYTES.
+        content_hash (bool, optional): 元画像を中身のハッシュで識別する. Defaults to False.
+
+    Returns:
+        RenderCache: キャッシュ
+    """
+    key = (os.path.abspath(directory), max_bytes, content_hash)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = RenderCache(*key)
+            _caches[key] = cache
+        return cache
@@ -0,0 +1,495 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from utils import autocrop, export, img, instrument, misc
+import bisect
+import io
+import os
+import threading
+import time
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BODY = 100 * 1024 * 1024  # 送られてくる元画像の上限 [byte]
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # ヒストグラムの区切り [秒]
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)  # 段階ごとの時間のヒストグラムの区切り [秒]
+
+# 保存形式ごとのContent-Type
+CONTENT_TYPES = {
+    export.OutputFormat.PNG: 'image/png',
+    export.OutputFormat.JPEG: 'image/jpeg',
+    export.OutputFormat.WEBP: 'image/webp',
+}
+
+
+@dataclass(frozen=True)
+class RenderRequest:
+    """描画の要求1件分のパラメータ"""
+    offset: int = 0
+    auto_offset: bool = False  # offsetの代わりに元画像から推定した値を使う
+    rgba: tuple[int, int, int, int] = (0, 110, 79, 255)
+    logo_color: img.LogoColor = img.LogoColor.WHITE
+    logo_shape: img.LogoShape = img.LogoShape.BANNER
+    size: tuple[int, int] = (img.IMG_W, img.IMG_H)
+    export_options: export.ExportOptions = export.ExportOptions()
+    resample: img.Image.Resampling = img.FINAL_RESAMPLE
+
+
+
+def parse_request(query: dict[str, list[str]], defaults: RenderRequest) -> RenderRequest:
+    """クエリ文字列から描画パラメータを作る
+
+    offset (autoなら元画像から推定), color (HEX), opacity (0-100), logo_color, logo_shape, width, height,
+    format (png / jpg / webp), quality, resample (nearest / bilinear / bicubic / lanczos など) が使える．省略した値はdefaultsになる．
+
+    Args:
+        query (dict[str, list[str]]): parse_qsの結果
+        defaults (RenderRequest): 省略された値
+
+    Returns:
+        RenderRequest: 描画パラメータ
+    """
+    def value(name: str) -> str | None:
+        values = query.get(name)
+        return values[-1] if values else None
+
+    changes = {}
+    if value('offset') is not None:
+        if value('offset').strip().lower() == 'auto':
+            changes['auto_offset'] = True
+        else:
+            changes['offset'] = int(value('offset'))
+            changes['auto_offset'] = False
+    r, g, b, a = defaults.rgba
+    if value('color') is not None:
+        hex = value('color').strip().lstrip('#')
+        if len(hex) != 6:
+            raise ValueError(f'HEXコードが不正です: {hex}')
+        r, g, b = misc.rgb(hex)
+    if value('opacity') is not None:
+        opacity = float(value('opacity'))
+        if not 0 <= opacity <= 100:
+            raise ValueError(f'不透明度が不正です: {opacity}')
+        a = int(opacity / 100.0 * 255)
+    changes['rgba'] = (r, g, b, a)
+    enums = (
+        ('logo_color', img.LogoColor), ('logo_shape', img.LogoShape),
+        ('resample', img.Image.Resampling)
+    )
+    for name, cls in enums:
+        if value(name) is not None:
+            try:
+                changes[name] = cls[value(name).upper()]
+            except KeyError:
+                names = ', '.join(m.name.lower() for m in cls)
+                raise ValueError(f'{name}が不正です: {value(name)} ({names} のどれか)')
+    if value('width') is not None or value('height') is not None:
+        w = int(value('width') or defaults.size[0])
+        h = int(value('height') or defaults.size[1])
+        if not (0 < w <= 8192 and 0 < h <= 8192):
+            raise ValueError(f'大きさが不正です: {w}x{h}')
+        changes['size'] = (w, h)
+    export_options = defaults.export_options
+    if value('format') is not None:
+        export_options = replace(export_options, format=export.parse_format(value('format')))
+    if value('quality') is not None:
+        quality = int(value('quality'))
+        if not 0 <= quality <= 100:
+            raise ValueError(f'品質が不正です: {quality}')
+        export_options = replace(export_options, jpeg_quality=quality, webp_quality=quality)
+    changes['export_options'] = export_options
+    return replace(defaults, **changes)
+
+
+
+def warm_worker():
+    """ワーカープロセスの初期化 (ロゴを読み込んでおく)
+
+    元画像と途中結果は要求ごとに違うのでキャッシュしない．
+    長方形の帯とロゴは大きさごとにプロセス内で使い回される．
+    """
+    img.source_cache.max_bytes = 0
+    img.stage_cache.max_bytes = 0
+    for color in img.LogoColor:
+        img.get_logo(color)
+    img.logo_version()
+
+
+
+def _ready() -> int:
+    """ワーカープロセスが起動したことを確かめるための空の処理"""
+    return os.getpid()
+
+
+
+def render_request(
+        source: bytes | str, request: RenderRequest,
+        trace_options: instrument.TraceOptions | None = None
+        ) -> tuple[bytes, instrument.RenderTrace]:
+    """要求された1枚を描画してエンコードする (ワーカープロセスで実行される)
+
+    Args:
+        source (bytes | str): 元画像のデータ，またはパス
+        request (RenderRequest): 描画パラメータ
+        trace_options (instrument.TraceOptions | None, optional): 計測で追加で取るもの. Defaults to None.
+
+    Returns:
+        tuple[bytes, instrument.RenderTrace]: (エンコードされたサムネイル, 段階ごとの時間)
+    """
+    name = source if isinstance(source, str) else f'<{len(source)} bytes>'
+    with instrument.trace(name, trace_options) as trace:
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+        decoded = img.decode_source(source, request.size)
+        offset = request.offset
+        if request.auto_offset:
+            offset = autocrop.estimate_offset(decoded, request.size)
+        image = img.compose_ladder(
+            decoded, offset, request.rgba,
+            request.logo_color, request.logo_shape, (request.size,), request.resample
+        )[0]
+        data, _ = export.encode(image, request.export_options)
+    return data, trace
+
+
+
+class Histogram:
+    """Prometheus形式の累積ヒストグラム"""
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後は+Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+    def lines(self, name: str, labels: str = '') -> list[str]:
+        """/metricsに出す行
+
+        Args:
+            name (str): メトリクス名
+            labels (str, optional): ラベル (例: 'format="png"'). Defaults to ''.
+
+        Returns:
+            list[str]: Prometheusのテキスト形式の行
+        """
+        prefix = labels + ',' if labels else ''
+        lines = []
+        total = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {total}')
+        suffix = '{' + labels + '}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {self.sum:.6f}')
+        lines.append(f'{name}_count{suffix} {self.count}')
+        return lines
+
+
+
+class Metrics:
+    """サービスの統計 (スレッドセーフ)"""
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.started = time.time()
+        self.requests: dict[int, int] = {}  # ステータスコード -> 件数
+        self.rejected = 0  # 待ちがいっぱいで断った件数
+        self.in_flight = 0  # 処理中と待ちの件数
+        self.latency = Histogram()  # 要求を受けてから返すまで
+        self.render = Histogram()  # ワーカーでの描画とエンコード
+        self.stages: dict[str, Histogram] = {}  # 段階 -> ワーカーでの段階ごとの時間
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+    def enter(self, limit: int) -> bool:
+        """処理の枠を確保する (待ちを含めてlimit件を超える場合はFalse)"""
+        with self.__lock:
+            if self.in_flight >= limit:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+
+    def leave(self):
+        with self.__lock:
+            self.in_flight -= 1
+
+
+    def record(
+            self, status: int, latency: float, trace: instrument.RenderTrace | None = None,
+            bytes_in: int = 0, bytes_out: int = 0):
+        """1件分の結果を記録する"""
+        with self.__lock:
+            self.requests[status] = self.requests.get(status, 0) + 1
+            self.latency.observe(latency)
+            if trace is not None:
+                self.render.observe(trace.elapsed)
+                for stage, seconds in trace.stages.items():
+                    self.stages.setdefault(stage, Histogram(STAGE_BUCKETS)).observe(seconds)
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+
+    def text(self, workers: int, max_queue: int) -> str:
+        """Prometheusのテキスト形式にする"""
+        with self.__lock:
+            lines = [
+                '# TYPE thumbgen_requests_total counter',
+                *(f'thumbgen_requests_total{{status="{status}"}} {count}'
+                  for status, count in sorted(self.requests.items())),
+                '# TYPE thumbgen_rejected_total counter',
+                f'thumbgen_rejected_total {self.rejected}',
+                '# TYPE thumbgen_in_flight gauge',
+                f'thumbgen_in_flight {self.in_flight}',
+                '# TYPE thumbgen_workers gauge',
+                f'thumbgen_workers {workers}',
+                '# TYPE thumbgen_queue_limit gauge',
+                f'thumbgen_queue_limit {max_queue}',
+                '# TYPE thumbgen_request_seconds histogram',
+                *self.latency.lines('thumbgen_request_seconds'),
+                '# TYPE thumbgen_render_seconds histogram',
+                *self.render.lines('thumbgen_render_seconds'),
+                '# TYPE thumbgen_stage_seconds histogram',
+                *(line for stage in instrument.STAGES if stage in self.stages
+                  for line in self.stages[stage].lines('thumbgen_stage_seconds', f'stage="{stage}"')),
+                '# TYPE thumbgen_bytes_in_total counter',
+                f'thumbgen_bytes_in_total {self.bytes_in}',
+                '# TYPE thumbgen_bytes_out_total counter',
+                f'thumbgen_bytes_out_total {self.bytes_out}',
+                '# TYPE thumbgen_uptime_seconds gauge',
+                f'thumbgen_uptime_seconds {time.time() - self.started:.1f}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+
+class RenderService:
+    """サムネイルを描画するローカルHTTPサービス
+
+    POST /render  本文の元画像を描画する (パラメータはクエリ文字列)
+    GET  /render?path=...  サーバー上の元画像を描画する (rootsの中のファイルのみ)
+    GET  /metrics  統計 (Prometheusのテキスト形式)
+    GET  /healthz  生存確認
+
+    描画は起動時にロゴを読み込んでおいたワーカープロセスで行う．
+    処理中と待ちの合計がmax_queueを超える要求は503で断る．
+    """
+    def __init__(
+            self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+            workers: int | None = None, max_queue: int | None = None,
+            defaults: RenderRequest = RenderRequest(),
+            roots: list[str] | None = None, max_body: int = DEFAULT_MAX_BODY,
+            trace_options: instrument.TraceOptions | None = None
+            ):
+        """初期化関数
+
+        Args:
+            host (str, optional): 待ち受けるアドレス. Defaults to DEFAULT_HOST.
+            port (int, optional): 待ち受けるポート (0なら空いているもの). Defaults to DEFAULT_PORT.
+            workers (int | None, optional): ワーカープロセス数. Noneならコア数. Defaults to None.
+            max_queue (int | None, optional): 処理中と待ちの合計の上限. Noneならワーカー数の4倍. Defaults to None.
+            defaults (RenderRequest, optional): 省略されたパラメータの値. Defaults to RenderRequest().
+            roots (list[str] | None, optional): パスで指定できる元画像のフォルダ.
+                Noneならパスでの指定は受け付けない. Defaults to None.
+            max_body (int, optional): 送られてくる元画像の上限 [byte]. Defaults to DEFAULT_MAX_BODY.
+            trace_options (instrument.TraceOptions | None, optional): 計測で追加で取るもの.
+                段階ごとの時間は常に/metricsに出し，instrumentの送り先があればそこにも送る.
+                Defaults to None.
+        """
+        self.workers = max(workers or os.cpu_count() or 1, 1)
+        self.max_queue = max(max_queue or self.workers * 4, 1)
+        self.defaults = defaults
+        self.roots = [os.path.realpath(root) for root in roots or []]
+        self.max_body = max_body
+        self.trace_options = trace_options
+        self.metrics = Metrics()
+        self.__pool: ProcessPoolExecutor | None = None
+        self.server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.server.daemon_threads = True
+
+
+    @property
+    def address(self) -> tuple[str, int]:
+        """待ち受けているアドレスとポート"""
+        return self.server.server_address[:2]
+
+
+    def start_workers(self):
+        """ワーカープロセスを起動して，ロゴを読み込み終わるまで待つ"""
+        self.__pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_worker)
+        futures = [self.__pool.submit(_ready) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+
+    def serve_forever(self):
+        """要求を処理し続ける (shutdownが呼ばれるまで戻らない)"""
+        if self.__pool is None:
+            self.start_workers()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.__pool.shutdown(cancel_futures=True)
+
+
+    def shutdown(self):
+        """serve_foreverを終わらせる (別のスレッドから呼ぶ)"""
+        self.server.shutdown()
+
+
+    def render(self, source: bytes | str, request: RenderRequest) -> tuple[bytes, instrument.RenderTrace]:
+        """ワーカープロセスで描画する (HTTPのスレッドから呼ばれる)"""
+        data, trace = self.__pool.submit(render_request, source, request, self.trace_options).result()
+        instrument.emit(trace)
+        return data, trace
+
+
+    def resolve(self, path: str) -> str:
+        """パスで指定された元画像を確かめる
+
+        Args:
+            path (str): 元画像のパス
+
+        Returns:
+            str: 実際のパス
+
+        Raises:
+            PermissionError: rootsの外のパスの場合
+            FileNotFoundError: ファイルがない場合
+        """
+        real = os.path.realpath(path)
+        if not any(os.path.commonpath((root, real)) == root for root in self.roots):
+            raise PermissionError(f'許可されていないパスです: {path}')
+        if not os.path.isfile(real):
+            raise FileNotFoundError(f'ファイルがありません: {path}')
+        return real
+
+
+
+def _make_handler(service: RenderService) -> type[BaseHTTPRequestHandler]:
+    """serviceを使う要求ハンドラーのクラスを作る"""
+
+    class Handler(BaseHTTPRequestHandler):
+        server_version = 'thumbGen'
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            match url.path:
+                case '/healthz':
+                    self.__reply(200, b'ok\n', 'text/plain')
+                case '/metrics':
+                    text = service.metrics.text(service.workers, service.max_queue)
+                    self.__reply(200, text.encode('utf-8'), 'text/plain; version=0.0.4')
+                case '/render':
+                    self.__render(url.query, None)
+                case _:
+                    self.__error(404, 'not found')
+
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/render':
+                self.__error(404, 'not found')
+                return
+            try:
+                length = int(self.headers.get('Content-Length', ''))
+            except ValueError:
+                self.close_connection = True
+                self.__error(411, 'Content-Lengthが必要です')
+                return
+            if length < 0:
+                self.close_connection = True
+                self.__error(400, f'Content-Lengthが不正です: {length}')
+                return
+            if length > service.max_body:
+                # 本文を読まずに返すので，接続は続けられない
+                self.close_connection = True
+                self.__error(413, f'元画像が大きすぎます (上限 {service.max_body} byte)')
+                return
+            self.__render(url.query, length)
+
+
+        def log_message(self, format: str, *args):
+            # 要求ごとの表示はしない (統計は/metricsで見る)
+            pass
+
+
+        def __render(self, query: str, length: int | None):
+            """描画の要求を処理する
+
+            混んでいるかどうかは本文を読む前に確かめる (断る要求の本文は受け取らない)．
+
+            Args:
+                query (str): クエリ文字列
+                length (int | None): 本文の長さ (POST). GETならNone.
+            """
+            start = time.perf_counter()
+            if not service.metrics.enter(service.max_queue):
+                if length is not None:
+                    # 本文を読まずに返すので，接続は続けられない
+                    self.close_connection = True
+                self.__error(503, '混んでいます', {'Retry-After': '1'}, start)
+                return
+            try:
+                body = self.rfile.read(length) if length is not None else None
+                params = parse_qs(query)
+                try:
+                    request = parse_request(params, service.defaults)
+                    if body is None:
+                        if not service.roots:
+                            raise PermissionError('パスでの指定は無効です (--rootで許可する)')
+                        path = params.get('path', [''])[-1]
+                        source: bytes | str = service.resolve(path)
+                    else:
+                        source = body
+                except PermissionError as e:
+                    self.__error(403, str(e), start=start, bytes_in=len(body or b''))
+                    return
+                except FileNotFoundError as e:
+                    self.__error(404, str(e), start=start)
+                    return
+                except ValueError as e:
+                    self.__error(400, f'パラメータが不正です: {e}', start=start, bytes_in=len(body or b''))
+                    return
+
+                try:
+                    data, trace = service.render(source, request)
+                except Exception as e:
+                    self.__error(422, f'{type(e).__name__}: {e}', start=start, bytes_in=len(body or b''))
+                    return
+                self.__reply(200, data, CONTENT_TYPES[request.export_options.format])
+                service.metrics.record(
+                    200, time.perf_counter() - start, trace,
+                    len(body or b''), len(data)
+                )
+            finally:
+                service.metrics.leave()
+
+
+        def __reply(self, status: int, data: bytes, content_type: str, headers: dict | None = None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+
+        def __error(
+                self, status: int, message: str, headers: dict | None = None,
+                start: float | None = None, bytes_in: int = 0):
+            self.__reply(status, (message + '\n').encode('utf-8'), 'text/plain; charset=utf-8', headers)
+            if start is not None:
+                service.metrics.record(status, time.perf_counter() - start, bytes_in=bytes_in)
+
+    return Handler
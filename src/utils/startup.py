@@ -0,0 +1,155 @@
+import builtins
+import os
+import sys
+import threading
+import time
+
+STARTED = time.perf_counter()  # このモジュールを読み込んだ時刻 (起動時間の基準)
+REPORT_ENV = 'THUMBGEN_STARTUP_REPORT'  # 1なら起動時間の内訳を表示する
+# 最初の描画のあとにバックグラウンドで読み込んでおくモジュール (初めてのプレビューを速くする)
+PRELOAD_MODULES = ('utils.img', 'utils.export', 'numpy')
+
+
+class StartupReport:
+    """起動時間の内訳 (段階ごとの時刻とモジュールごとの読み込み時間)"""
+    def __init__(self, enabled: bool = False):
+        """初期化関数
+
+        Args:
+            enabled (bool, optional): モジュールの読み込み時間を計測して，finishで表示する.
+                Falseなら段階ごとの時刻だけを記録する. Defaults to False.
+        """
+        self.enabled = enabled
+        self.marks: list[tuple[str, float]] = []  # (段階, STARTEDからの時間[秒])
+        # (モジュール, 子を含む時間[秒], 自身の時間[秒]) 読み込みが終わった順
+        self.imports: list[tuple[str, float, float]] = []
+        self.__stack: list[float] = []  # 読み込み中のモジュールごとの子の時間の合計
+        self.__thread = threading.get_ident()
+        self.__original_import = builtins.__import__
+        self.__active = False
+        if enabled:
+            self.__active = True
+            builtins.__import__ = self.__import
+
+
+    @classmethod
+    def from_env(cls) -> 'StartupReport':
+        """環境変数 THUMBGEN_STARTUP_REPORT が1なら有効にして作る"""
+        return cls(os.environ.get(REPORT_ENV) == '1')
+
+
+    def mark(self, label: str):
+        """段階が終わった時刻を記録する
+
+        Args:
+            label (str): 段階の名前
+        """
+        self.marks.append((label, time.perf_counter() - STARTED))
+
+
+    def finish(self, label: str = 'first paint'):
+        """最後の段階を記録して，有効なら内訳を表示する
+
+        Args:
+            label (str, optional): 最後の段階の名前. Defaults to 'first paint'.
+        """
+        self.mark(label)
+        self.__active = False
+        if self.enabled:
+            print('\n'.join(self.lines()))
+            # ほかのモジュールがさらに__import__を置き換えている場合は，戻すとそれが外れるので素通りさせる
+            if builtins.__import__ == self.__import:
+                builtins.__import__ = self.__original_import
+
+
+    def lines(self, limit: int = 20) -> list[str]:
+        """表示用の文字列にする
+
+        Args:
+            limit (int, optional): 表示するモジュールの数 (時間の長い順). Defaults to 20.
+
+        Returns:
+            list[str]: 1行ずつの文字列
+        """
+        lines = ['起動時間 (Python起動後):']
+        previous = 0.0
+        for label, at in self.marks:
+            lines.append(f'  {label:<20} {at * 1000:7.1f}ms (+{(at - previous) * 1000:.1f}ms)')
+            previous = at
+        if self.imports:
+            lines.append(f'モジュールの読み込み (上位{limit}件, 子を含む / 自身):')
+            for name, total, own in sorted(self.imports, key=lambda item: -item[1])[:limit]:
+                lines.append(f'  {name:<40} {total * 1000:7.1f}ms / {own * 1000:6.1f}ms')
+        loaded = [name for name in ('PIL', 'numpy', 'utils.img') if name in sys.modules]
+        lines.append(f'描画前に読み込まれたもの: {", ".join(loaded) or "なし"}')
+        return lines
+
+
+    def __import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        """builtins.__import__の代わり (メインスレッドで新しく読み込むモジュールの時間を計る)"""
+        if not self.__active or level != 0 or threading.get_ident() != self.__thread:
+            return self.__original_import(name, globals, locals, fromlist, level)
+
+        # 計測するのは新しく読み込むモジュール (from X import Y のYがモジュールの場合も含む)
+        if name not in sys.modules:
+            candidates = [name]
+        else:
+            candidates = [
+                f'{name}.{item}' for item in fromlist or ()
+                if item != '*' and f'{name}.{item}' not in sys.modules
+            ]
+        before = len(sys.modules)
+        self.__stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self.__original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self.__stack.pop()
+            if self.__stack:
+                self.__stack[-1] += elapsed
+            if len(sys.modules) > before:
+                loaded = [candidate for candidate in candidates if candidate in sys.modules]
+                label = ', '.join(loaded) or name
+                self.imports.append((label, elapsed, max(elapsed - children, 0.0)))
+
+
+
+def on_first_paint(widget, callback):
+    """ウィジェットが初めて描画されたときに1回だけcallbackを呼ぶ
+
+    Args:
+        widget (QWidget): 描画を待つウィジェット
+        callback (Callable[[], None]): 呼ぶ関数
+    """
+    from PySide6.QtCore import QEvent, QObject, QTimer
+
+    class FirstPaintFilter(QObject):
+        def eventFilter(self, watched, event):
+            if event.type() == QEvent.Type.Paint:
+                watched.removeEventFilter(self)
+                # 描画が終わってから呼ぶ
+                QTimer.singleShot(0, callback)
+            return False
+
+    event_filter = FirstPaintFilter(widget)
+    widget.installEventFilter(event_filter)
+
+
+
+def preload(modules: tuple[str, ...] = PRELOAD_MODULES):
+    """バックグラウンドのスレッドでモジュールを読み込んでおく
+
+    Args:
+        modules (tuple[str, ...], optional): 読み込むモジュール. Defaults to PRELOAD_MODULES.
+    """
+    def run():
+        import importlib
+        for module in modules:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                # なくても動く (NumPyがなければPillowで合成する)
+                pass
+
+    threading.Thread(target=run, name='thumbgen-preload', daemon=True).start()
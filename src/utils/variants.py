@@ -0,0 +1,212 @@
+from dataclasses import dataclass, field
+from PIL import Image
+from utils import export, img
+import hashlib
+import itertools
+import math
+import time
+
+SHEET_CELL_W = 480  # 一覧の1枚の幅
+SHEET_LABEL_H = 24  # 一覧の説明の帯の高さ
+SHEET_MARGIN = 8  # 一覧の余白
+
+
+@dataclass(frozen=True)
+class Variant:
+    """サムネイルの描画パラメータのうち，見た目の組み合わせ1つ分"""
+    logo_shape: img.LogoShape
+    logo_color: img.LogoColor
+    rgba: tuple[int, int, int, int]
+
+    @property
+    def label(self) -> str:
+        """一覧に表示する説明 (例: 'banner / white / #006e4fff')"""
+        color = ''.join(f'{c:02x}' for c in self.rgba)
+        return f'{self.logo_shape.name.lower()} / {self.logo_color.name.lower()} / #{color}'
+
+
+
+@dataclass
+class VariantResult:
+    """variantsの生成結果"""
+    variants: list[Variant]
+    outputs: list[export.ExportResult] = field(default_factory=list)  # variantsの順
+    sheet: export.ExportResult | None = None  # 一覧 (作らなかった場合はNone)
+    sheet_image: Image.Image | None = None  # 一覧の画像 (作らなかった場合はNone)
+    elapsed: float = 0.0
+
+
+
+def variant_grid(
+        shapes: tuple[img.LogoShape, ...] = tuple(img.LogoShape),
+        colors: tuple[img.LogoColor, ...] = tuple(img.LogoColor),
+        palette: tuple[tuple[int, int, int, int], ...] = ((0, 110, 79, 255),)
+        ) -> list[Variant]:
+    """形・ロゴの色・長方形の色のすべての組み合わせを作る
+
+    Args:
+        shapes (tuple[img.LogoShape, ...], optional): 長方形の形. Defaults to すべて.
+        colors (tuple[img.LogoColor, ...], optional): ロゴの色. Defaults to すべて.
+        palette (tuple[tuple[int, int, int, int], ...], optional): 長方形の色(R, G, B, A).
+            Defaults to ((0, 110, 79, 255),).
+
+    Returns:
+        list[Variant]: 組み合わせ (長方形の色，形，ロゴの色の順に並ぶ)
+    """
+    return [
+        Variant(shape, color, tuple(rgba))
+        for rgba, shape, color in itertools.product(palette, shapes, colors)
+    ]
+
+
+
+def render_variants(
+        input_path: str, offset: int, variants: list[Variant],
+        size: tuple[int, int] = (img.IMG_W, img.IMG_H),
+        resample: Image.Resampling = img.FINAL_RESAMPLE
+        ) -> list[Image.Image]:
+    """1回のデコードで複数の組み合わせのサムネイルを描画する (ファイルには保存しない)
+
+    元画像のデコード・縮小・切り取りは1回だけ行い，その下地に組み合わせごとの長方形とロゴを重ねる．
+    長方形の帯とロゴは(形, 色, 大きさ)ごとにキャッシュされるので，組み合わせが増えても
+    1枚あたりの追加の処理は合成だけで済む．
+
+    Args:
+        input_path (str): 元画像のパス
+        offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        variants (list[Variant]): 描画する組み合わせ
+        size (tuple[int, int], optional): 描画する大きさ. Defaults to (img.IMG_W, img.IMG_H).
+        resample (Image.Resampling, optional): 縮小フィルター. Defaults to img.FINAL_RESAMPLE.
+
+    Returns:
+        list[Image.Image]: 描画されたサムネイル (RGB, variantsの順)
+    """
+    base = img.render_base(img.decode_source(input_path, size), offset, size, resample)
+    return [
+        img.put_overlays(base, variant.rgba, variant.logo_color, variant.logo_shape)
+        for variant in variants
+    ]
+
+
+
+def contact_sheet(
+        images: list[Image.Image], labels: list[str] | None = None,
+        columns: int | None = None, cell_width: int = SHEET_CELL_W
+        ) -> Image.Image:
+    """サムネイルを縮小して並べた一覧を作る
+
+    Args:
+        images (list[Image.Image]): 並べるサムネイル (すべて同じ大きさ)
+        labels (list[str] | None, optional): それぞれの下に書く説明. Defaults to None.
+        columns (int | None, optional): 列の数. Noneなら正方形に近くなる数. Defaults to None.
+        cell_width (int, optional): 1枚の幅. Defaults to SHEET_CELL_W.
+
+    Returns:
+        Image.Image: 一覧 (RGB)
+    """
+    from PIL import ImageDraw, ImageFont
+
+    if not images:
+        raise ValueError('並べるサムネイルがありません')
+    columns = max(columns or math.ceil(math.sqrt(len(images))), 1)
+    rows = math.ceil(len(images) / columns)
+    w, h = images[0].size
+    cell = (cell_width, round(h * cell_width / w))
+    label_h = SHEET_LABEL_H if labels else 0
+    pitch = (cell[0] + SHEET_MARGIN, cell[1] + label_h + SHEET_MARGIN)
+
+    sheet = Image.new(
+        'RGB', (columns * pitch[0] + SHEET_MARGIN, rows * pitch[1] + SHEET_MARGIN),
+        (255, 255, 255)
+    )
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default()
+    for i, image in enumerate(images):
+        x = SHEET_MARGIN + (i % columns) * pitch[0]
+        y = SHEET_MARGIN + (i // columns) * pitch[1]
+        sheet.paste(
+            image.resize(cell, Image.Resampling.BILINEAR, reducing_gap=2.0), (x, y)
+        )
+        if labels:
+            draw.text((x + 2, y + cell[1] + 4), labels[i], fill=(0, 0, 0), font=font)
+    return sheet
+
+
+
+def sheet_path(
+        input_path: str, offset: int, variants: list[Variant],
+        export_options: export.ExportOptions | None = None,
+        output_policy: export.OutputPolicy | None = None
+        ) -> str:
+    """一覧の保存先のパスを取得する (既定では元画像と同じフォルダのthumbnail_variants.png)
+
+    templateの{shape}，{logo}，{color}はallになる．
+
+    Args:
+        input_path (str): 元画像のパス
+        offset (int): 画像の縦方向のオフセット
+        variants (list[Variant]): 一覧に並べる組み合わせ
+        export_options (export.ExportOptions | None, optional): 保存形式と圧縮の設定. Defaults to None.
+        output_policy (export.OutputPolicy | None, optional): 保存先の決め方. Defaults to None.
+
+    Returns:
+        str: 保存先のパス
+    """
+    export_options = export_options or export.ExportOptions()
+    output_policy = output_policy or export.OutputPolicy()
+    params = (img.source_stamp(input_path), offset, [v.label for v in variants], export_options.suffix)
+    tokens = {
+        'shape': 'all', 'logo': 'all', 'color': 'all', 'offset': str(offset),
+        'hash': hashlib.sha1(repr(params).encode('utf-8')).hexdigest()[:10],
+        'size': f'{img.IMG_W}x{img.IMG_H}',
+    }
+    policy = export.OutputPolicy(output_policy.directory, output_policy.template + '_variants')
+    return policy.path_for(input_path, export_options.suffix, tokens)
+
+
+
+def generate_variants(
+        input_path: str, offset: int, variants: list[Variant],
+        export_options: export.ExportOptions | None = None,
+        output_policy: export.OutputPolicy | None = None,
+        sheet: bool = True, columns: int | None = None,
+        resample: Image.Resampling = img.FINAL_RESAMPLE
+        ) -> VariantResult:
+    """複数の組み合わせのサムネイルを生成して，それぞれと一覧を保存する
+
+    ファイル名のテンプレートに{hash}も{shape}・{logo}・{color}もなければ最後に付ける
+    (既定ではthumbnail_banner_white_006e4fff.png など．一覧はthumbnail_variants.png)．
+
+    Args:
+        input_path (str): 元画像のパス
+        offset (int): 画像の縦方向のオフセット. 負なら下に，正なら上にずれる.
+        variants (list[Variant]): 生成する組み合わせ
+        export_options (export.ExportOptions | None, optional): 保存形式と圧縮の設定.
+            Noneなら既定のPNG. Defaults to None.
+        output_policy (export.OutputPolicy | None, optional): 保存先の決め方.
+            Noneなら元画像と同じフォルダ. Defaults to None.
+        sheet (bool, optional): 一覧も保存する. Defaults to True.
+        columns (int | None, optional): 一覧の列の数. Noneなら正方形に近くなる数. Defaults to None.
+        resample (Image.Resampling, optional): 縮小フィルター. Defaults to img.FINAL_RESAMPLE.
+
+    Returns:
+        VariantResult: 生成結果
+    """
+    start = time.perf_counter()
+    export_options = export_options or export.ExportOptions()
+    output_policy = output_policy or export.OutputPolicy()
+    policy = output_policy.with_style()
+    result = VariantResult(list(variants))
+    images = render_variants(input_path, offset, result.variants, resample=resample)
+    for variant, image in zip(result.variants, images):
+        save_path = img.thumbnail_path(
+            input_path, export_options, policy, offset,
+            variant.rgba, variant.logo_color, variant.logo_shape
+        )
+        result.outputs.append(img.save_thumbnail(image, save_path, export_options))
+    if sheet and images:
+        result.sheet_image = contact_sheet(images, [v.label for v in result.variants], columns)
+        save_path = sheet_path(input_path, offset, result.variants, export_options, output_policy)
+        result.sheet = export.export(result.sheet_image, save_path, export_options)
+    result.elapsed = time.perf_counter() - start
+    return result
@@ -0,0 +1,511 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable
+from utils import batch, instrument, manifest
+import ctypes
+import ctypes.util
+import json
+import os
+import pathlib
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+
+STYLE_FILE = 'thumbgen.json'  # フォルダごとの既定の描画パラメータ
+DEFAULT_SETTLE = 1.0  # 大きさと更新時刻がこの時間 [秒] 変わらなければ書き込みが終わったとみなす
+DEFAULT_INTERVAL = 1.0  # ポーリングの間隔 [秒]
+TICK = 0.1  # 完了の確認と投入の間隔 [秒]
+
+# inotifyのイベント (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len (この後にlenバイトの名前が続く)
+
+
+def file_stamp(path: str) -> tuple[int, int] | None:
+    """ファイルの大きさと更新時刻
+
+    Args:
+        path (str): ファイルのパス
+
+    Returns:
+        tuple[int, int] | None: (大きさ[byte], 更新時刻[ns]). ファイルがなければNone
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+
+def scan(directory: str) -> dict[str, tuple[int, int]]:
+    """ディレクトリ直下のファイルの大きさと更新時刻を取得する
+
+    Args:
+        directory (str): ディレクトリ
+
+    Returns:
+        dict[str, tuple[int, int]]: パス -> (大きさ[byte], 更新時刻[ns]). 読めなければ空
+    """
+    stamps = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        stamps[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    # 走査中に消えた
+                    continue
+    except OSError:
+        pass
+    return stamps
+
+
+
+class PollingWatcher:
+    """ディレクトリを一定間隔で走査して，追加・更新されたファイルを見つける (どのOSでも使える)"""
+    mode = 'polling'
+
+    def __init__(self, directories: list[str], interval: float = DEFAULT_INTERVAL):
+        """初期化関数
+
+        Args:
+            directories (list[str]): 監視するディレクトリ
+            interval (float, optional): 走査の間隔 [秒]. Defaults to DEFAULT_INTERVAL.
+        """
+        self.directories = list(directories)
+        self.interval = interval
+        self.__stamps = {directory: scan(directory) for directory in self.directories}
+        self.__next = time.monotonic() + interval
+
+
+    def files(self) -> list[str]:
+        """監視しているディレクトリにあるファイル"""
+        return [path for stamps in self.__stamps.values() for path in stamps]
+
+
+    def changes(self, timeout: float) -> set[str]:
+        """追加・更新・削除されたファイルを待つ
+
+        Args:
+            timeout (float): 待つ時間の上限 [秒]
+
+        Returns:
+            set[str]: 前回の走査から追加・更新・削除されたファイル (なければ空)
+        """
+        wait = self.__next - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        if wait > 0:
+            time.sleep(wait)
+        self.__next = time.monotonic() + self.interval
+        changed = set()
+        for directory in self.directories:
+            stamps = scan(directory)
+            previous = self.__stamps[directory]
+            changed.update(path for path, stamp in stamps.items() if previous.get(path) != stamp)
+            changed.update(path for path in previous if path not in stamps)
+            self.__stamps[directory] = stamps
+        return changed
+
+
+    def close(self):
+        pass
+
+
+
+class InotifyWatcher:
+    """inotifyで追加・更新されたファイルを知る (Linuxのみ．走査しないのでファイルが多くても軽い)
+
+    ネットワーク共有では別のマシンからの書き込みが通知されないので，PollingWatcherを使う．
+    """
+    mode = 'inotify'
+
+    def __init__(self, directories: list[str]):
+        """初期化関数
+
+        Args:
+            directories (list[str]): 監視するディレクトリ
+
+        Raises:
+            OSError: inotifyが使えない場合
+        """
+        libc_name = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotifyが使えません')
+        self.directories = list(directories)
+        self.__fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1に失敗しました')
+        self.__directories: dict[int, str] = {}  # watch descriptor -> ディレクトリ
+        try:
+            for directory in self.directories:
+                wd = libc.inotify_add_watch(self.__fd, os.fsencode(directory), WATCH_MASK)
+                if wd < 0:
+                    errno = ctypes.get_errno()
+                    raise OSError(errno, f'{directory}を監視できません: {os.strerror(errno)}')
+                self.__directories[wd] = directory
+        except OSError:
+            os.close(self.__fd)
+            raise
+
+
+    def files(self) -> list[str]:
+        """監視しているディレクトリにあるファイル"""
+        return [path for directory in self.directories for path in scan(directory)]
+
+
+    def changes(self, timeout: float) -> set[str]:
+        """追加・更新・削除されたファイルを待つ
+
+        Args:
+            timeout (float): 待つ時間の上限 [秒]
+
+        Returns:
+            set[str]: 通知のあったファイル (なければ空. 名前の変更は前後の両方)
+        """
+        ready, _, _ = select.select([self.__fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.__fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0')
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # 通知があふれたので，すべてのファイルを調べ直す
+                changed.update(self.files())
+            elif name and not mask & IN_ISDIR and wd in self.__directories:
+                changed.add(os.path.join(self.__directories[wd], os.fsdecode(name)))
+        return changed
+
+
+    def close(self):
+        os.close(self.__fd)
+
+
+
+def open_watcher(
+        directories: list[str], polling: bool = False, interval: float = DEFAULT_INTERVAL
+        ) -> InotifyWatcher | PollingWatcher:
+    """使える方法でディレクトリを監視する
+
+    Args:
+        directories (list[str]): 監視するディレクトリ
+        polling (bool, optional): inotifyが使えてもポーリングする. Defaults to False.
+        interval (float, optional): ポーリングの間隔 [秒]. Defaults to DEFAULT_INTERVAL.
+
+    Returns:
+        InotifyWatcher | PollingWatcher: Linuxではinotify，それ以外はポーリング
+    """
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directories)
+        except OSError:
+            pass
+    return PollingWatcher(directories, interval)
+
+
+
+class Debouncer:
+    """書き込み中のファイルを除くために，大きさと更新時刻が一定時間変わらなくなるまで待つ"""
+    def __init__(self, settle: float = DEFAULT_SETTLE):
+        """初期化関数
+
+        Args:
+            settle (float, optional): 変わらなければ書き込みが終わったとみなす時間 [秒].
+                Defaults to DEFAULT_SETTLE.
+        """
+        self.settle = settle
+        self.__pending: dict[str, tuple[float, tuple[int, int]]] = {}  # パス -> (期限, 最後に見た状態)
+
+
+    def __len__(self) -> int:
+        return len(self.__pending)
+
+
+    def touch(self, path: str):
+        """ファイルが変わったことを知らせる (期限を延ばす)
+
+        Args:
+            path (str): ファイルのパス
+        """
+        stamp = file_stamp(path)
+        if stamp is None:
+            self.__pending.pop(path, None)
+        else:
+            self.__pending[path] = (time.monotonic() + self.settle, stamp)
+
+
+    def ready(self) -> list[str]:
+        """書き込みが終わったファイルを取り出す
+
+        Returns:
+            list[str]: 期限までに大きさも更新時刻も変わらなかったファイル
+        """
+        now = time.monotonic()
+        ready = []
+        for path, (deadline, stamp) in list(self.__pending.items()):
+            if deadline > now:
+                continue
+            current = file_stamp(path)
+            if current is None:
+                del self.__pending[path]
+            elif current != stamp:
+                # まだ書き込まれている
+                self.__pending[path] = (now + self.settle, current)
+            else:
+                del self.__pending[path]
+                ready.append(path)
+        return ready
+
+
+    def next_deadline(self) -> float | None:
+        """一番早い期限 (time.monotonic()の値). 待っているファイルがなければNone"""
+        return min((deadline for deadline, _ in self.__pending.values()), default=None)
+
+
+
+class FolderWatcher:
+    """フォルダを監視して，追加・更新された画像のサムネイルをワーカープロセスで生成し続ける
+
+    書き込み中のファイルは大きさと更新時刻が落ち着くまで待つ．同時に処理するのは
+    ワーカー数の2倍までで，残りはパスだけを持って待たせるので，一度に大量に置かれてもメモリは増えない．
+    フォルダにthumbgen.jsonがあれば，そのフォルダの画像はその描画パラメータで生成する
+    (キーはマニフェストと同じ offset, color, opacity, rgba, logo_color, logo_shape)．
+    """
+    def __init__(
+            self, directories: list[str], options: batch.RenderOptions,
+            workers: int | None = None, settle: float = DEFAULT_SETTLE,
+            polling: bool = False, interval: float = DEFAULT_INTERVAL,
+            existing: bool = False,
+            on_result: Callable[[batch.JobResult, float], None] | None = None
+            ):
+        """初期化関数
+
+        Args:
+            directories (list[str]): 監視するフォルダ (直下の画像のみ)
+            options (batch.RenderOptions): 描画パラメータ (thumbgen.jsonで省略された値)
+            workers (int | None, optional): ワーカープロセス数. Noneならコア数. Defaults to None.
+            settle (float, optional): 書き込みが終わったとみなすまでの時間 [秒]. Defaults to DEFAULT_SETTLE.
+            polling (bool, optional): inotifyを使わずにポーリングする. Defaults to False.
+            interval (float, optional): ポーリングの間隔 [秒]. Defaults to DEFAULT_INTERVAL.
+            existing (bool, optional): 監視を始めたときにある画像も生成する. Defaults to False.
+            on_result (Callable | None, optional): 1枚終わるごとに
+                (処理結果, 最後の書き込みから生成が終わるまでの時間[秒]) で呼ばれる. Defaults to None.
+
+        Raises:
+            FileNotFoundError: フォルダがない場合
+        """
+        for directory in directories:
+            if not os.path.isdir(directory):
+                raise FileNotFoundError(f'フォルダがありません: {directory}')
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.options = options
+        self.workers = max(workers or os.cpu_count() or 1, 1)
+        self.settle = settle
+        self.polling = polling
+        self.interval = interval
+        self.existing = existing
+        self.on_result = on_result
+        self.summary = batch.BatchSummary()
+        self.mode: str | None = None  # 監視の方法 (runの中で決まる)
+        self.__styles: dict[str, tuple[tuple[int, int] | None, batch.RenderOptions | str]] = {}
+        # 監視しているフォルダに生成したサムネイル (監視の対象から除く．消えたら忘れる)
+        self.__outputs: set[str] = set()
+
+
+    def run(self, stop: threading.Event | None = None):
+        """stopがセットされるまで監視する (Ctrl+Cでも終わる)
+
+        Args:
+            stop (threading.Event | None, optional): 終わらせるときにセットする. Defaults to None.
+        """
+        stop = stop or threading.Event()
+        watcher = open_watcher(self.directories, self.polling, self.interval)
+        self.mode = watcher.mode
+        debouncer = Debouncer(self.settle)
+        # パス -> 生成したときの状態 (消えたファイルは忘れるので，フォルダにあるファイルの数までしか増えない)
+        rendered: dict[str, tuple[int, int] | None] = {}
+        for path in watcher.files():
+            if self.__accepts(path):
+                if self.existing:
+                    debouncer.touch(path)
+                else:
+                    rendered[path] = file_stamp(path)
+        queued: dict[str, None] = {}  # 書き込みが終わってワーカーの空きを待つパス (順番付き)
+        in_flight: dict[Future, tuple[str, tuple[int, int]]] = {}
+        max_in_flight = self.workers * 2
+        start = time.perf_counter()
+
+        try:
+            with ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=init_worker
+                    ) as executor:
+                while not stop.is_set():
+                    timeout = TICK if in_flight or queued else self.interval
+                    deadline = debouncer.next_deadline()
+                    if deadline is not None:
+                        timeout = min(timeout, max(deadline - time.monotonic(), 0.0))
+                    for path in watcher.changes(timeout):
+                        if os.path.basename(path) == STYLE_FILE:
+                            self.__styles.pop(os.path.dirname(path), None)
+                        elif file_stamp(path) is None:
+                            # 消えた (名前が変わった場合を含む)
+                            rendered.pop(path, None)
+                            self.__outputs.discard(path)
+                            debouncer.touch(path)
+                        elif self.__accepts(path):
+                            debouncer.touch(path)
+                    for path in debouncer.ready():
+                        if rendered.get(path) != file_stamp(path):
+                            queued[path] = None
+
+                    for future in [future for future in in_flight if future.done()]:
+                        path, stamp = in_flight.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            # ワーカープロセス自体が落ちた場合
+                            result = batch.JobResult(path, 0.0, f'{type(e).__name__}: {e}')
+                        if result.error is not None and file_stamp(path) != stamp:
+                            # 生成中に書き換えられた (まだ書き込み中だった) ので，落ち着いてからやり直す
+                            debouncer.touch(path)
+                            continue
+                        rendered[path] = stamp
+                        self.__record(result, stamp)
+
+                    busy = {path for path, _ in in_flight.values()}
+                    for path in list(queued):
+                        if len(in_flight) >= max_in_flight:
+                            break
+                        if path in busy:
+                            # 生成中のものが終わってからもう一度生成する
+                            continue
+                        del queued[path]
+                        stamp = file_stamp(path)
+                        if stamp is None:
+                            continue
+                        options = self.options_for(path)
+                        if isinstance(options, str):
+                            rendered[path] = stamp
+                            self.__record(batch.JobResult(path, 0.0, options), stamp)
+                            continue
+                        in_flight[executor.submit(batch.render_one, path, options)] = (path, stamp)
+        finally:
+            watcher.close()
+            self.summary.elapsed = time.perf_counter() - start
+
+
+    def options_for(self, path: str) -> batch.RenderOptions | str:
+        """画像のフォルダの描画パラメータ (thumbgen.jsonがあればその値)
+
+        Args:
+            path (str): 元画像のパス
+
+        Returns:
+            batch.RenderOptions | str: 描画パラメータ. thumbgen.jsonが不正ならその内容
+        """
+        directory = os.path.dirname(path)
+        style_path = os.path.join(directory, STYLE_FILE)
+        stamp = file_stamp(style_path)
+        cached = self.__styles.get(directory)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        options: batch.RenderOptions | str = self.options
+        if stamp is not None:
+            try:
+                options = load_style(style_path, self.options)
+            except (OSError, TypeError, ValueError) as e:
+                options = f'{STYLE_FILE}が不正です: {e}'
+        self.__styles[directory] = (stamp, options)
+        return options
+
+
+    def __accepts(self, path: str) -> bool:
+        """生成の対象にするファイルか (生成したサムネイルは除く)"""
+        return (
+            path not in self.__outputs
+            and batch.is_source_image(pathlib.Path(path), self.options.output_policy)
+        )
+
+
+    def __record(self, result: batch.JobResult, stamp: tuple[int, int]):
+        """1枚分の結果を記録する"""
+        if result.error is None:
+            self.summary.succeeded += 1
+        else:
+            self.summary.failed.append((result.path, result.error))
+        self.summary.total += 1
+        for output in result.outputs:
+            path = os.path.abspath(output.path)
+            if os.path.dirname(path) in self.directories:
+                # 監視していないフォルダに保存したものは通知されないので覚えなくてよい
+                self.__outputs.add(path)
+            self.summary.encode_time += output.encode_time
+            self.summary.outputs += 1
+            self.summary.output_bytes += output.nbytes
+        if result.cached:
+            self.summary.cache_hits += 1
+        instrument.emit(result.trace)
+        if self.on_result is not None:
+            # 最後に書き込まれてから生成が終わるまで (書き込みが落ち着くまでの待ちを含む)
+            latency = max(time.time() - stamp[1] / 1e9, 0.0)
+            self.on_result(result, latency)
+
+
+
+def init_worker():
+    """ワーカープロセスの初期化 (Ctrl+Cは親プロセスだけが受けて，処理中の画像を終えてから止める)"""
+    batch.init_worker()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+
+def load_style(path: str, defaults: batch.RenderOptions) -> batch.RenderOptions:
+    """フォルダの既定の描画パラメータを読み込む
+
+    Args:
+        path (str): thumbgen.jsonのパス
+        defaults (batch.RenderOptions): 省略された値
+
+    Returns:
+        batch.RenderOptions: 描画パラメータ
+
+    Raises:
+        ValueError: 内容が不正な場合
+    """
+    with open(path, encoding='utf-8') as f:
+        try:
+            record = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f'JSONとして読めません ({e})')
+    if not isinstance(record, dict):
+        raise ValueError('オブジェクトではありません')
+    for key in ('input', 'path', 'output'):
+        if key in record:
+            raise ValueError(f'{key}はフォルダごとには指定できません')
+    return manifest.row_options(record, defaults)
@@ -0,0 +1,114 @@
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+from typing import Any, Callable
+
+
+class _TaskSignals(QObject):
+    """ワーカースレッドからメインスレッドに結果を返すためのシグナル"""
+    done = Signal(int, object, object)  # (世代, 結果, 例外)
+
+
+
+class _Task(QRunnable):
+    """ワーカースレッドで1つの関数を実行するタスク"""
+    def __init__(
+            self, generation: int, fn: Callable[..., Any],
+            args: tuple, signals: _TaskSignals
+            ):
+        """初期化関数
+
+        Args:
+            generation (int): 要求の世代 (新しい要求ほど大きい)
+            fn (Callable[..., Any]): 実行する関数
+            args (tuple): 関数の引数
+            signals (_TaskSignals): 結果を通知するシグナル
+        """
+        super().__init__()
+        self.__generation = generation
+        self.__fn = fn
+        self.__args = args
+        self.__signals = signals
+
+
+    def run(self):
+        try:
+            result = self.__fn(*self.__args)
+        except Exception as e:
+            self.__signals.done.emit(self.__generation, None, e)
+        else:
+            self.__signals.done.emit(self.__generation, result, None)
+
+
+
+class LatestOnlyExecutor(QObject):
+    """最新の要求だけを描画するバックグラウンド実行器
+
+    同時に実行するのは1件だけで，実行中に来た要求は最新の1件だけを待たせる
+    (それより古い待ちは捨てる)．実行中の処理が古くなった場合は結果を捨て，
+    最新の要求の結果だけをfinished / failedで通知する．
+    submitと通知はメインスレッドで行われる．
+    """
+    finished = Signal(object)  # 結果
+    failed = Signal(object)  # 例外
+
+    def __init__(self, parent: QObject | None = None):
+        """初期化関数
+
+        Args:
+            parent (QObject | None, optional): 親オブジェクト. Defaults to None.
+        """
+        super().__init__(parent)
+        self.__pool = QThreadPool(self)
+        self.__pool.setMaxThreadCount(1)
+        self.__signals = _TaskSignals(self)
+        self.__signals.done.connect(self.__on_done)
+        self.__generation = 0
+        self.__running = False
+        self.__pending: tuple[int, Callable[..., Any], tuple] | None = None
+
+
+    def submit(self, fn: Callable[..., Any], *args) -> int:
+        """関数をワーカースレッドで実行する
+
+        Args:
+            fn (Callable[..., Any]): 実行する関数
+            *args: 関数の引数
+
+        Returns:
+            int: 要求の世代
+        """
+        self.__generation += 1
+        task = (self.__generation, fn, args)
+        if self.__running:
+            self.__pending = task
+        else:
+            self.__start(task)
+        return self.__generation
+
+
+    def is_busy(self) -> bool:
+        """実行中または待ちの要求があるか
+
+        Returns:
+            bool: 実行中または待ちの要求があればTrue
+        """
+        return self.__running or self.__pending is not None
+
+
+    def __start(self, task: tuple[int, Callable[..., Any], tuple]):
+        self.__running = True
+        self.__pool.start(_Task(*task, self.__signals))
+
+
+    def __on_done(self, generation: int, result: Any, error: Exception | None):
+        self.__running = False
+        if self.__pending is not None:
+            task, self.__pending = self.__pending, None
+            self.__start(task)
+
+        if generation != self.__generation:
+            # 新しい要求があるので古い結果は捨てる
+            return
+        if error is None:
+            self.finished.emit(result)
+        else:
+            self.failed.emit(error)
@@ -0,0 +1,5 @@
+import pathlib
+import sys
+
+# src/ を読み込めるようにする (cli.pyと同じく utils をトップレベルのパッケージとして使う)
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / 'src'))
@@ -0,0 +1,75 @@
+from PIL import Image, ImageDraw
+from utils import autocrop, batch, export, img, instrument
+import pytest
+
+
+def test_best_top_picks_window_with_most_saliency():
+    scores = [0.0] * 20
+    scores[15:18] = [10.0, 10.0, 10.0]
+    # 窓の高さ5，見える範囲は上の3行
+    assert autocrop.best_top(scores, 5, 3) == 15
+
+
+
+def test_best_top_prefers_center_when_flat():
+    assert autocrop.best_top([1.0] * 21, 11, 9) == 5
+    assert autocrop.best_top([0.0] * 21, 11, 9) == 5
+
+
+
+def test_best_top_without_room():
+    assert autocrop.best_top([1.0] * 10, 10, 8) == 0
+    assert autocrop.best_top([1.0] * 5, 10, 8) == 0
+
+
+
+def tall_image(detail_top: int, detail_bottom: int) -> Image.Image:
+    image = Image.new('RGB', (1920, 2880), (90, 120, 160))
+    draw = ImageDraw.Draw(image)
+    for x in range(100, 1800, 40):
+        draw.rectangle((x, detail_top, x + 20, detail_bottom), fill=(250, 250, 250))
+    return image
+
+
+
+@pytest.mark.parametrize('detail', [(0, 600), (1000, 1500), (1800, 2400), (2300, 2879)])
+def test_estimate_offset_keeps_detail_above_banner(detail):
+    offset = autocrop.estimate_offset(tall_image(*detail))
+    assert 0 <= offset <= 2 * (2880 - img.IMG_H)
+    visible = img.IMG_H - img.BANNER_H
+
+    def shown(top: int) -> int:
+        return max(min(detail[1], top + visible) - max(detail[0], top), 0)
+
+    best = max(shown(top) for top in range(2880 - img.IMG_H + 1))
+    # 解析は1/4の大きさなので数画素ずれてよい
+    assert shown(img.crop_top(offset)) >= best - 8
+
+
+
+def test_estimate_offset_for_wide_image():
+    assert autocrop.estimate_offset(Image.new('RGB', (3000, 1000))) == 0
+
+
+
+def test_suggest_offset_from_file(tmp_path):
+    path = tmp_path / 'tall.png'
+    tall_image(1800, 2400).save(path)
+    with open(path, 'rb') as f:
+        from_file = autocrop.suggest_offset(f)
+    assert autocrop.suggest_offset(str(path)) == from_file
+
+
+
+def test_auto_offset_decodes_once(tmp_path):
+    path = tmp_path / 'tall.png'
+    tall_image(1800, 2400).save(path)
+    options = batch.RenderOptions(
+        auto_offset=True, output_policy=export.OutputPolicy(str(tmp_path / 'out'), '{stem}_{offset}'),
+        trace=instrument.TraceOptions()
+    )
+    result = batch.render_one(str(path), options)
+    assert result.error is None
+    assert result.trace.counts['decoded_bytes'] == 1920 * 2880 * 3
+    offset = autocrop.estimate_offset(Image.open(path))
+    assert result.outputs[0].path.endswith(f'tall_{offset}.png')
@@ -0,0 +1,130 @@
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from utils import batch, export, img, pipeline
+import pathlib
+import pytest
+import threading
+import time
+
+
+def touch(directory: pathlib.Path, *names: str):
+    for name in names:
+        (directory / name).write_bytes(b'')
+
+
+
+def test_collect_inputs_skips_only_generated_thumbnails(tmp_path):
+    touch(
+        tmp_path,
+        'a.jpg', 'a_thumbnail.png', 'a_thumbnail_1280x720.png',
+        'a_thumbnail_banner_white_006e4fff.png', 'a_thumbnail_variants.png',
+        # 元画像がないので生成したものではない
+        'product_thumbnail.jpg', 'my_thumbnail.png', 'notes.txt',
+    )
+    policy = export.OutputPolicy(template='{stem}_thumbnail')
+    paths, skipped = batch.collect_inputs([str(tmp_path)], policy)
+    assert [pathlib.Path(p).name for p in paths] == ['a.jpg', 'my_thumbnail.png', 'product_thumbnail.jpg']
+    assert sorted(pathlib.Path(p).name for p in skipped) == [
+        'a_thumbnail.png', 'a_thumbnail_1280x720.png',
+        'a_thumbnail_banner_white_006e4fff.png', 'a_thumbnail_variants.png',
+    ]
+
+
+
+def test_collect_inputs_with_fixed_template(tmp_path):
+    touch(tmp_path, 'a.jpg', 'thumbnail.png', 'thumbnail_640x360.jpg', 'thumbnail_old.png')
+    paths, skipped = batch.collect_inputs([str(tmp_path / '*')], export.OutputPolicy())
+    assert sorted(pathlib.Path(p).name for p in paths) == ['a.jpg', 'thumbnail_old.png']
+    assert len(skipped) == 2
+
+
+
+def test_collect_inputs_with_output_directory(tmp_path):
+    out = tmp_path / 'out'
+    out.mkdir()
+    touch(tmp_path, 'a.jpg', 'b_thumbnail.png')
+    touch(out, 'a_thumbnail.png')
+    policy = export.OutputPolicy(str(out), '{stem}_thumbnail')
+    # 保存先のフォルダ以外のファイルは名前が一致しても除かない
+    paths, skipped = batch.collect_inputs([str(tmp_path), str(out)], policy)
+    assert sorted(pathlib.Path(p).name for p in paths) == ['a.jpg', 'b_thumbnail.png']
+    assert [pathlib.Path(p).name for p in skipped] == ['a_thumbnail.png']
+
+
+
+def test_collect_inputs_keeps_explicit_files(tmp_path):
+    touch(tmp_path, 'thumbnail.png')
+    paths, skipped = batch.collect_inputs([str(tmp_path / 'thumbnail.png')])
+    assert paths == [str(tmp_path / 'thumbnail.png')]
+    assert skipped == []
+
+
+
+def test_name_pattern():
+    pattern = export.OutputPolicy(template='{stem}-{offset}-{stem}').name_pattern()
+    match = pattern.fullmatch('x_y--20-x_y_1920x1080')
+    assert match is not None and match['stem'] == 'x_y'
+    assert pattern.fullmatch('a-0-b') is None
+
+
+
+@pytest.mark.parametrize('max_in_flight, budget, expected', [
+    (2, 0, 2),
+    (8, 250, 2),
+    # 1件で予算を超えるジョブもほかになければ投入する
+    (8, 50, 1),
+])
+def test_schedule_limits_in_flight(max_in_flight, budget, expected):
+    lock = threading.Lock()
+    running = peak = 0
+    done = []
+
+    def work(job: int) -> int:
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+        return job
+
+    with ThreadPoolExecutor(8) as executor:
+        batch.schedule(
+            executor, range(10),
+            lambda pool, job: pool.submit(work, job),
+            lambda job, future: done.append(future.result()),
+            max_in_flight, budget, cost=lambda job: 100
+        )
+    assert sorted(done) == list(range(10))
+    assert peak == expected
+
+
+
+def test_run_batch_writes_one_file_per_source(tmp_path):
+    for name, color in (('a', 'red'), ('b', 'blue')):
+        Image.new('RGB', (320, 180), color).save(tmp_path / f'{name}.png')
+    paths = [str(tmp_path / 'a.png'), str(tmp_path / 'b.png')]
+    summary = batch.run_batch(paths, batch.RenderOptions(), workers=1)
+    assert summary.succeeded == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        'a.png', 'a_thumbnail.png', 'b.png', 'b_thumbnail.png'
+    ]
+
+
+
+def test_auto_offset_does_not_decode_on_cache_hit(tmp_path, monkeypatch):
+    path = tmp_path / 'a.png'
+    Image.merge('RGB', [Image.effect_noise((320, 400), 60)] * 3).save(path)
+    options = batch.RenderOptions(auto_offset=True, cache_dir=str(tmp_path / 'cache'))
+    first = batch.render_one(str(path), options)
+    assert first.error is None and not first.cached
+
+    decoded = []
+    decode_source = img.decode_source
+    monkeypatch.setattr(img, 'decode_source', lambda *args: decoded.append(args) or decode_source(*args))
+    second = batch.render_one(str(path), options)
+    assert second.error is None and second.cached
+    summary, _ = pipeline.run_pipeline([str(path)], options, (1, 1, 1))
+    assert summary.cache_hits == 1
+    assert decoded == []
@@ -0,0 +1,69 @@
+from utils import cache
+
+
+def make_cache(max_bytes: int) -> cache.LRUCache:
+    return cache.LRUCache(max_bytes, len)
+
+
+
+def test_get_counts_hits_and_misses():
+    lru = make_cache(10)
+    assert lru.get('a') is None
+    lru.put('a', 'xx')
+    assert lru.get('a') == 'xx'
+    assert (lru.hits, lru.misses) == (1, 1)
+
+
+
+def test_evicts_least_recently_used():
+    lru = make_cache(6)
+    lru.put('a', 'aa')
+    lru.put('b', 'bb')
+    lru.put('c', 'cc')
+    # aを使ったので，次に捨てられるのはb
+    assert lru.get('a') == 'aa'
+    lru.put('d', 'dd')
+    assert lru.get('b') is None
+    assert [lru.get(key) for key in 'acd'] == ['aa', 'cc', 'dd']
+    assert lru.evictions == 1
+    assert lru.current_bytes == 6
+
+
+
+def test_put_replaces_without_double_counting():
+    lru = make_cache(10)
+    lru.put('a', 'aaaa')
+    lru.put('a', 'aa')
+    assert len(lru) == 1
+    assert lru.current_bytes == 2
+    assert lru.evictions == 0
+
+
+
+def test_put_skips_values_larger_than_limit():
+    lru = make_cache(3)
+    lru.put('a', 'aa')
+    lru.put('b', 'bbbb')
+    assert lru.get('b') is None
+    assert lru.get('a') == 'aa'
+    assert lru.evictions == 0
+
+
+
+def test_clear_keeps_counters():
+    lru = make_cache(10)
+    lru.put('a', 'aa')
+    lru.get('a')
+    lru.get('b')
+    lru.clear()
+    assert lru.stats() == {
+        'items': 0, 'bytes': 0, 'max_bytes': 10, 'hits': 1, 'misses': 1, 'evictions': 0,
+    }
+
+
+
+def test_zero_limit_disables_cache():
+    lru = make_cache(0)
+    lru.put('a', 'a')
+    assert lru.get('a') is None
+    assert len(lru) == 0
@@ -0,0 +1,40 @@
+from utils import export
+import os
+import pytest
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='権限はPOSIXのみ')
+def test_write_atomic_respects_umask(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, 'UMASK', 0o027)
+    path = tmp_path / 'sub' / 'a.png'
+    export.write_atomic(str(path), b'data')
+    assert path.read_bytes() == b'data'
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    assert [p.name for p in path.parent.iterdir()] == ['a.png']
+
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='umaskはPOSIXのみ')
+def test_read_umask_matches_process_umask():
+    mask = os.umask(0o077)
+    try:
+        assert export._read_umask() == 0o077
+    finally:
+        os.umask(mask)
+    assert os.umask(mask) == mask
+
+
+
+def test_output_policy_rejects_unknown_token():
+    with pytest.raises(ValueError):
+        export.OutputPolicy(template='{unknown}')
+
+
+
+def test_output_policy_path_for(tmp_path):
+    policy = export.OutputPolicy(str(tmp_path), '{stem}_{size}').with_style()
+    path = policy.path_for(
+        '/src/photo.jpg', '.png',
+        {'shape': 'banner', 'logo': 'white', 'color': '006e4fff', 'size': '640x360'}
+    )
+    assert path == str(tmp_path / 'photo_640x360_banner_white_006e4fff.png')
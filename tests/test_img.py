@@ -0,0 +1,137 @@
+from PIL import Image, ImageChops
+from utils import composite, export, img
+import math
+import pathlib
+import pytest
+
+
+def gradient(size: tuple[int, int]) -> Image.Image:
+    """縦横で色が変わる画像 (合成結果の違いが見えるように)"""
+    x = Image.linear_gradient('L').rotate(90).resize(size)
+    y = Image.linear_gradient('L').resize(size)
+    return Image.merge('RGB', (x, y, ImageChops.invert(x)))
+
+
+
+@pytest.mark.parametrize('size', img.LADDER_SIZES)
+@pytest.mark.parametrize('logo_color', list(img.LogoColor))
+@pytest.mark.parametrize('logo_shape', list(img.LogoShape))
+def test_put_overlays_matches_pillow_fallback(monkeypatch, size, logo_color, logo_shape):
+    base = gradient(size)
+    rgba = (0, 110, 79, 200)
+    expected = img.put_overlays(base, rgba, logo_color, logo_shape)
+    monkeypatch.setattr(composite, 'AVAILABLE', False)
+    actual = img.put_overlays(base, rgba, logo_color, logo_shape)
+    assert actual.mode == expected.mode == 'RGB'
+    assert ImageChops.difference(actual, expected).getbbox() is None
+
+
+
+def noise(size: tuple[int, int]) -> Image.Image:
+    """画素ごとに値が変わる画像 (縮小の違いが見えるように)"""
+    return Image.merge('RGB', (Image.effect_noise(size, 80), *gradient(size).split()[:2]))
+
+
+
+def resize_then_crop(image: Image.Image, offset: int, size: tuple[int, int], resample) -> Image.Image:
+    """cover_sizeに縮小してから切り取る (img.resizeと同じ結果になるはずの素直な方法)"""
+    cover = image.resize(
+        img.cover_size(image.size, size), resample, reducing_gap=img.reducing_gap(resample)
+    )
+    return img.crop(cover, offset, size)
+
+
+
+OFFSETS = (0, 37, -1, 200, -200, 5000, -5000)  # ±5000は元画像の端を越える
+SIZES = ((384, 216), (256, 144), (128, 72))  # LADDER_SIZESと同じ縦横比で，テストが速く終わる大きさ
+
+
+
+# 倍率が2進数で割り切れる (浮動小数点の誤差が出ない) なら完全に一致する
+# (横長，4:3，reducing_gapで先に整数分の1にする大きさ，フレームより小さい元画像)
+@pytest.mark.parametrize('source_size', [(768, 432), (768, 576), (3072, 1728), (192, 108)])
+@pytest.mark.parametrize('resample', list(Image.Resampling))
+def test_resize_is_resize_then_crop_for_exact_scales(source_size, resample):
+    source = noise(source_size)
+    for size in SIZES:
+        for offset in OFFSETS:
+            expected = resize_then_crop(source, offset, size, resample)
+            actual = img.resize(source, offset, size, resample)
+            assert ImageChops.difference(actual, expected).getbbox() is None, (size, offset)
+
+
+
+# それ以外の倍率でも違いはフィルターの重みの丸め (1階調) だけ
+# (NEARESTとBOXは画素の境目で重みが飛ぶので，丸めで1画素ずれることがあり対象外)
+@pytest.mark.parametrize('source_size', [(1000, 750), (750, 1000), (2000, 500), (160, 120), (83, 194)])
+@pytest.mark.parametrize('resample', [
+    Image.Resampling.BILINEAR, Image.Resampling.HAMMING,
+    Image.Resampling.BICUBIC, Image.Resampling.LANCZOS,
+])
+def test_resize_is_resize_then_crop_within_rounding(source_size, resample):
+    source = noise(source_size)
+    for size in SIZES:
+        for offset in OFFSETS:
+            expected = resize_then_crop(source, offset, size, resample)
+            actual = img.resize(source, offset, size, resample)
+            extrema = ImageChops.difference(actual, expected).getextrema()
+            assert max(high for _, high in extrema) <= 1, (size, offset)
+
+
+
+@pytest.mark.parametrize('offset', OFFSETS)
+def test_crop_top_scales_with_size(offset):
+    full = img.crop_top(offset)
+    assert full == (img.IMG_H + offset) // 2 - img.IMG_H // 2
+    for size in img.LADDER_SIZES:
+        assert img.crop_top(offset, size) == round(full * size[1] / img.IMG_H)
+
+
+
+@pytest.mark.parametrize('size', img.LADDER_SIZES)
+@pytest.mark.parametrize('shape', list(img.LogoShape))
+def test_get_banner_scales_with_size(size, shape):
+    banner, y0 = img.get_banner(shape, (0, 110, 79, 255), size)
+    w, h = size
+    assert banner.mode == 'RGBA'
+    assert banner.width == w
+    assert y0 + banner.height == h
+    assert y0 == math.floor(h - img.BANNER_H * h / img.IMG_H)
+
+
+
+def test_generate_ladder_writes_each_size(tmp_path, monkeypatch):
+    path = tmp_path / 'a.jpg'
+    noise((800, 600)).save(path)
+    decoded = []
+    decode_source = img.decode_source
+    monkeypatch.setattr(img, 'decode_source', lambda *args: decoded.append(args) or decode_source(*args))
+
+    results = img.generate_ladder(str(path), 0, (0, 110, 79, 255))
+    # 一番大きい大きさで1回だけデコードする
+    assert [args[1] for args in decoded] == [(1920, 1080)]
+    assert [pathlib.Path(r.path).name for r in results] == [
+        'thumbnail_1920x1080.png', 'thumbnail_1280x720.png', 'thumbnail_640x360.png'
+    ]
+    for result, size in zip(results, img.LADDER_SIZES):
+        with Image.open(result.path) as image:
+            assert image.size == size
+        assert result.nbytes == pathlib.Path(result.path).stat().st_size
+
+
+
+def test_generate_ladder_with_template_and_source(tmp_path, monkeypatch):
+    path = tmp_path / 'a.png'
+    noise((400, 400)).save(path)
+    sizes = ((400, 400), (200, 100))
+    source = img.decode_source(str(path), img.ladder_master_size(sizes))
+    monkeypatch.setattr(img, 'decode_source', None)  # 渡したsourceを使うのでデコードしない
+
+    policy = export.OutputPolicy(str(tmp_path / 'out'), '{stem}_{size}_thumb')
+    results = img.generate_ladder(
+        str(path), 0, (0, 110, 79, 255), sizes=sizes, output_policy=policy, source=source
+    )
+    assert [pathlib.Path(r.path).name for r in results] == ['a_400x400_thumb.png', 'a_200x100_thumb.png']
+    for result, size in zip(results, sizes):
+        with Image.open(result.path) as image:
+            assert image.size == size
@@ -0,0 +1,122 @@
+from utils import instrument
+import json
+import pytest
+import threading
+import time
+
+
+@pytest.fixture(autouse=True)
+def no_sinks():
+    instrument.close_sinks()
+    yield
+    instrument.close_sinks()
+
+
+
+def test_span_and_count_outside_trace_do_nothing():
+    with instrument.span('decode'):
+        instrument.count('source_cache_hit')
+    assert not instrument.enabled()
+
+
+
+def test_trace_sums_spans_and_counts():
+    with instrument.trace('a.jpg', instrument.TraceOptions()) as result:
+        for _ in range(2):
+            with instrument.span('decode'):
+                time.sleep(0.01)
+        with instrument.span('encode'):
+            time.sleep(0.03)
+        instrument.count('output_bytes', 100)
+        instrument.count('output_bytes', 20)
+        instrument.count('source_cache_miss')
+    assert result.stages['decode'] >= 0.02
+    assert result.bound == 'encode'
+    assert result.elapsed >= sum(result.stages.values())
+    assert result.counts == {'output_bytes': 120, 'source_cache_miss': 1}
+    assert result.summary().startswith('decode ')
+    # 終わったら計測中ではなくなる
+    instrument.count('output_bytes')
+    assert result.counts['output_bytes'] == 120
+
+
+
+def test_trace_records_error():
+    with pytest.raises(ValueError):
+        with instrument.trace('a.jpg', instrument.TraceOptions()) as result:
+            raise ValueError('broken')
+    assert result.error == 'ValueError: broken'
+    assert result.record()['error'] == 'ValueError: broken'
+
+
+
+def test_activate_continues_trace_in_other_thread():
+    with instrument.trace('a.jpg', instrument.TraceOptions()) as result:
+        def work(trace):
+            with instrument.activate(trace):
+                instrument.count('resized')
+        # 別のスレッドはactivateしなければ計測中の描画を持たない
+        threads = [threading.Thread(target=work, args=(t,)) for t in (result, None)]
+        threads.append(threading.Thread(target=instrument.count, args=('ignored',)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert result.counts == {'resized': 1}
+
+
+
+def make_trace(name: str, error: str | None = None) -> instrument.RenderTrace:
+    return instrument.RenderTrace(
+        name, stages={'decode': 0.01, 'encode': 0.03},
+        counts={'output_bytes': 10, 'stage_cache_hit': 2}, elapsed=0.05, error=error
+    )
+
+
+
+def test_json_lines_sink(tmp_path):
+    path = tmp_path / 'logs' / 'trace.jsonl'
+    instrument.add_sink(instrument.JsonLinesSink(str(path)))
+    assert instrument.enabled()
+    instrument.emit(make_trace('a.jpg'))
+    instrument.emit(None)
+    instrument.emit(make_trace('b.jpg', 'OSError: x'))
+    instrument.close_sinks()
+    records = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert [r['name'] for r in records] == ['a.jpg', 'b.jpg']
+    assert records[0]['bound'] == 'encode'
+    assert records[0]['counts'] == {'output_bytes': 10, 'stage_cache_hit': 2}
+    assert records[1]['error'] == 'OSError: x'
+
+
+
+def test_prometheus_sink(tmp_path):
+    path = tmp_path / 'thumbgen.prom'
+    sink = instrument.PrometheusSink(str(path))
+    instrument.add_sink(sink)
+    instrument.emit(make_trace('a.jpg'))
+    instrument.emit(make_trace('b.jpg', 'OSError: x'))
+    lines = path.read_text(encoding='utf-8').splitlines()
+    assert lines == sink.text().splitlines()
+    assert 'thumbgen_traces_total 2' in lines
+    assert 'thumbgen_trace_errors_total 1' in lines
+    assert 'thumbgen_stage_seconds_total{stage="encode"} 0.060000' in lines
+    assert 'thumbgen_bound_total{stage="encode"} 2' in lines
+    assert 'thumbgen_bytes_total{kind="output"} 20' in lines
+    assert 'thumbgen_events_total{event="stage_cache_hit"} 4' in lines
+
+
+
+def test_configure_without_sinks_disables_tracing():
+    assert instrument.configure() is None
+    assert not instrument.enabled()
+
+
+
+def test_remove_sink_closes_it(tmp_path):
+    sink = instrument.JsonLinesSink(str(tmp_path / 'trace.jsonl'))
+    instrument.add_sink(sink)
+    instrument.remove_sink(sink)
+    assert not instrument.enabled()
+    with pytest.raises(ValueError):
+        sink.emit(make_trace('a.jpg'))
@@ -0,0 +1,117 @@
+from utils import batch, export, img, manifest
+import json
+import pytest
+
+
+DEFAULTS = batch.RenderOptions(offset=7, rgba=(1, 2, 3, 255))
+
+
+def test_row_options_defaults():
+    assert manifest.row_options({}, DEFAULTS) == DEFAULTS
+
+
+
+def test_row_options_values():
+    options = manifest.row_options({
+        'offset': '-30', 'color': '#ff0000', 'opacity': '50',
+        'logo_color': 'black', 'logo_shape': 'trapezoid', 'output': 'out/a.jpg',
+    }, DEFAULTS)
+    assert options.offset == -30
+    assert not options.auto_offset
+    assert options.rgba == (255, 0, 0, 127)
+    assert options.logo_color is img.LogoColor.BLACK
+    assert options.logo_shape is img.LogoShape.TRAPEZOID
+    assert options.export_options.format is export.OutputFormat.JPEG
+    assert options.output_policy == export.OutputPolicy('out', 'a')
+
+
+
+@pytest.mark.parametrize('rgba', [[10, 20, 30, 40], '10,20,30,40'])
+def test_row_options_rgba(rgba):
+    assert manifest.row_options({'rgba': rgba}, DEFAULTS).rgba == (10, 20, 30, 40)
+
+
+
+def test_row_options_auto_offset():
+    assert manifest.row_options({'offset': 'Auto'}, DEFAULTS).auto_offset
+    options = manifest.row_options({'offset': 0}, batch.RenderOptions(auto_offset=True))
+    assert not options.auto_offset
+
+
+
+@pytest.mark.parametrize('record', [
+    {'offset': 'x'},
+    {'offset': None},
+    {'color': '12345'},
+    {'opacity': 101},
+    {'rgba': '1,2,3'},
+    {'rgba': [0, 0, 0, 256]},
+    {'rgba': 'x'},
+    {'logo_color': 'red'},
+    {'output': 'a.gif'},
+])
+def test_row_options_invalid(record):
+    with pytest.raises((ValueError, TypeError)):
+        manifest.row_options(record, DEFAULTS)
+
+
+
+def test_read_manifest_reports_bad_rows(tmp_path):
+    path = tmp_path / 'm.jsonl'
+    path.write_text('\n'.join([
+        json.dumps({'input': 'a.jpg', 'offset': 'auto'}),
+        '# comment',
+        json.dumps({'input': 'b.jpg', 'offset': None}),
+        '[1, 2]',
+        json.dumps({'offset': 1}),
+        'not json',
+    ]), encoding='utf-8')
+    rows = list(manifest.read_manifest(str(path), DEFAULTS))
+    assert [row.index for row in rows] == [0, 1, 2, 3, 4]
+    assert rows[0].error is None and rows[0].path == str(tmp_path / 'a.jpg')
+    assert rows[0].options.auto_offset
+    assert all(row.error is not None for row in rows[1:])
+
+
+
+def test_read_manifest_csv(tmp_path):
+    path = tmp_path / 'm.csv'
+    path.write_text('input,offset,logo_color\na.jpg,12,\nb.jpg,,black\n', encoding='utf-8')
+    rows = list(manifest.read_manifest(str(path), DEFAULTS))
+    assert [row.options.offset for row in rows] == [12, 7]
+    assert rows[1].options.logo_color is img.LogoColor.BLACK
+
+
+
+def result(error: str | None = None) -> batch.JobResult:
+    return batch.JobResult('a.jpg', 0.0, error)
+
+
+
+def test_result_log_resume(tmp_path):
+    path = str(tmp_path / 'results.jsonl')
+    with manifest.ResultLog(path) as log:
+        log.write(0, result())
+        log.write(2, result())
+        log.write(1, result('NG'))
+        log.write(4, result())
+    with open(path, 'a', encoding='utf-8') as f:
+        # 中断で書きかけになった行
+        f.write('{"row": 5, "err')
+
+    with manifest.ResultLog(path, resume=True) as log:
+        assert [log.is_done(i) for i in range(6)] == [True, False, True, False, True, False]
+        log.write(1, result())
+    with manifest.ResultLog(path, resume=True) as log:
+        assert [log.is_done(i) for i in range(6)] == [True, True, True, False, True, False]
+
+
+
+def test_result_log_memory_stays_flat_after_failures(tmp_path):
+    with manifest.ResultLog(str(tmp_path / 'results.jsonl')) as log:
+        log.write(0, result('NG'))
+        for i in range(1, 1000):
+            log.write(i, result())
+        assert log.written_below == 1000
+        assert len(log._ResultLog__written) == 0
+        assert not log.is_done(0) and log.is_done(999)
@@ -0,0 +1,14 @@
+from utils import img, misc
+import os
+
+
+def test_rgb():
+    assert misc.rgb('006E4F') == (0, 110, 79)
+    assert misc.rgb('') == (0, 0, 0)
+
+
+
+def test_assets_do_not_depend_on_cwd(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for color in img.LogoColor:
+        assert os.path.isfile(img.logo_path(color))
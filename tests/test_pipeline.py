@@ -0,0 +1,74 @@
+from PIL import Image
+from utils import batch, pipeline
+import pathlib
+import pytest
+import threading
+
+
+def make_sources(directory: pathlib.Path, count: int) -> list[str]:
+    paths = []
+    for i in range(count):
+        path = directory / f'{i:02d}.png'
+        Image.new('RGB', (192, 108), (i * 20 % 256, 80, 160)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+
+def run(paths: list[str], threads: tuple[int, int, int]) -> tuple:
+    """パイプラインを実行して，(処理結果, 統計, 終わった順のパス) を返す"""
+    done = []
+    summary, stats = pipeline.run_pipeline(
+        paths, batch.RenderOptions(), threads,
+        lambda n, total, path, error: done.append(path)
+    )
+    return summary, stats, done
+
+
+
+def pipeline_threads() -> list[threading.Thread]:
+    names = {f'thumbgen-{name}' for name in ('feed', 'decode', 'compose', 'encode')}
+    return [t for t in threading.enumerate() if t.name in names]
+
+
+
+def test_single_threads_keep_input_order(tmp_path):
+    paths = make_sources(tmp_path, 6)
+    summary, stats, done = run(paths, (1, 1, 1))
+    assert done == paths
+    assert summary.succeeded == 6
+    assert [stage.items for stage in stats.stages] == [6, 6, 6]
+    for path in paths:
+        assert pathlib.Path(path).with_name(pathlib.Path(path).stem + '_thumbnail.png').is_file()
+
+
+
+def test_errors_skip_later_stages(tmp_path):
+    paths = make_sources(tmp_path, 4)
+    broken = tmp_path / 'broken.png'
+    broken.write_bytes(b'not an image')
+    paths.insert(2, str(broken))
+    paths.append(str(tmp_path / 'missing.png'))
+
+    summary, stats, done = run(paths, (2, 1, 2))
+    assert sorted(done) == sorted(paths)
+    assert summary.succeeded == 4
+    assert sorted(path for path, _ in summary.failed) == [str(broken), str(tmp_path / 'missing.png')]
+    assert all(error for _, error in summary.failed)
+    # デコードで失敗したジョブは，合成とエンコードでは処理せずに (数えずに) 最後まで流れる
+    assert [stage.items for stage in stats.stages] == [6, 4, 4]
+
+
+
+@pytest.mark.parametrize('count, threads', [(0, (3, 2, 4)), (1, (4, 3, 5)), (7, (3, 2, 4))])
+def test_stop_reaches_every_thread(tmp_path, count, threads):
+    paths = make_sources(tmp_path, count)
+    result = []
+    runner = threading.Thread(target=lambda: result.append(run(paths, threads)))
+    runner.start()
+    runner.join(timeout=30)
+    assert not runner.is_alive()
+    summary, _, done = result[0]
+    assert summary.succeeded == count
+    assert len(done) == count
+    assert pipeline_threads() == []
@@ -0,0 +1,43 @@
+from utils import render_cache
+import os
+
+
+def test_store_and_fetch(tmp_path):
+    cache = render_cache.RenderCache(str(tmp_path / 'cache'))
+    output = tmp_path / 'a.png'
+    output.write_bytes(b'x' * 10)
+    cache.store('ab' * 32, '.png', str(output))
+    dest = tmp_path / 'out' / 'b.png'
+    assert cache.fetch('ab' * 32, '.png', str(dest))
+    assert dest.read_bytes() == b'x' * 10
+    assert not cache.fetch('cd' * 32, '.png', str(tmp_path / 'c.png'))
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+
+def test_store_same_key_replaces_size(tmp_path):
+    cache = render_cache.RenderCache(str(tmp_path / 'cache'))
+    output = tmp_path / 'a.png'
+    output.write_bytes(b'x' * 10)
+    for _ in range(3):
+        cache.store('ab' * 32, '.png', str(output))
+    assert cache.stats()['bytes'] == 10
+    # 中身が変わった場合は新しいサイズになる
+    other = tmp_path / 'b.png'
+    other.write_bytes(b'y' * 25)
+    cache.store('ab' * 32, '.png', str(other))
+    assert cache.stats()['bytes'] == 25
+
+
+
+def test_evict_oldest_first(tmp_path):
+    cache = render_cache.RenderCache(str(tmp_path / 'cache'), max_bytes=25)
+    for i, key in enumerate(('aa', 'bb', 'cc')):
+        output = tmp_path / f'{key}.png'
+        output.write_bytes(b'x' * 10)
+        cache.store(key * 32, '.png', str(output))
+        cached = tmp_path / 'cache' / key / f'{key * 32}.png'
+        os.utime(cached, (i, i))
+    cache.evict()
+    assert cache.stats()['bytes'] == 20
+    assert not (tmp_path / 'cache' / 'aa' / f'{"aa" * 32}.png').exists()
@@ -0,0 +1,92 @@
+from utils import export, img, service
+import pytest
+import socket
+import threading
+
+
+def test_parse_request_defaults():
+    defaults = service.RenderRequest(offset=10)
+    assert service.parse_request({}, defaults) == defaults
+
+
+def test_parse_request_values():
+    request = service.parse_request({
+        'offset': ['-40'], 'color': ['#ff0000'], 'opacity': ['50'],
+        'logo_color': ['black'], 'logo_shape': ['trapezoid'],
+        'width': ['640'], 'height': ['360'], 'format': ['jpg'], 'quality': ['70'],
+    }, service.RenderRequest())
+    assert request.offset == -40
+    assert not request.auto_offset
+    assert request.rgba == (255, 0, 0, 127)
+    assert request.logo_color is img.LogoColor.BLACK
+    assert request.logo_shape is img.LogoShape.TRAPEZOID
+    assert request.size == (640, 360)
+    assert request.export_options.format is export.OutputFormat.JPEG
+    assert request.export_options.jpeg_quality == 70
+
+
+@pytest.mark.parametrize('name', ['jpg', 'jpeg', 'JPEG'])
+def test_parse_request_jpeg_alias(name):
+    request = service.parse_request({'format': [name]}, service.RenderRequest())
+    assert request.export_options.format is export.OutputFormat.JPEG
+
+
+def test_parse_request_auto_offset():
+    request = service.parse_request({'offset': ['auto']}, service.RenderRequest(offset=5))
+    assert request.auto_offset
+    # 整数を指定すれば既定の自動を上書きできる
+    request = service.parse_request({'offset': ['0']}, service.RenderRequest(auto_offset=True))
+    assert not request.auto_offset
+
+
+@pytest.mark.parametrize('query', [
+    {'offset': ['x']},
+    {'color': ['12345']},
+    {'opacity': ['101']},
+    {'logo_color': ['red']},
+    {'width': ['0']},
+    {'height': ['9000']},
+    {'format': ['gif']},
+    {'quality': ['-1']},
+])
+def test_parse_request_invalid(query):
+    with pytest.raises(ValueError):
+        service.parse_request(query, service.RenderRequest())
+
+
+
+@pytest.fixture
+def running_service():
+    # ワーカープロセスは起動せず，HTTPの受け付けだけを確かめる
+    render_service = service.RenderService(port=0, workers=1, max_queue=1, max_body=1024)
+    thread = threading.Thread(target=render_service.server.serve_forever, daemon=True)
+    thread.start()
+    yield render_service
+    render_service.shutdown()
+    render_service.server.server_close()
+
+
+
+def post(address: tuple[str, int], headers: bytes) -> bytes:
+    """本文を送らずにPOSTして，応答の先頭を受け取る"""
+    with socket.create_connection(address, timeout=5) as conn:
+        conn.sendall(b'POST /render HTTP/1.1\r\nHost: test\r\n' + headers + b'\r\n')
+        return conn.recv(1024)
+
+
+
+@pytest.mark.parametrize('headers, status', [
+    (b'', b'411'),
+    (b'Content-Length: -1\r\n', b'400'),
+    (b'Content-Length: 4096\r\n', b'413'),
+])
+def test_post_rejects_bad_length(running_service, headers, status):
+    assert post(running_service.address, headers).split()[1] == status
+
+
+
+def test_post_overloaded_without_reading_body(running_service):
+    running_service.metrics.in_flight = running_service.max_queue
+    # 本文を読むなら送られるまで待つので，すぐに503が返ることを確かめる
+    assert post(running_service.address, b'Content-Length: 100\r\n').split()[1] == b'503'
+    assert running_service.metrics.in_flight == running_service.max_queue
@@ -0,0 +1,57 @@
+from utils import startup
+import builtins
+import sys
+
+
+def forget(name: str):
+    sys.modules.pop(name, None)
+
+
+
+def test_finish_restores_import(capsys):
+    original = builtins.__import__
+    forget('colorsys')
+    report = startup.StartupReport(enabled=True)
+    try:
+        assert builtins.__import__ is not original
+        import colorsys  # noqa: F401
+        report.finish()
+        assert builtins.__import__ is original
+    finally:
+        builtins.__import__ = original
+    assert any(name == 'colorsys' for name, _, _ in report.imports)
+    assert '起動時間' in capsys.readouterr().out
+
+
+
+def test_finish_keeps_later_wrapper(capsys):
+    original = builtins.__import__
+    report = startup.StartupReport(enabled=True)
+    calls = []
+
+    def wrapper(*args, **kwargs):
+        calls.append(args[0])
+        return report_import(*args, **kwargs)
+
+    report_import = builtins.__import__
+    builtins.__import__ = wrapper
+    try:
+        report.finish()
+        # 後から置き換えたものは外さない (計測はせずに素通りする)
+        assert builtins.__import__ is wrapper
+        forget('colorsys')
+        import colorsys  # noqa: F401
+        assert calls and not any(name == 'colorsys' for name, _, _ in report.imports)
+    finally:
+        builtins.__import__ = original
+    capsys.readouterr()
+
+
+
+def test_disabled_report_does_not_patch():
+    original = builtins.__import__
+    report = startup.StartupReport()
+    assert builtins.__import__ is original
+    report.finish()
+    assert builtins.__import__ is original
+    assert [label for label, _ in report.marks] == ['first paint']
@@ -0,0 +1,65 @@
+from PIL import Image
+from utils import img, variants
+import pytest
+
+
+def test_variant_grid_covers_every_combination():
+    palette = ((0, 110, 79, 255), (255, 0, 0, 128))
+    grid = variants.variant_grid(palette=palette)
+    assert len(grid) == len(palette) * len(img.LogoShape) * len(img.LogoColor)
+    assert len(set(grid)) == len(grid)
+    # 長方形の色，形，ロゴの色の順に並ぶ
+    first = list(img.LogoShape)[0]
+    assert grid[:len(img.LogoColor)] == [
+        variants.Variant(first, color, palette[0]) for color in img.LogoColor
+    ]
+    assert {v.rgba for v in grid[len(grid) // 2:]} == {palette[1]}
+
+
+
+def test_variant_grid_with_subset():
+    grid = variants.variant_grid((img.LogoShape.BANNER,), (img.LogoColor.WHITE,), ([1, 2, 3, 4],))
+    assert grid == [variants.Variant(img.LogoShape.BANNER, img.LogoColor.WHITE, (1, 2, 3, 4))]
+    assert grid[0].label == 'banner / white / #01020304'
+
+
+
+@pytest.mark.parametrize('count, columns, grid', [
+    (1, None, (1, 1)),
+    (4, None, (2, 2)),
+    (5, None, (3, 2)),
+    (5, 2, (2, 3)),
+    (3, 10, (10, 1)),
+])
+def test_contact_sheet_layout(count, columns, grid):
+    images = [Image.new('RGB', (160, 90), (i * 40, 0, 0)) for i in range(count)]
+    sheet = variants.contact_sheet(images, columns=columns, cell_width=80)
+    cell_w, cell_h = 80, 45
+    margin = variants.SHEET_MARGIN
+    assert sheet.mode == 'RGB'
+    assert sheet.size == (
+        grid[0] * (cell_w + margin) + margin, grid[1] * (cell_h + margin) + margin
+    )
+    # 左上から順に並ぶ
+    for i in range(count):
+        x = margin + (i % grid[0]) * (cell_w + margin)
+        y = margin + (i // grid[0]) * (cell_h + margin)
+        assert sheet.getpixel((x + cell_w // 2, y + cell_h // 2)) == (i * 40, 0, 0)
+
+
+
+def test_contact_sheet_labels_add_a_strip():
+    images = [Image.new('RGB', (160, 90))] * 2
+    plain = variants.contact_sheet(images, columns=2, cell_width=80)
+    labeled = variants.contact_sheet(images, ['a', 'b'], columns=2, cell_width=80)
+    assert labeled.width == plain.width
+    assert labeled.height == plain.height + variants.SHEET_LABEL_H
+    # 説明の帯に文字が書かれている
+    strip = labeled.crop((0, variants.SHEET_MARGIN + 45, labeled.width, labeled.height))
+    assert strip.convert('L').getextrema()[0] < 255
+
+
+
+def test_contact_sheet_rejects_empty():
+    with pytest.raises(ValueError):
+        variants.contact_sheet([])
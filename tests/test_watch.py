@@ -0,0 +1,69 @@
+from utils import batch, watch
+import json
+import os
+import pytest
+
+
+def test_polling_watcher_reports_added_changed_and_removed(tmp_path):
+    kept = tmp_path / 'kept.jpg'
+    removed = tmp_path / 'removed.jpg'
+    kept.write_bytes(b'a')
+    removed.write_bytes(b'a')
+    watcher = watch.PollingWatcher([str(tmp_path)], interval=0.0)
+    assert watcher.changes(0.0) == set()
+
+    kept.write_bytes(b'ab')
+    removed.unlink()
+    (tmp_path / 'added.jpg').write_bytes(b'a')
+    assert watcher.changes(0.0) == {
+        str(kept), str(removed), str(tmp_path / 'added.jpg')
+    }
+    assert watcher.changes(0.0) == set()
+
+
+
+def test_debouncer_waits_until_settled(tmp_path):
+    path = tmp_path / 'a.jpg'
+    path.write_bytes(b'a')
+    debouncer = watch.Debouncer(settle=0.0)
+    debouncer.touch(str(path))
+    assert debouncer.ready() == [str(path)]
+    assert len(debouncer) == 0
+
+    debouncer.touch(str(path))
+    path.unlink()
+    assert debouncer.ready() == []
+    assert len(debouncer) == 0
+
+
+
+def write_style(directory, record) -> str:
+    path = os.path.join(directory, watch.STYLE_FILE)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(record, f)
+    return path
+
+
+
+def test_load_style(tmp_path):
+    path = write_style(tmp_path, {'offset': 'auto', 'color': 'ff0000'})
+    options = watch.load_style(path, batch.RenderOptions())
+    assert options.auto_offset
+    assert options.rgba == (255, 0, 0, 255)
+
+
+
+@pytest.mark.parametrize('record', [
+    {'offset': None},
+    {'offset': 'x'},
+    {'rgba': 'x'},
+    {'rgba': 5},
+    {'output': 'a.png'},
+    ['offset', 10],
+])
+def test_invalid_style_is_reported(tmp_path, record):
+    write_style(tmp_path, record)
+    folder = watch.FolderWatcher([str(tmp_path)], batch.RenderOptions())
+    options = folder.options_for(str(tmp_path / 'a.jpg'))
+    assert isinstance(options, str)
+    assert watch.STYLE_FILE in options
@@ -5,12 +5,17 @@ a = Analysis(
     ['src/main.py'],
     pathex=[],
     binaries=[],
-    datas=[('img/*', 'img')],
+    # one-fileでは起動のたびに展開されるので，実行時に使う画像だけを同梱する
+    datas=[
+        ('img/logo_black.png', 'img'),
+        ('img/logo_white.png', 'img'),
+        ('img/placeholder.jpg', 'img'),
+    ],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=['tkinter'],
     noarchive=False,
     optimize=0,
 )
@@ -26,7 +31,7 @@ exe = EXE(
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    upx=False,  # 圧縮したQtのライブラリは読み込むたびに展開されて起動が遅くなる
     upx_exclude=[],
     runtime_tmpdir=None,
     console=False,